@@ -1,7 +1,10 @@
-# Entry point for Railway
-import os
-import uvicorn
+# Entry point for Railway, and the command line:
+#   python backend                    API server
+#   python backend run DIR... [opts]  headless batch run (see --help)
+#   python backend trace|inspect ...  trace files
+import sys
 
-if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
+from cli import main
 
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:] or ["serve"]))
@@ -0,0 +1,101 @@
+# Content-addressed cache of assembly results
+# Vishanth Dandu
+
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Tuple
+
+from assembler import Assembler
+
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+# Exact-source aliases kept for skipping normalization on repeat requests
+MAX_ALIASES = 8192
+
+
+class CachedAssembly(NamedTuple):
+    binary: Tuple[int, ...]
+    errors: Tuple[str, ...]
+    labels: Dict[str, int]
+    size: int
+
+
+def normalize_source(source: str) -> str:
+    # Drop comments, surrounding whitespace and blank lines; assemble() does
+    # the same before looking at a line, so the result is unchanged
+    lines = []
+    for line in source.split('\n'):
+        line = line.partition(';')[0].strip()
+        if line:
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+def _entry_size(binary: List[int], errors: List[str], labels: Dict[str, int]) -> int:
+    # Rough in-memory footprint, used for the byte budget
+    return (200 + 36 * len(binary) + sum(60 + len(e) for e in errors)
+            + sum(100 + len(name) for name in labels))
+
+
+class AssemblyCache:
+    # LRU of assemble() results bounded by an estimated byte size.
+    #
+    # Entries are keyed by a hash of the normalized source, so sources that
+    # only differ in comments or layout share one. The hash of the exact
+    # source is remembered as an alias, making a repeat request one hash
+    # and two dict lookups.
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[bytes, CachedAssembly]' = OrderedDict()
+        self._aliases: 'OrderedDict[bytes, bytes]' = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self._aliases.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                'bytes': self.size, 'max_bytes': self.max_bytes}
+
+    def assemble(self, source: str) -> CachedAssembly:
+        raw_key = _digest(source)
+        key = self._aliases.get(raw_key)
+        entry = self._entries.get(key) if key is not None else None
+        if entry is None:
+            key = _digest(normalize_source(source))
+            entry = self._entries.get(key)
+            self._alias(raw_key, key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        assembler = Assembler()
+        binary, errors = assembler.assemble(source)
+        entry = CachedAssembly(tuple(binary), tuple(errors), assembler.labels,
+                               _entry_size(binary, errors, assembler.labels))
+        if entry.size <= self.max_bytes:
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+        return entry
+
+    def _alias(self, raw_key: bytes, key: bytes):
+        self._aliases[raw_key] = key
+        self._aliases.move_to_end(raw_key)
+        if len(self._aliases) > MAX_ALIASES:
+            self._aliases.popitem(last=False)
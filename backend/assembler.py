@@ -4,6 +4,8 @@
 import re
 from typing import List, Tuple, Dict, Optional
 
+from image import SECTION_CODE, SECTION_DATA, ProgramImage, Section
+
 
 class AssemblerError(Exception):
     def __init__(self, message: str, line: int = 0):
@@ -12,6 +14,39 @@ class AssemblerError(Exception):
         super().__init__(f"Line {line}: {message}")
 
 
+# Operands are maximal runs of anything but commas and whitespace
+_TOKEN = re.compile(r'[^,\s]+')
+
+# Operand format per mnemonic: N none, R three registers, I register,
+# register, immediate, M register, base, offset, J label or offset
+_FORMATS = {
+    'NOP': 'N', 'HALT': 'N',
+    'ADD': 'R', 'SUB': 'R', 'AND': 'R', 'OR': 'R',
+    'ADDI': 'I',
+    'LOAD': 'M', 'STORE': 'M',
+    'JMP': 'J', 'BRZ': 'J',
+}
+
+_BRANCHES = ('JMP', 'BRZ')
+
+# Operand count each format checks for (N ignores extra operands)
+_OPERANDS = {'R': 3, 'I': 3, 'M': 3, 'J': 1}
+
+# Register and decimal immediate spellings that need no parsing; anything
+# else goes through parse_register/parse_immediate for their exact errors
+_REGISTERS = {f'{prefix}{n}': n for prefix in 'Rr' for n in range(8)}
+_IMMEDIATES = {str(n): n for n in range(-512, 512)}
+
+
+# Section directives for assemble_image()
+_SECTION_DIRECTIVES = {'.TEXT': SECTION_CODE, '.DATA': SECTION_DATA}
+
+
+def tokenize(line: str) -> List[str]:
+    # Mnemonic and operands of an instruction line
+    return _TOKEN.findall(line)
+
+
 class Assembler:
     OPCODES = {
         'NOP': 0x0,
@@ -66,18 +101,19 @@ class Assembler:
     def preprocess(self, source: str) -> List[Tuple[int, str, Optional[str]]]:
         lines = []
         current_address = 0
+        labels = self.labels
         
-        for line_num, line in enumerate(source.split('\n'), 1):
-            line = line.split(';')[0].strip()
+        for line in source.split('\n'):
+            line = line.partition(';')[0].strip()
             if not line:
                 continue
             
             label = None
             if ':' in line:
-                parts = line.split(':', 1)
-                label = parts[0].strip()
-                line = parts[1].strip()
-                self.labels[label] = current_address
+                label, _, line = line.partition(':')
+                label = label.strip()
+                line = line.strip()
+                labels[label] = current_address
             
             if line:
                 lines.append((current_address, line, label))
@@ -86,79 +122,60 @@ class Assembler:
         return lines
     
     def assemble_instruction(self, line: str, current_pc: int) -> int:
-        parts = [p.strip() for p in re.split(r'[,\s]+', line) if p.strip()]
+        parts = tokenize(line)
         if not parts:
             raise AssemblerError("Empty instruction", 0)
         
         mnemonic = parts[0].upper()
-        
-        if mnemonic not in self.OPCODES:
+        fmt = _FORMATS.get(mnemonic)
+        if fmt is None:
             raise AssemblerError(f"Unknown instruction: {mnemonic}", 0)
         
         opcode = self.OPCODES[mnemonic]
-        
-        if mnemonic in ['NOP', 'HALT']:
+        if fmt == 'N':
             return opcode << 12
         
-        if mnemonic in ['ADD', 'SUB', 'AND', 'OR']:
-            if len(parts) != 4:
-                raise AssemblerError(f"{mnemonic} requires 3 operands", 0)
-            rd = self.parse_register(parts[1])
-            rs1 = self.parse_register(parts[2])
-            rs2 = self.parse_register(parts[3])
-            return self.encode_r_type(opcode, rd, rs1, rs2)
-        
-        # I-type: ADDI
-        if mnemonic == 'ADDI':
-            if len(parts) != 4:
-                raise AssemblerError("ADDI requires 3 operands", 0)
-            rd = self.parse_register(parts[1])
-            rs = self.parse_register(parts[2])
-            imm = self.parse_immediate(parts[3])
-            if imm < -32 or imm > 31:
-                raise AssemblerError(f"Immediate out of range: {imm} (must be -32 to 31)", 0)
-            # Convert to unsigned 6-bit with sign extension
-            imm_unsigned = imm & 0x3F
-            return self.encode_i_type(opcode, rd, rs, imm_unsigned)
-        
-        # M-type: LOAD, STORE
-        if mnemonic in ['LOAD', 'STORE']:
-            if len(parts) != 4:
-                raise AssemblerError(f"{mnemonic} requires 3 operands", 0)
-            rd = self.parse_register(parts[1])
-            base = self.parse_register(parts[2])
-            offset = self.parse_immediate(parts[3])
-            if offset < -32 or offset > 31:
-                raise AssemblerError(f"Offset out of range: {offset} (must be -32 to 31)", 0)
-            # Convert to unsigned 6-bit with sign extension
-            offset_unsigned = offset & 0x3F
-            return self.encode_m_type(opcode, rd, base, offset_unsigned)
+        operands = _OPERANDS[fmt]
+        if len(parts) != operands + 1:
+            plural = 's' if operands > 1 else ''
+            raise AssemblerError(f"{mnemonic} requires {operands} operand{plural}", 0)
         
-        # J-type: JMP, BRZ
-        if mnemonic in ['JMP', 'BRZ']:
-            if len(parts) != 2:
-                raise AssemblerError(f"{mnemonic} requires 1 operand", 0)
-            
+        if fmt == 'J':
             target = parts[1]
-            offset = 0
-            
             if target in self.labels:
-                target_addr = self.labels[target]
-                offset = target_addr - current_pc
+                offset = self.labels[target] - current_pc
             else:
-                try:
-                    offset = self.parse_immediate(target)
-                except ValueError:
-                    raise AssemblerError(f"Unknown label or invalid offset: {target}", 0)
-            
+                offset = _IMMEDIATES.get(target)
+                if offset is None:
+                    try:
+                        offset = self.parse_immediate(target)
+                    except ValueError:
+                        raise AssemblerError(f"Unknown label or invalid offset: {target}", 0)
             if offset < -512 or offset > 511:
                 raise AssemblerError(f"Jump offset out of range: {offset} (must be -512 to 511)", 0)
-            
-            offset_unsigned = offset & 0x3FF
-            cond = 0 if mnemonic == 'JMP' else 0
-            return self.encode_j_type(opcode, cond, offset_unsigned)
+            return self.encode_j_type(opcode, 0, offset)
+        
+        rd = _REGISTERS.get(parts[1])
+        if rd is None:
+            rd = self.parse_register(parts[1])
+        rs = _REGISTERS.get(parts[2])
+        if rs is None:
+            rs = self.parse_register(parts[2])
+        
+        if fmt == 'R':
+            rt = _REGISTERS.get(parts[3])
+            if rt is None:
+                rt = self.parse_register(parts[3])
+            return self.encode_r_type(opcode, rd, rs, rt)
         
-        raise AssemblerError(f"Unhandled instruction: {mnemonic}", 0)
+        # I-type ADDI and M-type LOAD/STORE share the 6-bit signed field
+        imm = _IMMEDIATES.get(parts[3])
+        if imm is None:
+            imm = self.parse_immediate(parts[3])
+        if imm < -32 or imm > 31:
+            kind = "Immediate" if fmt == 'I' else "Offset"
+            raise AssemblerError(f"{kind} out of range: {imm} (must be -32 to 31)", 0)
+        return (opcode << 12) | (rd << 9) | (rs << 6) | (imm & 0x3F)
     
     def assemble(self, source: str) -> Tuple[List[int], List[str]]:
         self.labels = {}
@@ -169,16 +186,134 @@ class Assembler:
             # First pass: collect labels
             preprocessed = self.preprocess(source)
             
-            # Second pass: assemble instructions
+            # Second pass: assemble instructions. Only branches depend on
+            # their address, so every other repeated line is encoded once.
+            encoded: Dict[str, int] = {}
             for address, line, label in preprocessed:
-                try:
-                    instruction = self.assemble_instruction(line, address)
-                    binary.append(instruction)
-                except (AssemblerError, ValueError) as e:
-                    errors.append(str(e))
+                instruction = encoded.get(line)
+                if instruction is None:
+                    try:
+                        instruction = self.assemble_instruction(line, address)
+                    except (AssemblerError, ValueError) as e:
+                        errors.append(str(e))
+                        continue
+                    if line[:3].upper() not in _BRANCHES:
+                        encoded[line] = instruction
+                binary.append(instruction)
             
         except Exception as e:
             errors.append(f"Assembly error: {str(e)}")
         
         return binary, errors
-
+    
+    def parse_word(self, text: str) -> int:
+        # .word operand: a label address or a 16-bit value
+        if text in self.labels:
+            return self.labels[text]
+        value = _IMMEDIATES.get(text)
+        if value is None:
+            value = self.parse_immediate(text)
+        if value < -0x8000 or value > 0xFFFF:
+            raise ValueError(f"Word out of range: {text}")
+        return value & 0xFFFF
+    
+    def assemble_image(self, source: str, code_address: int = 0) -> Tuple[Optional[ProgramImage], List[str]]:
+        # Assemble into a ProgramImage. Besides instructions the source may use
+        #   .text [ADDR]   code from here (at ADDR, default after the last code)
+        #   .data [ADDR]   data from here (at ADDR, default after the last section)
+        #   .org ADDR      continue the current kind of section at ADDR
+        #   .word V, ...   literal 16-bit words, values or labels
+        # Labels are absolute addresses and all become symbols; the entry is
+        # the start of the first code section. Errors give the source line.
+        self.labels = {}
+        errors = []
+        # kind, address, [(address, line number, instruction or .word operands)]
+        sections: List[Tuple[int, int, list]] = []
+        ends = {SECTION_CODE: code_address, SECTION_DATA: None}
+        kind = SECTION_CODE
+        items = None
+        address = code_address
+        
+        def start(new_kind: int, new_address: int):
+            nonlocal kind, items, address
+            kind, address = new_kind, new_address
+            items = []
+            sections.append((kind, address, items))
+        
+        for number, line in enumerate(source.split('\n'), 1):
+            line = line.partition(';')[0].strip()
+            if not line:
+                continue
+            if ':' in line:
+                label, _, line = line.partition(':')
+                self.labels[label.strip()] = address
+                line = line.strip()
+                if not line:
+                    continue
+            
+            parts = tokenize(line)
+            directive = parts[0].upper()
+            try:
+                if directive in _SECTION_DIRECTIVES or directive == '.ORG':
+                    if directive == '.ORG' and len(parts) != 2:
+                        raise ValueError(".org requires an address")
+                    if len(parts) > 2:
+                        raise ValueError(f"{parts[0]} takes at most one address")
+                    if items is not None:
+                        ends[kind] = address
+                    new_kind = _SECTION_DIRECTIVES.get(directive, kind)
+                    if len(parts) == 2:
+                        new_address = self.parse_immediate(parts[1])
+                    elif ends[new_kind] is not None:
+                        new_address = ends[new_kind]
+                    else:
+                        new_address = max(ends[SECTION_CODE], address)
+                    if not 0 <= new_address < 0x10000 or new_address % 2:
+                        raise ValueError(f"Invalid section address: {new_address:#x}")
+                    start(new_kind, new_address)
+                    continue
+                if items is None:
+                    start(SECTION_CODE, code_address)
+                if directive == '.WORD':
+                    if len(parts) < 2:
+                        raise ValueError(".word requires a value")
+                    items.append((address, number, parts[1:]))
+                    address += 2 * (len(parts) - 1)
+                elif directive.startswith('.'):
+                    raise ValueError(f"Unknown directive: {parts[0]}")
+                else:
+                    items.append((address, number, line))
+                    address += 2
+            except ValueError as e:
+                errors.append(f"Line {number}: {e}")
+                continue
+            if address > 0x10000:
+                errors.append(f"Line {number}: Section at {sections[-1][1]:#06x} runs past the end of memory")
+                return None, errors
+        
+        image = ProgramImage(code_address, symbols=dict(self.labels))
+        entry = None
+        for section_kind, section_address, section_items in sections:
+            words = []
+            for item_address, number, item in section_items:
+                try:
+                    if isinstance(item, list):
+                        words.extend(self.parse_word(value) for value in item)
+                    else:
+                        words.append(self.assemble_instruction(item, item_address))
+                except AssemblerError as e:
+                    errors.append(f"Line {number}: {e.message}")
+                except ValueError as e:
+                    errors.append(f"Line {number}: {e}")
+            if not section_items:
+                continue
+            if section_kind == SECTION_CODE and entry is None:
+                entry = section_address
+            data = b''.join(word.to_bytes(2, 'little') for word in words)
+            image.sections.append(Section(section_kind, section_address, data))
+        if entry is not None:
+            image.entry = entry
+        
+        if errors:
+            return None, errors
+        return image, errors
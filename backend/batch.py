@@ -0,0 +1,202 @@
+# Batch execution of many independent programs on a process pool
+# Vishanth Dandu
+
+import asyncio
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+from assembler import Assembler
+from simulator import Simulator
+from tracebuf import TraceBuffer
+
+# Steps run between wall-clock checks inside a worker
+SLICE_STEPS = 20000
+DEFAULT_TIMEOUT = 10.0
+# Address-space limit for each worker process (bytes), None for no limit
+DEFAULT_MEMORY_LIMIT = 512 * 1024 * 1024
+
+
+@dataclass
+class BatchJob:
+    # One program to assemble (source) or load (binary) and run
+    id: str = ""
+    source: Optional[str] = None
+    binary: Optional[List[int]] = None
+    start_address: int = 0
+    registers: Optional[List[int]] = None
+    flags: Optional[Dict[str, bool]] = None
+    # start address -> byte values
+    memory: Dict[int, List[int]] = field(default_factory=dict)
+    max_steps: int = 10000
+    timeout: float = DEFAULT_TIMEOUT
+    # number of trailing trace lines to return, 0 for none
+    trace_last: int = 0
+
+
+# Warm per-worker instances, created by _init_worker
+_assembler: Optional[Assembler] = None
+_simulator: Optional[Simulator] = None
+
+
+def _init_worker(memory_limit: Optional[int]):
+    global _assembler, _simulator
+    if memory_limit:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ImportError, ValueError, OSError):
+            pass
+    _assembler = Assembler()
+    _simulator = Simulator()
+
+
+def run_job(job: BatchJob) -> dict:
+    # Execute one job in the current process and return its result record
+    global _assembler, _simulator
+    if _simulator is None:
+        _init_worker(None)
+    started = time.perf_counter()
+    result = {'id': job.id, 'status': 'error', 'errors': [], 'state': None, 'trace_log': []}
+
+    try:
+        if job.source is not None:
+            binary, errors = _assembler.assemble(job.source)
+            if errors:
+                result['errors'] = errors
+                return result
+        else:
+            binary = job.binary or []
+
+        simulator = _simulator
+        simulator.reset()
+        simulator.load_program(binary, job.start_address)
+        state = simulator.state
+        if job.registers is not None:
+            registers = [r & 0xFFFF for r in job.registers[:8]]
+            state.registers[:len(registers)] = registers
+        if job.flags is not None:
+            state.flags = job.flags
+        for addr, data in job.memory.items():
+            try:
+                simulator.write_memory(int(addr), bytes(data))
+            except ValueError as e:
+                result['errors'] = [f"Bad memory at {addr}: {e}"]
+                return result
+
+        # Run in slices so a runaway program is stopped at its deadline
+        deadline = started + job.timeout
+        buffer = TraceBuffer(job.trace_last) if job.trace_last > 0 else None
+        remaining = job.max_steps
+        status = 'max_steps'
+        while remaining > 0:
+            steps_before = state.instruction_count
+            simulator.execute(min(SLICE_STEPS, remaining), buffer)
+            remaining -= state.instruction_count - steps_before
+            if state.halted:
+                status = 'halted'
+                break
+            if time.perf_counter() > deadline:
+                status = 'timeout'
+                break
+        result['status'] = status
+        result['state'] = simulator.get_state_dict()
+        result['trace_log'] = buffer.lines() if buffer is not None else []
+    except MemoryError:
+        result['errors'] = ["Memory limit exceeded"]
+    except Exception as e:
+        result['errors'] = [f"{type(e).__name__}: {e}"]
+    finally:
+        result['elapsed'] = time.perf_counter() - started
+    return result
+
+
+def _worker_died(job: BatchJob) -> dict:
+    return {'id': job.id, 'status': 'error', 'errors': ["Worker process died"],
+            'state': None, 'trace_log': []}
+
+
+def run_jobs(jobs: List[BatchJob]) -> List[dict]:
+    return [run_job(job) for job in jobs]
+
+
+class BatchRunner:
+    # Fans jobs out to a process pool sized to the machine's cores. Workers
+    # keep their Assembler/Simulator between jobs.
+
+    def __init__(self, workers: Optional[int] = None,
+                 memory_limit: Optional[int] = DEFAULT_MEMORY_LIMIT):
+        self.workers = workers or os.cpu_count() or 1
+        self.memory_limit = memory_limit
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self.memory_limit,))
+        return self._pool
+
+    def submit(self, jobs: Iterable[BatchJob]) -> Dict[Future, BatchJob]:
+        return {self.pool.submit(run_job, job): job for job in jobs}
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        # A worker of pool died (e.g. killed for memory): the next submit
+        # starts a fresh pool. The broken one is shut down without waiting,
+        # so this is safe on the event loop, and a fresh pool another
+        # caller already swapped in is left alone.
+        if self._pool is pool:
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _collect(self, future: Future, job: BatchJob, pool: ProcessPoolExecutor) -> dict:
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            return _worker_died(job)
+
+    def run(self, jobs: Iterable[BatchJob], chunksize: int = 1) -> Iterator[dict]:
+        # Yield results in completion order. With chunksize > 1 each task
+        # carries that many jobs, which saves a round trip per job when
+        # there are many short programs.
+        pool = self.pool
+        if chunksize <= 1:
+            submitted = self.submit(jobs)
+            for future in as_completed(submitted):
+                yield self._collect(future, submitted[future], pool)
+            return
+        jobs = list(jobs)
+        chunks = {pool.submit(run_jobs, jobs[i:i + chunksize]): jobs[i:i + chunksize]
+                  for i in range(0, len(jobs), chunksize)}
+        for future in as_completed(chunks):
+            try:
+                yield from future.result()
+            except BrokenProcessPool:
+                self._discard_pool(pool)
+                for job in chunks[future]:
+                    yield _worker_died(job)
+
+    async def run_async(self, jobs: Iterable[BatchJob]) -> AsyncIterator[dict]:
+        # Same as run() without blocking the event loop
+        pool = self.pool
+        submitted = self.submit(jobs)
+        waiting = {asyncio.wrap_future(f): f for f in submitted}
+        while waiting:
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            for wrapped in done:
+                future = waiting.pop(wrapped)
+                yield self._collect(future, submitted[future], pool)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+def job_from_dict(data: dict) -> BatchJob:
+    known = set(BatchJob.__dataclass_fields__)
+    return BatchJob(**{k: v for k, v in data.items() if k in known})
@@ -0,0 +1,227 @@
+# Basic-block compiler - turns hot straight-line code into Python functions
+# Vishanth Dandu
+
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from dispatch import (ZN_FLAGS, decode_entry, disassemble, op_add, op_addi, op_and, op_brz,
+                      op_halt, op_jmp, op_load, op_or, op_store, op_sub)
+
+# Entries into an uncompiled block before it gets compiled
+HOT_THRESHOLD = 16
+# Longest block; longer straight-line runs are split
+MAX_BLOCK_LENGTH = 64
+# Compiled code is shared process-wide, keyed by (start, code bytes)
+MAX_SHARED_BLOCKS = 4096
+
+_TERMINATORS = (op_jmp, op_brz, op_halt)
+
+_shared: Dict[Tuple[int, bytes], 'CompiledBlock'] = {}
+
+
+class CompiledBlock:
+    # A basic block compiled to `fn(state, budget) -> instructions executed`.
+    # Registers live in locals and are written back when the block exits.
+    __slots__ = ('start', 'end', 'code', 'length', 'interior', 'fn', 'source')
+
+    def __init__(self, start: int, code: bytes, fn: Callable, source: str):
+        self.start = start
+        self.end = start + len(code)
+        self.code = code
+        self.length = len(code) // 2
+        # PCs inside the block where a breakpoint would stop the interpreter
+        self.interior: FrozenSet[int] = frozenset(range(start + 2, self.end, 2))
+        self.fn = fn
+        self.source = source
+
+
+def _scan(memory, start: int) -> List[Tuple[int, int]]:
+    # (pc, word) pairs from start through the first JMP/BRZ/HALT
+    words = []
+    pc = start
+    while 0 <= pc < 0xFFFF and len(words) < MAX_BLOCK_LENGTH:
+        word = memory[pc] | (memory[pc + 1] << 8)
+        words.append((pc, word))
+        pc += 2
+        if decode_entry(word)[0] in _TERMINATORS:
+            break
+    return words
+
+
+def _generate(start: int, words: List[Tuple[int, int]]) -> str:
+    # Emit Python source for the block
+    end = start + 2 * len(words)
+    entries = [decode_entry(word) for _, word in words]
+    read, written = set(), set()
+    uses_flags = False
+    # Only the last Z/N writer and the last ADD (for C) decide the exit
+    # flags. Blocks with a STORE can exit early, so they keep every update.
+    last_zn = last_carry = -1
+    has_store = any(entry[0] is op_store for entry in entries)
+    for i, (handler, a, b, c) in enumerate(entries):
+        if handler in (op_add, op_sub, op_and, op_or, op_addi):
+            last_zn = i
+            if handler is op_add:
+                last_carry = i
+        if handler in (op_add, op_sub, op_and, op_or):
+            read.update((b, c))
+            written.add(a)
+            uses_flags = True
+        elif handler is op_addi:
+            read.add(b)
+            written.add(a)
+            uses_flags = True
+        elif handler is op_load:
+            read.add(b)
+            written.add(a)
+        elif handler is op_store:
+            read.update((a, b))
+        elif handler is op_brz:
+            uses_flags = True
+
+    last_handler, _, offset, _ = entries[-1]
+    last_pc = words[-1][0]
+    target = (last_pc + offset) & 0xFFFF
+    # Blocks that branch back to their own start loop in place while the
+    # step budget lasts
+    self_loop = last_handler in (op_jmp, op_brz) and target == start
+
+    def exit_lines(pc_expr: str, count_expr: str, indent: str) -> List[str]:
+        lines = [f"{indent}regs[{r}] = r{r}" for r in sorted(written)]
+        if uses_flags:
+            lines.append(f"{indent}state.flag_bits = zn | c")
+        lines.append(f"{indent}state.pc = {pc_expr}")
+        lines.append(f"{indent}return {count_expr}")
+        return lines
+
+    src = ["def block(state, budget):",
+           "    regs = state.registers",
+           "    mem = state.memory"]
+    for r in sorted(read | written):
+        src.append(f"    r{r} = regs[{r}]")
+    if uses_flags:
+        src.append("    zn = state.flag_bits & 3")
+        src.append("    c = state.flag_bits & 4")
+    src.append("    n = 0")
+    indent = "    "
+    if self_loop:
+        src.append("    while True:")
+        indent = "        "
+
+    for i, ((pc, word), (handler, a, b, c)) in enumerate(zip(words, entries)):
+        src.append(f"{indent}# {pc:04X}: {disassemble(word).replace(' (not taken)', '')}")
+        live_zn = has_store or i == last_zn
+        if handler is op_add:
+            src.append(f"{indent}r{a} = (r{b} + r{c}) & 0xFFFF")
+            if has_store or i == last_carry:
+                src.append(f"{indent}c = 4 if r{a} < r{b} else 0")
+        elif handler is op_sub:
+            src.append(f"{indent}r{a} = (r{b} - r{c}) & 0xFFFF")
+        elif handler is op_and or handler is op_or:
+            symbol = '&' if handler is op_and else '|'
+            src.append(f"{indent}r{a} = r{b} {symbol} r{c}")
+        elif handler is op_addi:
+            src.append(f"{indent}r{a} = (r{b} + {c}) & 0xFFFF")
+        if live_zn and handler in (op_add, op_sub, op_and, op_or, op_addi):
+            src.append(f"{indent}zn = ZN[r{a}]")
+        if handler is op_load or handler is op_store:
+            if c == 0:
+                src.append(f"{indent}addr = r{b}")
+            else:
+                src.append(f"{indent}addr = (r{b} + {c}) & 0xFFFF")
+            src.append(f"{indent}if addr < 0xFFFF:")
+            if handler is op_load:
+                src.append(f"{indent}    r{a} = mem[addr] | (mem[addr + 1] << 8)")
+            else:
+                src.append(f"{indent}    mem[addr] = r{a} & 0xFF")
+                src.append(f"{indent}    mem[addr + 1] = (r{a} >> 8) & 0xFF")
+                # A store into this block's own code ends it early so the
+                # interpreter sees the new instructions
+                src.append(f"{indent}    if {start - 1} <= addr < {end}:")
+                src.extend(exit_lines(str(pc + 2), f"n + {i + 1}", indent + "        "))
+        elif handler is op_halt:
+            src.append(f"{indent}state.halted = True")
+        # NOP, JMP and BRZ only affect the exit PC
+
+    length = len(words)
+    if last_handler is op_jmp:
+        pc_expr = str(target)
+    elif last_handler is op_brz:
+        pc_expr = f"{target} if zn & 1 else {last_pc + 2}"
+    elif last_handler is op_halt:
+        pc_expr = str(last_pc)
+    else:
+        pc_expr = str(end)
+
+    if self_loop:
+        src.append(f"{indent}n += {length}")
+        cond = "" if last_handler is op_jmp else "zn & 1 and "
+        src.append(f"{indent}if {cond}n + {length} <= budget:")
+        src.append(f"{indent}    continue")
+        src.append(f"{indent}break")
+        src.extend(exit_lines(pc_expr, "n", "    "))
+    else:
+        src.extend(exit_lines(pc_expr, str(length), "    "))
+    return "\n".join(src) + "\n"
+
+
+def compile_block(memory, start: int) -> Optional[CompiledBlock]:
+    words = _scan(memory, start)
+    if not words:
+        return None
+    code = bytes(memory[start:start + 2 * len(words)])
+    key = (start, code)
+    block = _shared.get(key)
+    if block is None:
+        source = _generate(start, words)
+        namespace = {'ZN': ZN_FLAGS}
+        exec(compile(source, f"<block {start:04X}>", "exec"), namespace)
+        block = CompiledBlock(start, code, namespace['block'], source)
+        if len(_shared) >= MAX_SHARED_BLOCKS:
+            _shared.clear()
+        _shared[key] = block
+    return block
+
+
+class BlockCache:
+    # Per-simulator map of entry PC -> compiled block, plus entry counts for
+    # blocks that are not hot yet
+
+    def __init__(self, threshold: int = HOT_THRESHOLD):
+        self.threshold = threshold
+        self.blocks: Dict[int, CompiledBlock] = {}
+        self.heat: Dict[int, int] = {}
+
+    def clear(self):
+        self.blocks.clear()
+        self.heat.clear()
+
+    @property
+    def nbytes(self) -> int:
+        # Rough size: generated source and code bytes, with the compiled
+        # function counted at about the size of its source
+        return sum(2 * len(block.source) + len(block.code) for block in self.blocks.values())
+
+    def invalidate(self, start: int, end: int):
+        # Drop every block overlapping memory[start:end]
+        for pc, block in list(self.blocks.items()):
+            if block.start < end and start < block.end:
+                del self.blocks[pc]
+
+    def lookup(self, memory, pc: int) -> Optional[CompiledBlock]:
+        # Compiled block for pc if it is hot, None to keep interpreting.
+        # Blocks whose code bytes changed since compilation are dropped.
+        block = self.blocks.get(pc)
+        if block is not None:
+            if memory.startswith(block.code, block.start):
+                return block
+            del self.blocks[pc]
+            self.heat[pc] = 0
+        heat = self.heat.get(pc, 0) + 1
+        if heat < self.threshold:
+            self.heat[pc] = heat
+            return None
+        self.heat.pop(pc, None)
+        block = compile_block(memory, pc)
+        if block is not None:
+            self.blocks[pc] = block
+        return block
@@ -0,0 +1,274 @@
+# Command line: headless batch runs of .asm files, trace files, or the API server
+# Vishanth Dandu
+
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+from assembler import Assembler
+from batch import DEFAULT_MEMORY_LIMIT, DEFAULT_TIMEOUT, BatchJob, BatchRunner
+from simulator import Simulator, check_range
+from tracefile import DEFAULT_CHUNK_RECORDS, OPCODES, TraceReader, record_run
+
+# Per-program settings a fixture may give
+FIXTURE_FIELDS = ('start_address', 'registers', 'flags', 'memory', 'max_steps', 'timeout',
+                  'trace_last')
+
+DEFAULT_MAX_STEPS = 100000
+
+
+def find_programs(paths: List[str], pattern: str = '*.asm') -> Iterator[Tuple[str, str]]:
+    # (path, path relative to its argument) for files matching pattern
+    # under each path, in a stable order. File arguments are taken as
+    # they are.
+    for path in paths:
+        if os.path.isfile(path):
+            yield path, os.path.basename(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if fnmatch.fnmatch(name, pattern):
+                    found = os.path.join(root, name)
+                    yield found, os.path.relpath(found, path).replace(os.sep, '/')
+
+
+def _is_int(value, low: int, high: int) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+
+
+def load_fixture(data: dict, where: str = 'fixture') -> dict:
+    # Fixture fields with memory addresses parsed from JSON keys ("256",
+    # "0x100"). Raises ValueError, naming where, for a field of the wrong
+    # type or memory outside the address space.
+    if not isinstance(data, dict):
+        raise ValueError(f"{where}: fixture must be a JSON object")
+    fixture = {k: v for k, v in data.items() if k in FIXTURE_FIELDS}
+    if 'start_address' in fixture and not _is_int(fixture['start_address'], 0, 0xFFFF):
+        raise ValueError(f"{where}: start_address must be 0 to 0xFFFF")
+    registers = fixture.get('registers')
+    if registers is not None and not (isinstance(registers, list) and len(registers) <= 8
+                                      and all(_is_int(r, -0x8000, 0xFFFF) for r in registers)):
+        raise ValueError(f"{where}: registers must be a list of up to 8 16-bit integers")
+    flags = fixture.get('flags')
+    if flags is not None and not (isinstance(flags, dict)
+                                  and all(k in ('Z', 'N', 'C') and isinstance(v, bool)
+                                          for k, v in flags.items())):
+        raise ValueError(f"{where}: flags must map Z, N or C to true/false")
+    for name in ('max_steps', 'trace_last'):
+        if name in fixture and not _is_int(fixture[name], 0, sys.maxsize):
+            raise ValueError(f"{where}: {name} must be a non-negative integer")
+    if 'timeout' in fixture and not (isinstance(fixture['timeout'], (int, float))
+                                     and not isinstance(fixture['timeout'], bool)
+                                     and fixture['timeout'] >= 0):
+        raise ValueError(f"{where}: timeout must be a non-negative number")
+    if 'memory' in fixture:
+        if not isinstance(fixture['memory'], dict):
+            raise ValueError(f"{where}: memory must map addresses to byte lists")
+        memory = {}
+        for addr, values in fixture['memory'].items():
+            try:
+                start = int(str(addr), 0)
+            except ValueError:
+                raise ValueError(f"{where}: bad memory address {addr!r}")
+            if not (isinstance(values, list) and all(_is_int(v, 0, 0xFF) for v in values)):
+                raise ValueError(f"{where}: memory at {addr} must be a list of bytes")
+            try:
+                check_range(start, len(values))
+            except ValueError as e:
+                raise ValueError(f"{where}: {e}")
+            memory[start] = values
+        fixture['memory'] = memory
+    return fixture
+
+
+def fixture_for(path: str, relative: str, fixtures: Dict[str, dict]) -> dict:
+    # Every --fixtures pattern matching the relative path, in file order,
+    # then a sidecar <name>.json next to the program
+    fixture = {}
+    for pattern, data in fixtures.items():
+        if fnmatch.fnmatch(relative, pattern):
+            fixture.update(data)
+    sidecar = os.path.splitext(path)[0] + '.json'
+    if os.path.isfile(sidecar):
+        with open(sidecar) as f:
+            fixture.update(load_fixture(json.load(f), sidecar))
+    return fixture
+
+
+def make_jobs(paths: List[str], args, fixtures: Dict[str, dict]) -> List[BatchJob]:
+    jobs = []
+    for path, relative in find_programs(paths, args.pattern):
+        with open(path) as f:
+            source = f.read()
+        job = BatchJob(id=path, source=source, max_steps=args.max_steps, timeout=args.timeout,
+                       trace_last=args.trace_last)
+        for name, value in fixture_for(path, relative, fixtures).items():
+            setattr(job, name, value)
+        jobs.append(job)
+    return jobs
+
+
+def result_record(result: dict, memory: bool) -> dict:
+    # One JSON line: the batch result with the CPU state flattened
+    record = {'path': result['id'], 'status': result['status'], 'errors': result['errors']}
+    state = result.get('state')
+    if state is not None:
+        if not memory:
+            state = {k: v for k, v in state.items() if k != 'memory'}
+        record.update(state)
+    record['elapsed'] = result.get('elapsed', 0.0)
+    if result.get('trace_log'):
+        record['trace_log'] = result['trace_log']
+    return record
+
+
+def run_command(args, out: Optional[TextIO] = None) -> int:
+    out = out or sys.stdout
+    fixtures = {}
+    if args.fixtures:
+        with open(args.fixtures) as f:
+            patterns = json.load(f)
+        if not isinstance(patterns, dict):
+            raise ValueError(f"{args.fixtures}: must map path patterns to fixtures")
+        fixtures = {pattern: load_fixture(data, f"{args.fixtures}: {pattern}")
+                    for pattern, data in patterns.items()}
+    jobs = make_jobs(args.paths, args, fixtures)
+    runner = BatchRunner(args.workers, DEFAULT_MEMORY_LIMIT)
+    # Several programs per task once there are plenty to go round
+    chunksize = max(1, min(64, len(jobs) // (runner.workers * 8)))
+
+    started = time.perf_counter()
+    statuses: Dict[str, int] = {}
+    try:
+        for result in runner.run(jobs, chunksize):
+            statuses[result['status']] = statuses.get(result['status'], 0) + 1
+            out.write(json.dumps(result_record(result, args.memory)) + '\n')
+            out.flush()
+    finally:
+        runner.shutdown()
+    elapsed = time.perf_counter() - started
+
+    if not args.quiet:
+        counts = ', '.join(f"{status}={count}" for status, count in sorted(statuses.items()))
+        print(f"{len(jobs)} programs in {elapsed:.2f}s with {runner.workers} workers"
+              f" ({len(jobs) / elapsed if elapsed else 0:,.0f}/s): {counts}", file=sys.stderr)
+    return 1 if statuses.get('error') else 0
+
+
+def trace_command(args, out: Optional[TextIO] = None) -> int:
+    out = out or sys.stdout
+    with open(args.program) as f:
+        binary, errors = Assembler().assemble(f.read())
+    if errors:
+        for error in errors:
+            print(error, file=sys.stderr)
+        return 1
+    simulator = Simulator()
+    simulator.load_program(binary)
+    started = time.perf_counter()
+    note, writer = record_run(simulator, args.output, args.max_steps, args.chunk_records,
+                              args.compress)
+    elapsed = time.perf_counter() - started
+    status = note or ('halted' if simulator.state.halted else 'max_steps')
+    out.write(f"{writer.total} records, {writer.bytes_written} bytes in {elapsed:.2f}s: {status}\n")
+    return 0
+
+
+def parse_range(text: str) -> Tuple[int, int]:
+    # "LO:HI" as [LO, HI), or a single address
+    low, sep, high = text.partition(':')
+    low = int(low, 0)
+    return (low, int(high, 0)) if sep else (low, low + 1)
+
+
+def inspect_command(args, out: Optional[TextIO] = None) -> int:
+    out = out or sys.stdout
+    opcodes = None
+    if args.op:
+        unknown = [name for name in args.op if name.lower() not in OPCODES]
+        if unknown:
+            raise ValueError(f"Unknown opcode: {', '.join(unknown)}")
+        opcodes = [OPCODES[name.lower()] for name in args.op]
+    address = parse_range(args.address) if args.address else None
+    pc = int(args.pc, 0) if args.pc else None
+
+    with TraceReader(args.file) as reader:
+        if opcodes is None and address is None and pc is None:
+            stop = None if args.limit is None else args.start + args.limit
+            records = reader.records(args.start, stop)
+        else:
+            records = (r for r in reader.filter(opcodes, address, pc) if r.index >= args.start)
+        for n, record in enumerate(records):
+            if args.limit is not None and n >= args.limit:
+                break
+            if args.json:
+                out.write(json.dumps(record._asdict()) + '\n')
+            else:
+                out.write(f"{record.index:>10}  {record.line()}\n")
+    return 0
+
+
+def serve_command(args) -> int:
+    import uvicorn
+    uvicorn.run("main:app", host=args.host, port=args.port)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='backend', description="ISA simulator")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="assemble and run .asm files, printing JSON lines")
+    run.add_argument('paths', nargs='+', help="files or directories to search")
+    run.add_argument('--pattern', default='*.asm', help="file name pattern (default %(default)s)")
+    run.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                     help="default step limit per program (default %(default)s)")
+    run.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                     help="default wall-clock limit per program in seconds (default %(default)s)")
+    run.add_argument('--trace-last', type=int, default=0,
+                     help="trailing trace lines to include per program")
+    run.add_argument('--fixtures', help="JSON file mapping path patterns to initial state and limits")
+    run.add_argument('--workers', type=int, help="worker processes (default: one per core)")
+    run.add_argument('--memory', action='store_true', help="include memory[0:1024] in results")
+    run.add_argument('--quiet', action='store_true', help="no summary on stderr")
+    run.set_defaults(handler=run_command)
+
+    trace = commands.add_parser('trace', help="run a program, writing its full trace to a file")
+    trace.add_argument('program', help=".asm file")
+    trace.add_argument('-o', '--output', required=True, help="trace file to write")
+    trace.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                       help="step limit (default %(default)s)")
+    trace.add_argument('--chunk-records', type=int, default=DEFAULT_CHUNK_RECORDS,
+                       help="records per chunk (default %(default)s)")
+    trace.add_argument('--compress', action='store_true', help="zlib-compress chunks")
+    trace.set_defaults(handler=trace_command)
+
+    inspect = commands.add_parser('inspect', help="print records from a trace file")
+    inspect.add_argument('file', help="trace file")
+    inspect.add_argument('--op', action='append', help="only this opcode (repeatable), e.g. store")
+    inspect.add_argument('--address', help="only LOAD/STORE to LO:HI (HI exclusive) or one address")
+    inspect.add_argument('--pc', help="only records at this PC")
+    inspect.add_argument('--start', type=int, default=0, help="first record index")
+    inspect.add_argument('--limit', type=int, help="most records to print")
+    inspect.add_argument('--json', action='store_true', help="JSON lines instead of trace text")
+    inspect.set_defaults(handler=inspect_command)
+
+    serve = commands.add_parser('serve', help="run the API server")
+    serve.add_argument('--host', default='0.0.0.0')
+    serve.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    serve.set_defaults(handler=serve_command)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
@@ -0,0 +1,148 @@
+# Run-until conditions compiled to Python predicates
+# Vishanth Dandu
+
+import ast
+from typing import FrozenSet, Optional
+
+from dispatch import FLAG_C, FLAG_N, FLAG_Z
+
+# Longest condition text accepted
+MAX_CONDITION_LENGTH = 256
+# Largest integer constant accepted; with the operators below no
+# intermediate value grows much past 16 bits
+MAX_CONSTANT = 0xFFFF
+
+# Names a condition may use and the expression each compiles to
+_NAMES = {
+    'pc': "state.pc",
+    'icount': "(state.instruction_count + steps)",
+    'cycles': "cycles",
+    'halted': "state.halted",
+    'Z': f"(state.flag_bits & {FLAG_Z} != 0)",
+    'N': f"(state.flag_bits & {FLAG_N} != 0)",
+    'C': f"(state.flag_bits & {FLAG_C} != 0)",
+}
+_NAMES.update({f'R{i}': f"r[{i}]" for i in range(8)})
+_NAMES.update({f'r{i}': f"r[{i}]" for i in range(8)})
+
+_COMPARE = {ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>='}
+# No *, //, %, << or >>: those can raise or build huge integers
+_BINARY = {ast.Add: '+', ast.Sub: '-', ast.BitAnd: '&', ast.BitOr: '|', ast.BitXor: '^'}
+_UNARY = {ast.Not: 'not ', ast.USub: '-', ast.Invert: '~'}
+
+
+class Condition:
+    # A compiled condition: test(state, steps, cycles) is true when a run
+    # should stop. Runs update the state's counters only when they end, so
+    # they pass the instructions run so far and the current cycle count.
+    # Conditions are expressions over pc, R0-R7, the flags Z/N/C, halted,
+    # icount (instructions run), cycles, mem[addr] (a byte) and word[addr]
+    # (a little-endian word), with comparisons, + - & | ^ ~, and/or/not,
+    # e.g. "R3 == 0", "pc == 0x20 or word[0x100] > 7".
+    #
+    # An evaluation error counts as the condition holding, so the run
+    # stops; error then holds it and note() reports it.
+    #
+    # pcs is set when the condition only asks for pc to equal one of some
+    # constants; runs then treat those as breakpoints and keep compiled
+    # blocks.
+    __slots__ = ('text', 'source', 'test', 'pcs', 'error')
+
+    def __init__(self, text: str, source: str, test, pcs: Optional[FrozenSet[int]]):
+        self.text = text
+        self.source = source
+        self.test = test
+        self.pcs = pcs
+        self.error: Optional[str] = None
+
+    def _failed(self, error: Exception) -> bool:
+        self.error = f"{type(error).__name__}: {error}"
+        return True
+
+    def note(self, pc: int) -> str:
+        if self.error is not None:
+            return f"CONDITION {self.text} failed at PC={pc:04X}: {self.error}"
+        return f"CONDITION {self.text} at PC={pc:04X}"
+
+    def __repr__(self) -> str:
+        return f"Condition({self.text!r})"
+
+
+def _emit(node: ast.AST) -> str:
+    if isinstance(node, ast.Constant) and type(node.value) in (int, bool):
+        if not 0 <= node.value <= MAX_CONSTANT:
+            raise ValueError(f"Constant out of range in condition: {node.value}")
+        return repr(node.value)
+    if isinstance(node, ast.Name):
+        if node.id not in _NAMES:
+            raise ValueError(f"Unknown name in condition: {node.id}")
+        return _NAMES[node.id]
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name):
+        addr = f"({_emit(node.slice)}) & 0xFFFF"
+        if node.value.id == 'mem':
+            return f"m[{addr}]"
+        if node.value.id == 'word':
+            return f"word(m, {addr})"
+        raise ValueError(f"Unknown memory accessor in condition: {node.value.id}")
+    if isinstance(node, ast.Compare) and all(type(op) in _COMPARE for op in node.ops):
+        parts = [_emit(node.left)]
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(f"{_COMPARE[type(op)]} {_emit(right)}")
+        return f"({' '.join(parts)})"
+    if isinstance(node, ast.BoolOp):
+        joiner = ' and ' if isinstance(node.op, ast.And) else ' or '
+        return f"({joiner.join(_emit(value) for value in node.values)})"
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+        return f"({_emit(node.left)} {_BINARY[type(node.op)]} {_emit(node.right)})"
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+        return f"({_UNARY[type(node.op)]}{_emit(node.operand)})"
+    raise ValueError(f"Unsupported expression in condition: {ast.unparse(node)}")
+
+
+def _pc_targets(node: ast.AST) -> Optional[FrozenSet[int]]:
+    # The constants in "pc == K" or an `or` of such tests, else None
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.Or):
+        pcs = set()
+        for value in node.values:
+            targets = _pc_targets(value)
+            if targets is None:
+                return None
+            pcs |= targets
+        return frozenset(pcs)
+    if (isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], ast.Eq)):
+        left, right = node.left, node.comparators[0]
+        if isinstance(right, ast.Name):
+            left, right = right, left
+        if (isinstance(left, ast.Name) and left.id == 'pc' and isinstance(right, ast.Constant)
+                and type(right.value) is int):
+            return frozenset([right.value])
+    return None
+
+
+def _word(memory, addr: int) -> int:
+    return memory[addr] | (memory[(addr + 1) & 0xFFFF] << 8)
+
+
+def compile_condition(text: str) -> Condition:
+    # Raises ValueError for anything outside the condition language
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("Empty condition")
+    if len(text) > MAX_CONDITION_LENGTH:
+        raise ValueError(f"Condition longer than {MAX_CONDITION_LENGTH} characters")
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid condition: {e.msg}")
+    expr = _emit(tree.body)
+    source = "\n".join(["def until(state, steps, cycles):",
+                        "    r = state.registers",
+                        "    m = state.memory",
+                        "    try:",
+                        f"        return bool({expr})",
+                        "    except Exception as e:",
+                        "        return failed(e)"])
+    namespace = {'word': _word}
+    exec(compile(source, "<condition>", "exec"), namespace)
+    condition = Condition(text.strip(), source, namespace['until'], _pc_targets(tree.body))
+    namespace['failed'] = condition._failed
+    return condition
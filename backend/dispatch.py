@@ -0,0 +1,165 @@
+# Predecoded dispatch table for the 16-bit ISA
+# Vishanth Dandu
+
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+# Every 16-bit word decodes to one (handler, a, b, c) entry. The table is built
+# once per process and shared by every Simulator, so the hot loop only does
+# an index and a call per instruction.
+Entry = Tuple[Callable, int, int, int]
+
+_table: Optional[List[Entry]] = None
+
+# Flag bits of CPUState.flag_bits
+FLAG_Z = 0x1
+FLAG_N = 0x2
+FLAG_C = 0x4
+
+# Z/N bits for every 16-bit result, so ALU handlers set both with one lookup
+ZN_FLAGS = bytes([FLAG_Z] + [FLAG_N if v & 0x8000 else 0 for v in range(1, 0x10000)])
+
+
+def _sext(value: int, bits: int) -> int:
+    sign = 1 << (bits - 1)
+    return (value & (sign - 1)) - (value & sign)
+
+
+# Opcode handlers - each one updates the state and advances the PC itself
+
+def op_nop(state, a, b, c):
+    state.pc += 2
+
+
+def op_add(state, rd, rs1, rs2):
+    regs = state.registers
+    result = (regs[rs1] + regs[rs2]) & 0xFFFF
+    regs[rd] = result
+    # carry compares against rs1 as read after the write, as it always has
+    state.flag_bits = ZN_FLAGS[result] | (FLAG_C if result < regs[rs1] else 0)
+    state.pc += 2
+
+
+def op_sub(state, rd, rs1, rs2):
+    regs = state.registers
+    result = (regs[rs1] - regs[rs2]) & 0xFFFF
+    regs[rd] = result
+    state.flag_bits = (state.flag_bits & FLAG_C) | ZN_FLAGS[result]
+    state.pc += 2
+
+
+def op_and(state, rd, rs1, rs2):
+    regs = state.registers
+    result = regs[rs1] & regs[rs2]
+    regs[rd] = result
+    state.flag_bits = (state.flag_bits & FLAG_C) | ZN_FLAGS[result]
+    state.pc += 2
+
+
+def op_or(state, rd, rs1, rs2):
+    regs = state.registers
+    result = regs[rs1] | regs[rs2]
+    regs[rd] = result
+    state.flag_bits = (state.flag_bits & FLAG_C) | ZN_FLAGS[result]
+    state.pc += 2
+
+
+def op_addi(state, rd, rs, imm):
+    regs = state.registers
+    result = (regs[rs] + imm) & 0xFFFF
+    regs[rd] = result
+    state.flag_bits = (state.flag_bits & FLAG_C) | ZN_FLAGS[result]
+    state.pc += 2
+
+
+def op_load(state, rd, base, offset):
+    regs = state.registers
+    addr = (regs[base] + offset) & 0xFFFF
+    if addr < 0xFFFF:
+        memory = state.memory
+        regs[rd] = memory[addr] | (memory[addr + 1] << 8)
+    state.pc += 2
+
+
+def op_store(state, rd, base, offset):
+    regs = state.registers
+    addr = (regs[base] + offset) & 0xFFFF
+    if addr < 0xFFFF:
+        value = regs[rd]
+        memory = state.memory
+        memory[addr] = value & 0xFF
+        memory[addr + 1] = (value >> 8) & 0xFF
+    state.pc += 2
+
+
+def op_jmp(state, cond, offset, c):
+    state.pc = (state.pc + offset) & 0xFFFF
+
+
+def op_brz(state, cond, offset, c):
+    if state.flag_bits & FLAG_Z:
+        state.pc = (state.pc + offset) & 0xFFFF
+    else:
+        state.pc += 2
+
+
+def op_halt(state, a, b, c):
+    state.halted = True
+
+
+def decode_entry(word: int) -> Entry:
+    # Decode one instruction word into its dispatch entry
+    opcode = (word >> 12) & 0xF
+    if 0x1 <= opcode <= 0x4:
+        handler = (op_add, op_sub, op_and, op_or)[opcode - 1]
+        return handler, (word >> 9) & 0x7, (word >> 6) & 0x7, (word >> 3) & 0x7
+    if opcode == 0x5:
+        return op_addi, (word >> 9) & 0x7, (word >> 6) & 0x7, _sext(word & 0x3F, 6)
+    if opcode == 0x6 or opcode == 0x7:
+        handler = op_load if opcode == 0x6 else op_store
+        return handler, (word >> 9) & 0x7, (word >> 6) & 0x7, _sext(word & 0x3F, 6)
+    if opcode == 0x8 or opcode == 0x9:
+        handler = op_jmp if opcode == 0x8 else op_brz
+        return handler, (word >> 10) & 0x3, _sext(word & 0x3FF, 10), 0
+    if opcode == 0xA:
+        return op_halt, 0, 0, 0
+    # NOP and unassigned opcodes just fall through to the next instruction
+    return op_nop, 0, 0, 0
+
+
+def get_dispatch_table() -> List[Entry]:
+    # Build the shared table on first use. Words that only differ in unused
+    # bits decode to the same entry, so identical entries share one tuple.
+    global _table
+    if _table is None:
+        unique = {}
+        table = []
+        for word in range(0x10000):
+            entry = decode_entry(word)
+            table.append(unique.setdefault(entry, entry))
+        _table = table
+    return _table
+
+
+@lru_cache(maxsize=4096)
+def disassemble(word: int, taken: bool = False) -> str:
+    # Trace text for one instruction; `taken` only matters for BRZ
+    opcode = (word >> 12) & 0xF
+    handler, a, b, c = decode_entry(word)
+    if handler is op_halt:
+        return "HALT"
+    if handler is op_nop:
+        return "NOP" if opcode == 0x0 else f"UNKNOWN({opcode})"
+    if handler is op_jmp:
+        return f"JMP {b:+d}"
+    if handler is op_brz:
+        return f"BRZ ({'taken' if taken else 'not taken'}) {b:+d}"
+    name = handler.__name__[3:].upper()
+    if opcode >= 0x5:
+        # I/M-type immediates are shown sign-extended to 16 bits
+        return f"{name} R{a}, R{b}, {c & 0xFFFF}"
+    return f"{name} R{a}, R{b}, R{c}"
+
+
+def format_trace(pc: int, word: int, zero_flag: bool) -> str:
+    return f"PC={pc:04X} I={word:04X} " + disassemble(word, zero_flag)
@@ -0,0 +1,214 @@
+# Execution history - undo journal and copy-on-write checkpoints
+# Vishanth Dandu
+
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+from dispatch import op_add, op_addi, op_and, op_load, op_or, op_store, op_sub
+
+PAGE_SIZE = 256
+PAGE_COUNT = 0x10000 // PAGE_SIZE
+
+# Each journal entry is two 64-bit words
+ENTRY_BYTES = 16
+DEFAULT_JOURNAL_BYTES = 1024 * 1024
+DEFAULT_MAX_CHECKPOINTS = 32
+# Most a client may ask for; larger requests are clamped
+MAX_JOURNAL_BYTES = 16 * 1024 * 1024
+MAX_CHECKPOINTS = 256
+
+_WRITES_RD = (op_add, op_sub, op_and, op_or, op_addi, op_load)
+_ZERO_PAGE = bytes(PAGE_SIZE)
+
+
+def history_limits(max_journal_bytes=DEFAULT_JOURNAL_BYTES,
+                   max_checkpoints=DEFAULT_MAX_CHECKPOINTS):
+    # Client-supplied limits clamped to MAX_JOURNAL_BYTES/MAX_CHECKPOINTS;
+    # raises ValueError for anything but non-negative ints
+    for name, value in (('max_bytes', max_journal_bytes), ('max_checkpoints', max_checkpoints)):
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{name} must be a non-negative integer")
+    return min(max_journal_bytes, MAX_JOURNAL_BYTES), min(max_checkpoints, MAX_CHECKPOINTS)
+
+
+class Checkpoint:
+    # Full CPU state; memory pages are immutable bytes shared with other
+    # checkpoints wherever they were not written in between
+    __slots__ = ('id', 'pages', 'registers', 'pc', 'flag_bits', 'halted',
+                 'cycle_count', 'instruction_count', 'position')
+
+    def __init__(self, id: int, pages: List[bytes], state, position: int):
+        self.id = id
+        self.pages = pages
+        self.registers = tuple(state.registers)
+        self.pc = state.pc
+        self.flag_bits = state.flag_bits
+        self.halted = state.halted
+        self.cycle_count = state.cycle_count
+        self.instruction_count = state.instruction_count
+        self.position = position
+
+
+class History:
+    # Undo journal for step_back plus page-level copy-on-write checkpoints.
+    #
+    # Before each instruction the journal stores what it is about to
+    # overwrite: pc, flags, the destination register's old value, or the
+    # old word under a STORE. Entries live in a ring sized from
+    # max_journal_bytes, so the oldest history is forgotten first.
+    #
+    # Writes that bypass the journal (loading a program, memory edits)
+    # must be reported with note_write(); they mark pages dirty and cut the
+    # journal, since they cannot be undone step by step.
+
+    def __init__(self, state, max_journal_bytes: int = DEFAULT_JOURNAL_BYTES,
+                 max_checkpoints: int = DEFAULT_MAX_CHECKPOINTS):
+        self.state = state
+        self.max_journal_bytes = max_journal_bytes
+        self.max_checkpoints = max_checkpoints
+        self.capacity = max(1, max_journal_bytes // ENTRY_BYTES)
+        # pc | flags << 17 | (rd + 1) << 20 | old rd value << 24
+        self._regs = array('Q', bytes(8 * self.capacity))
+        # (address + 1) | old word << 17, zero when memory is untouched
+        self._mem = array('Q', bytes(8 * self.capacity))
+        self.clear()
+
+    def clear(self):
+        self._next = 0
+        self.length = 0
+        # instructions executed minus instructions undone
+        self.position = 0
+        self.dirty = bytearray(b'\x01' * PAGE_COUNT)
+        self.checkpoints: 'OrderedDict[int, Checkpoint]' = OrderedDict()
+        self._last_pages: Optional[List[bytes]] = None
+        self._next_id = 1
+
+    @property
+    def journal_bytes(self) -> int:
+        return self.length * ENTRY_BYTES
+
+    @property
+    def nbytes(self) -> int:
+        # Journal ring plus every distinct non-zero checkpoint page
+        pages = {id(page) for checkpoint in self.checkpoints.values()
+                 for page in checkpoint.pages if page is not _ZERO_PAGE}
+        return ENTRY_BYTES * self.capacity + PAGE_SIZE * len(pages)
+
+    def record(self, pc: int, entry: tuple):
+        # Journal the instruction about to run at pc
+        state = self.state
+        handler, a, b, c = entry
+        regs = 0
+        mem = 0
+        if handler in _WRITES_RD:
+            regs = ((a + 1) << 20) | (state.registers[a] << 24)
+        elif handler is op_store:
+            addr = (state.registers[b] + c) & 0xFFFF
+            if addr < 0xFFFF:
+                memory = state.memory
+                mem = (addr + 1) | ((memory[addr] | (memory[addr + 1] << 8)) << 17)
+                self.dirty[addr >> 8] = 1
+                self.dirty[(addr + 1) >> 8] = 1
+        i = self._next
+        self._regs[i] = pc | (state.flag_bits << 17) | regs
+        self._mem[i] = mem
+        i += 1
+        self._next = 0 if i == self.capacity else i
+        if self.length < self.capacity:
+            self.length += 1
+        self.position += 1
+
+    def step_back(self, count: int = 1) -> int:
+        # Undo up to count instructions; returns how many were undone
+        state = self.state
+        memory = state.memory
+        registers = state.registers
+        count = max(0, min(count, self.length))
+        i = self._next
+        for _ in range(count):
+            i = (i - 1) % self.capacity
+            info = self._regs[i]
+            state.pc = info & 0x1FFFF
+            state.flag_bits = (info >> 17) & 0x7
+            reg = (info >> 20) & 0xF
+            if reg:
+                registers[reg - 1] = (info >> 24) & 0xFFFF
+            mem = self._mem[i]
+            if mem:
+                addr = (mem & 0x1FFFF) - 1
+                word = mem >> 17
+                memory[addr] = word & 0xFF
+                memory[addr + 1] = word >> 8
+                self.dirty[addr >> 8] = 1
+                self.dirty[(addr + 1) >> 8] = 1
+        if count:
+            # an instruction only runs on a machine that is not halted
+            state.halted = False
+            state.cycle_count -= count
+            state.instruction_count -= count
+        self._next = i
+        self.length -= count
+        self.position -= count
+        return count
+
+    def note_write(self, start: int, end: int):
+        # Memory[start:end] changed outside the journal. It counts as a
+        # step that cannot be undone, so restoring a checkpoint from before
+        # it copies pages back even when no instruction ran since.
+        for page in range(start // PAGE_SIZE, (max(end, start + 1) - 1) // PAGE_SIZE + 1):
+            self.dirty[page] = 1
+        self.length = 0
+        self.position += 1
+
+    def checkpoint(self) -> int:
+        # Snapshot the state; only pages written since the previous
+        # checkpoint are copied
+        memory = self.state.memory
+        previous = self._last_pages
+        pages = []
+        for page in range(PAGE_COUNT):
+            if previous is None or self.dirty[page]:
+                start = page * PAGE_SIZE
+                data = bytes(memory[start:start + PAGE_SIZE])
+                pages.append(_ZERO_PAGE if data == _ZERO_PAGE else data)
+            else:
+                pages.append(previous[page])
+        self.dirty[:] = bytes(PAGE_COUNT)
+        self._last_pages = pages
+
+        checkpoint = Checkpoint(self._next_id, pages, self.state, self.position)
+        self._next_id += 1
+        self.checkpoints[checkpoint.id] = checkpoint
+        while len(self.checkpoints) > self.max_checkpoints:
+            self.checkpoints.popitem(last=False)
+        return checkpoint.id
+
+    def restore(self, checkpoint_id: int):
+        # Return to a checkpoint. Going back within the journal undoes just
+        # the instructions since then; otherwise only pages that differ
+        # from the checkpoint are copied back.
+        checkpoint = self.checkpoints.get(checkpoint_id)
+        if checkpoint is None:
+            raise KeyError(f"Unknown checkpoint: {checkpoint_id}")
+
+        back = self.position - checkpoint.position
+        if 0 <= back <= self.length:
+            self.step_back(back)
+            return
+
+        state = self.state
+        view = memoryview(state.memory)
+        for page, data in enumerate(checkpoint.pages):
+            start = page * PAGE_SIZE
+            if view[start:start + PAGE_SIZE] != data:
+                view[start:start + PAGE_SIZE] = data
+                self.dirty[page] = 1
+        state.registers[:] = checkpoint.registers
+        state.pc = checkpoint.pc
+        state.flag_bits = checkpoint.flag_bits
+        state.halted = checkpoint.halted
+        state.cycle_count = checkpoint.cycle_count
+        state.instruction_count = checkpoint.instruction_count
+        self.length = 0
+        self.position = checkpoint.position
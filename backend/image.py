@@ -0,0 +1,102 @@
+# Program image format: code and data sections plus a symbol table
+# Vishanth Dandu
+
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, List, Union
+
+# Layout, all little-endian:
+#   header:        magic, version, entry address, section count, symbol count
+#   section table: kind, load address, file offset, length
+#   symbol table:  address, name length, UTF-8 name
+#   section data at the offsets given in the section table
+IMAGE_MAGIC = b'ISAI'
+IMAGE_VERSION = 1
+
+SECTION_CODE = 0
+SECTION_DATA = 1
+
+IMAGE_MEMORY_SIZE = 0x10000
+
+_HEADER = struct.Struct('<4sHHHH')
+_SECTION = struct.Struct('<BxHII')
+_SYMBOL = struct.Struct('<HB')
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+@dataclass
+class Section:
+    kind: int
+    address: int
+    # bytes-like; memoryview slices of the file when read from a buffer
+    data: Buffer
+
+
+@dataclass
+class ProgramImage:
+    entry: int = 0
+    sections: List[Section] = field(default_factory=list)
+    symbols: Dict[str, int] = field(default_factory=dict)
+
+
+def write_image(image: ProgramImage) -> bytes:
+    symbols = [(address, name.encode('utf-8')) for name, address in image.symbols.items()]
+    offset = (_HEADER.size + _SECTION.size * len(image.sections)
+              + sum(_SYMBOL.size + len(name) for _, name in symbols))
+    out = [_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, image.entry, len(image.sections), len(symbols))]
+    for section in image.sections:
+        out.append(_SECTION.pack(section.kind, section.address, offset, len(section.data)))
+        offset += len(section.data)
+    for address, name in symbols:
+        if len(name) > 255:
+            raise ValueError(f"Symbol name too long: {name[:16]!r}...")
+        out.append(_SYMBOL.pack(address, len(name)))
+        out.append(name)
+    out.extend(bytes(section.data) for section in image.sections)
+    return b''.join(out)
+
+
+def read_image(buffer: Buffer) -> ProgramImage:
+    # Parse without copying section data: each section's data is a
+    # memoryview into buffer, so a memory-mapped file is read in place.
+    # The views must be released before such a buffer is closed.
+    with memoryview(buffer) as view:
+        if len(view) < _HEADER.size:
+            raise ValueError("Image too short")
+        magic, version, entry, section_count, symbol_count = _HEADER.unpack_from(view)
+        if magic != IMAGE_MAGIC:
+            raise ValueError(f"Not a program image: magic {magic!r}")
+        if version != IMAGE_VERSION:
+            raise ValueError(f"Unsupported image version: {version}")
+
+        table = []
+        symbols = {}
+        pos = _HEADER.size
+        try:
+            for _ in range(section_count):
+                kind, address, offset, length = _SECTION.unpack_from(view, pos)
+                pos += _SECTION.size
+                if offset + length > len(view) or address + length > IMAGE_MEMORY_SIZE:
+                    raise ValueError(f"Section at {address:#06x} out of bounds")
+                table.append((kind, address, offset, length))
+            for _ in range(symbol_count):
+                address, length = _SYMBOL.unpack_from(view, pos)
+                pos += _SYMBOL.size
+                if pos + length > len(view):
+                    raise ValueError("Truncated image")
+                symbols[bytes(view[pos:pos + length]).decode('utf-8')] = address
+                pos += length
+        except struct.error:
+            raise ValueError("Truncated image")
+
+        sections = [Section(kind, address, view[offset:offset + length])
+                    for kind, address, offset, length in table]
+    return ProgramImage(entry, sections, symbols)
+
+
+def release_image(image: ProgramImage):
+    # Drop the buffer views held by an image from read_image()
+    for section in image.sections:
+        if isinstance(section.data, memoryview):
+            section.data.release()
@@ -0,0 +1,214 @@
+# Incremental re-assembly for the IDE edit loop
+# Vishanth Dandu
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+from assembler import Assembler, AssemblerError, tokenize
+
+_BRANCHES = ('JMP', 'BRZ')
+
+# An assembled instruction: its word, or the error message a full
+# assembly reports for it
+Result = Union[int, str]
+
+
+class _Line:
+    # Parse of one source line, shared by every line with the same text.
+    # target is the operand of a one-operand JMP/BRZ, whose encoding depends
+    # on label addresses; every other instruction's result is fixed.
+    __slots__ = ('label', 'text', 'target', 'result', 'branch_results')
+
+    def __init__(self, label: Optional[str], text: Optional[str]):
+        self.label = label
+        self.text = text
+        self.target: Optional[str] = None
+        self.result: Optional[Result] = None
+        # label offset (None when the operand is not a label) -> result
+        self.branch_results: Dict[Optional[int], Result] = {}
+
+
+@dataclass
+class AssemblyUpdate:
+    binary: List[int]
+    errors: List[str]
+    labels: Dict[str, int]
+    # (word index, word) for every word that differs from the previous
+    # binary, with (index, 0) for words past the end of a shorter one;
+    # None when either assembly had errors
+    changes: Optional[List[Tuple[int, int]]]
+
+
+def _common_prefix(a: List[str], b: List[str]) -> int:
+    # Binary search with slice comparisons, so the scan runs in C
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a: List[str], b: List[str], limit: int) -> int:
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class AssemblySession:
+    # Keeps the previous source's per-line results between calls.
+    #
+    # update() only parses and encodes lines whose text is new. An edit
+    # that leaves every line's label and instruction slot in place (the
+    # usual keystroke) touches nothing else; one that adds or removes
+    # instructions or labels re-lays out addresses and re-encodes only the
+    # branches whose label offset moved. Output always equals
+    # Assembler().assemble(source).
+
+    def __init__(self):
+        self.assembler = Assembler()
+        self.lines: List[str] = []
+        self._entries: List[_Line] = []
+        # 1 for every line that holds an instruction
+        self._slots = bytearray()
+        self._cache: Dict[str, _Line] = {}
+        self.labels: Dict[str, int] = {}
+        self._results: List[Result] = []
+        self._error_count = 0
+        self.binary: List[int] = []
+        self.errors: List[str] = []
+
+    def _parse(self, line: str) -> _Line:
+        entry = self._cache.get(line)
+        if entry is not None:
+            return entry
+        # Same splitting as Assembler.preprocess
+        code = line.split(';')[0].strip()
+        label = None
+        if ':' in code:
+            label, code = code.split(':', 1)
+            label = label.strip()
+            code = code.strip()
+        entry = _Line(label, code or None)
+        if entry.text is not None:
+            parts = tokenize(entry.text)
+            if parts and parts[0].upper() in _BRANCHES and len(parts) == 2:
+                entry.target = parts[1]
+            else:
+                entry.result = self._encode(entry.text, 0)
+        self._cache[line] = entry
+        return entry
+
+    def _encode(self, text: str, pc: int) -> Result:
+        try:
+            return self.assembler.assemble_instruction(text, pc)
+        except (AssemblerError, ValueError) as e:
+            return str(e)
+
+    def _branch(self, entry: _Line, pc: int) -> Result:
+        address = self.labels.get(entry.target)
+        key = None if address is None else address - pc
+        result = entry.branch_results.get(key)
+        if result is None:
+            self.assembler.labels = self.labels
+            result = entry.branch_results[key] = self._encode(entry.text, pc)
+        return result
+
+    def _layout(self):
+        # Addresses and labels for the whole source, as preprocess does
+        labels = {}
+        address = 0
+        for entry in self._entries:
+            if entry.label is not None:
+                labels[entry.label] = address
+            if entry.text is not None:
+                address += 2
+        self.labels = labels
+        self._slots = bytearray(entry.text is not None for entry in self._entries)
+
+        results = []
+        pc = 0
+        for entry in self._entries:
+            if entry.text is not None:
+                results.append(entry.result if entry.target is None else self._branch(entry, pc))
+                pc += 2
+        self._results = results
+        self._error_count = sum(1 for r in results if type(r) is str)
+
+    def source_map(self) -> Dict[int, int]:
+        # Instruction address -> 1-based source line of the current source
+        addresses = {}
+        address = 0
+        for number, entry in enumerate(self._entries, 1):
+            if entry.text is not None:
+                addresses[address] = number
+                address += 2
+        return addresses
+
+    def update(self, source: str) -> AssemblyUpdate:
+        lines = source.split('\n')
+        old_lines = self.lines
+        prefix = _common_prefix(old_lines, lines)
+        suffix = _common_suffix(old_lines, lines, min(len(old_lines), len(lines)) - prefix)
+        old_region = self._entries[prefix:len(old_lines) - suffix]
+        new_region = [self._parse(line) for line in lines[prefix:len(lines) - suffix]]
+
+        old_binary, old_errors = self.binary, self._error_count
+        old_results = self._results
+        self.lines = lines
+        self._entries[prefix:len(old_lines) - suffix] = new_region
+
+        in_place = (len(old_region) == len(new_region)
+                    and all(old.label == new.label and (old.text is None) == (new.text is None)
+                            for old, new in zip(old_region, new_region)))
+        changed: Optional[List[int]] = None
+        if in_place:
+            # Same labels and instruction slots; only the region's own
+            # instructions can change
+            results = self._results = list(old_results)
+            index = self._slots.count(1, 0, prefix)
+            pc = index * 2
+            changed = []
+            for entry in new_region:
+                if entry.text is None:
+                    continue
+                result = entry.result if entry.target is None else self._branch(entry, pc)
+                if result != results[index]:
+                    self._error_count += (type(result) is str) - (type(results[index]) is str)
+                    results[index] = result
+                    changed.append(index)
+                index += 1
+                pc += 2
+        else:
+            self._layout()
+
+        results = self._results
+        if self._error_count:
+            self.binary = [r for r in results if type(r) is int]
+            self.errors = [r for r in results if type(r) is str]
+        else:
+            self.binary = results
+            self.errors = []
+
+        changes = None
+        if not self._error_count and not old_errors:
+            if changed is None:
+                binary = self.binary
+                changed = [i for i in range(len(binary))
+                           if i >= len(old_binary) or binary[i] != old_binary[i]]
+            changes = [(i, self.binary[i]) for i in changed]
+            # Zero the old tail so a patched program matches a fresh load
+            changes.extend((i, 0) for i in range(len(self.binary), len(old_binary)))
+
+        if len(self._cache) > 2 * len(lines) + 1024:
+            self._cache = {line: entry for line, entry in zip(lines, self._entries)}
+        # The lists and dict are never mutated once returned; the next update
+        # builds new ones
+        return AssemblyUpdate(self.binary, self.errors, self.labels, changes)
@@ -0,0 +1,183 @@
+# Lockstep batch engine - one program over many CPU states with NumPy
+# Vishanth Dandu
+
+from typing import List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+MEMORY_SIZE = 0x10000
+
+_FLAG_NAMES = (('Z', 0x1), ('N', 0x2), ('C', 0x4))
+
+
+def _sext16(field: np.ndarray, bits: int) -> np.ndarray:
+    # Sign-extend a `bits`-wide field to a 16-bit two's complement value
+    sign = 1 << (bits - 1)
+    return ((field ^ sign) - sign).astype(np.uint16)
+
+
+class LockstepSimulator:
+    # N independent CPU states stored as arrays:
+    #   registers  (N, 8)      uint16
+    #   memory     (N, 65536)  uint8
+    #   pc, cycle_count, instruction_count (N,) int64
+    #   flags      (N,)        uint8, same bits as CPUState.flag_bits
+    #   halted     (N,)        bool
+    # Every step executes one instruction in each running lane. Lanes are
+    # grouped by opcode, so lanes whose PCs diverge still run vectorized.
+
+    def __init__(self, lanes: int):
+        if lanes < 1:
+            raise ValueError(f"Lane count must be positive: {lanes}")
+        self.lanes = lanes
+        self.registers = np.zeros((lanes, 8), dtype=np.uint16)
+        self.memory = np.zeros((lanes, MEMORY_SIZE), dtype=np.uint8)
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.flags = np.zeros(lanes, dtype=np.uint8)
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.cycle_count = np.zeros(lanes, dtype=np.int64)
+        self.instruction_count = np.zeros(lanes, dtype=np.int64)
+
+    def load_program(self, binary: Sequence[int], start_address: int = 0):
+        # Same program in every lane; registers, flags and counters reset
+        words = np.asarray(binary, dtype=np.int64) & 0xFFFF
+        count = min(len(words), max(0, (MEMORY_SIZE - start_address) // 2))
+        code = np.empty(count * 2, dtype=np.uint8)
+        code[0::2] = words[:count] & 0xFF
+        code[1::2] = words[:count] >> 8
+        self.memory[:, start_address:start_address + count * 2] = code
+        self.registers[:] = 0
+        self.flags[:] = 0
+        self.halted[:] = False
+        self.pc[:] = start_address
+        self.cycle_count[:] = 0
+        self.instruction_count[:] = 0
+
+    def set_lane(self, lane: int, registers: Optional[Sequence[int]] = None,
+                 memory: Optional[Mapping[int, bytes]] = None,
+                 flags: Optional[Mapping[str, bool]] = None):
+        # Initial inputs for one lane; memory maps start address -> bytes
+        if registers is not None:
+            self.registers[lane, :len(registers)] = np.asarray(registers, dtype=np.int64) & 0xFFFF
+        if memory is not None:
+            for addr, data in memory.items():
+                data = np.frombuffer(bytes(data), dtype=np.uint8)
+                self.memory[lane, addr:addr + len(data)] = data
+        if flags is not None:
+            self.flags[lane] = sum(bit for name, bit in _FLAG_NAMES if flags.get(name))
+
+    def step(self) -> int:
+        # Execute one instruction in every running lane; returns how many ran
+        active = np.flatnonzero(~self.halted)
+        if active.size == 0:
+            return 0
+        pc = self.pc[active]
+
+        # Fetch - a PC past the last full word halts the lane and runs a NOP,
+        # exactly as Simulator.fetch_instruction does
+        fetchable = pc < MEMORY_SIZE - 1
+        safe_pc = np.where(fetchable, pc, 0)
+        words = (self.memory[active, safe_pc].astype(np.uint16)
+                 | (self.memory[active, safe_pc + 1].astype(np.uint16) << 8))
+        if not fetchable.all():
+            words[~fetchable] = 0
+            self.halted[active[~fetchable]] = True
+
+        opcodes = words >> 12
+        counts = np.bincount(opcodes, minlength=16)
+        present = np.flatnonzero(counts)
+        next_pc = pc + 2
+        if len(present) == 1:
+            # Lanes in lockstep all run the same opcode
+            self._execute(int(present[0]), active, words, pc, next_pc, slice(None))
+        else:
+            order = np.argsort(opcodes, kind='stable')
+            bounds = np.concatenate(([0], np.cumsum(counts)))
+            for opcode in present:
+                sel = order[bounds[opcode]:bounds[opcode + 1]]
+                self._execute(int(opcode), active[sel], words[sel], pc[sel], next_pc, sel)
+
+        self.pc[active] = next_pc
+        self.cycle_count[active] += 1
+        self.instruction_count[active] += 1
+        return int(active.size)
+
+    def _execute(self, opcode: int, lanes: np.ndarray, words: np.ndarray,
+                 pc: np.ndarray, next_pc: np.ndarray, sel: Union[np.ndarray, slice]):
+        regs = self.registers
+        rd = (words >> 9) & 0x7
+        rs = (words >> 6) & 0x7
+
+        if 0x1 <= opcode <= 0x5:
+            left = regs[lanes, rs]
+            if opcode == 0x5:
+                result = left + _sext16(words & 0x3F, 6)
+            else:
+                right = regs[lanes, (words >> 3) & 0x7]
+                if opcode == 0x1:
+                    result = left + right
+                elif opcode == 0x2:
+                    result = left - right
+                elif opcode == 0x3:
+                    result = left & right
+                else:
+                    result = left | right
+            regs[lanes, rd] = result
+            zn = (result == 0).astype(np.uint8) | ((result >> 14) & 0x2).astype(np.uint8)
+            if opcode == 0x1:
+                # carry compares against rs1 as read after the write
+                carry = (result < regs[lanes, rs]).astype(np.uint8) << 2
+                self.flags[lanes] = zn | carry
+            else:
+                self.flags[lanes] = (self.flags[lanes] & 0x4) | zn
+
+        elif opcode == 0x6 or opcode == 0x7:
+            addr = regs[lanes, rs] + _sext16(words & 0x3F, 6)
+            ok = addr < MEMORY_SIZE - 1
+            lanes, rd, addr = lanes[ok], rd[ok], addr[ok].astype(np.int64)
+            if opcode == 0x6:
+                regs[lanes, rd] = (self.memory[lanes, addr].astype(np.uint16)
+                                   | (self.memory[lanes, addr + 1].astype(np.uint16) << 8))
+            else:
+                value = regs[lanes, rd]
+                self.memory[lanes, addr] = value & 0xFF
+                self.memory[lanes, addr + 1] = value >> 8
+
+        elif opcode == 0x8 or opcode == 0x9:
+            offset = _sext16(words & 0x3FF, 10).astype(np.int64)
+            target = (pc + offset) & 0xFFFF
+            if opcode == 0x8:
+                next_pc[sel] = target
+            else:
+                taken = (self.flags[lanes] & 0x1).astype(bool)
+                next_pc[sel] = np.where(taken, target, pc + 2)
+
+        elif opcode == 0xA:
+            self.halted[lanes] = True
+            next_pc[sel] = pc
+        # NOP and unassigned opcodes fall through to pc + 2
+
+    def run(self, max_steps: int = 10000) -> int:
+        # Step until every lane halts or max_steps; returns instructions run
+        total = 0
+        for _ in range(max_steps):
+            executed = self.step()
+            if not executed:
+                break
+            total += executed
+        return total
+
+    def get_state_dict(self, lane: int) -> dict:
+        flags = int(self.flags[lane])
+        return {
+            'registers': [int(r) for r in self.registers[lane]],
+            'pc': int(self.pc[lane]),
+            'flags': {name: bool(flags & bit) for name, bit in _FLAG_NAMES},
+            'halted': bool(self.halted[lane]),
+            'cycle_count': int(self.cycle_count[lane]),
+            'instruction_count': int(self.instruction_count[lane]),
+            'memory': self.memory[lane, :1024].tolist()
+        }
+
+    def get_state_dicts(self) -> List[dict]:
+        return [self.get_state_dict(lane) for lane in range(self.lanes)]
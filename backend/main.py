@@ -1,14 +1,48 @@
 # FastAPI backend for ISA Simulator
 # Vishanth Dandu
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
+import asyncio
 import json
+import time
 
-from assembler import Assembler
+from asmcache import AssemblyCache
+from batch import BatchRunner, job_from_dict
+from conditions import compile_condition
+from history import DEFAULT_JOURNAL_BYTES, DEFAULT_MAX_CHECKPOINTS, history_limits
+from incremental import AssemblySession
+from metrics import SIZE_BUCKETS, Counter, Gauge, Histogram, RateMeter, Registry
+from profiler import DEFAULT_TOP
+from scheduler import Scheduler
+from sessions import Session, SessionManager
 from simulator import Simulator
+from statesync import (ENCODING_JSON, STATE_WINDOW, SYNC_FULL, StateSync, decode_memory_frame,
+                       encode_memory_frame)
+from streaming import StreamingRun
+from timing import timing_from_dict
+from tracebuf import check_trace_mode
+from watch import WATCH_WRITE
+
+# Actions accepted while a run is in progress
+RUN_SAFE_ACTIONS = {"pause", "resume", "cancel", "trace", "sync", "resync", "profile", "timing",
+                    "set_breakpoint", "clear_breakpoint", "set_watchpoint", "clear_watchpoint",
+                    "read_memory", "viewport", "clear_viewport"}
+
+# Actions with their own latency series; anything else is counted as "other"
+WS_ACTIONS = RUN_SAFE_ACTIONS | {"load", "assemble", "step", "run", "run_until", "reset",
+                                 "write_memory", "history", "checkpoint", "restore", "step_back"}
+
+# Per-job caps for /batch
+MAX_BATCH_STEPS = 5_000_000
+MAX_BATCH_TIMEOUT = 60.0
+MAX_BATCH_TRACE_LAST = 10_000
+
+# Most instructions one "step" message may run; it runs on the event loop
+MAX_STEP_COUNT = 100_000
 
 app = FastAPI(title="ISA Simulator API")
 
@@ -34,6 +68,100 @@ class AssembleResponse(BaseModel):
     binary: List[int]
     errors: List[str]
     success: bool
+    labels: Dict[str, int] = {}
+
+
+class AssembleBatchRequest(BaseModel):
+    sources: List[str]
+
+
+class AssembleBatchResponse(BaseModel):
+    results: List[AssembleResponse]
+
+
+class BatchJobRequest(BaseModel):
+    id: str = ""
+    source: Optional[str] = None
+    binary: Optional[List[int]] = None
+    start_address: int = 0
+    registers: Optional[List[int]] = None
+    flags: Optional[Dict[str, bool]] = None
+    memory: Dict[int, List[int]] = {}
+    max_steps: int = 10000
+    timeout: float = 10.0
+    trace_last: int = 0
+
+
+class BatchRequest(BaseModel):
+    jobs: List[BatchJobRequest]
+
+
+batch_runner = BatchRunner()
+assembly_cache = AssemblyCache()
+session_manager = SessionManager()
+# WebSocket runs execute on this scheduler's worker thread
+scheduler = Scheduler()
+
+
+def session_counts() -> dict:
+    stats = session_manager.stats()
+    return {("attached",): stats["attached"],
+            ("detached",): stats["sessions"] - stats["attached"],
+            ("pooled",): stats["pooled"]}
+
+
+def session_memory() -> dict:
+    stats = session_manager.stats()
+    largest = max((session.nbytes for session in session_manager.sessions.values()), default=0)
+    return {("total",): stats["bytes"], ("max",): largest}
+
+
+# Served at /metrics. Hot paths only touch these per message, request or
+# scheduler quantum, never per instruction; figures other objects already
+# keep are read when the metrics are rendered.
+metrics = Registry()
+assemble_seconds = metrics.add(Histogram(
+    "isa_assemble_seconds", "Time to answer an HTTP assemble request", ("endpoint",)))
+assemble_source_bytes = metrics.add(Histogram(
+    "isa_assemble_source_bytes", "Size of sources assembled over HTTP", ("endpoint",), SIZE_BUCKETS))
+ws_message_seconds = metrics.add(Histogram(
+    "isa_ws_message_seconds", "Time to handle a WebSocket message", ("action",)))
+ws_connections = metrics.add(Gauge("isa_ws_connections", "Open WebSocket connections"))
+trace_bytes = metrics.add(Counter("isa_trace_bytes_total", "Trace text sent to WebSocket clients"))
+instructions = metrics.add(Counter(
+    "isa_instructions_total", "Simulated instructions executed", ("source",)))
+instruction_rate = RateMeter()
+metrics.add(Gauge("isa_mips", "Million simulated instructions per second over the last 10s",
+                  collect=lambda: instruction_rate.rate() / 1e6))
+metrics.add(Gauge("isa_sessions", "Simulator sessions", ("state",), collect=session_counts))
+metrics.add(Gauge("isa_session_memory_bytes", "Approximate memory held by sessions", ("stat",),
+                  collect=session_memory))
+metrics.add(Counter("isa_session_evictions_total", "Detached sessions evicted",
+                    collect=lambda: session_manager.evictions))
+metrics.add(Gauge("isa_scheduler_queue_depth", "Run quanta waiting for a worker",
+                  collect=lambda: scheduler.queue_depth))
+metrics.add(Gauge("isa_scheduler_wait_seconds", "Recent average wait for a worker",
+                  collect=lambda: scheduler.wait_recent))
+metrics.add(Counter("isa_scheduler_cpu_seconds_total", "Worker CPU time spent simulating",
+                    collect=lambda: scheduler.cpu_time))
+metrics.add(Counter("isa_assembly_cache_requests_total", "Assembly cache lookups", ("result",),
+                    collect=lambda: {("hit",): assembly_cache.hits, ("miss",): assembly_cache.misses}))
+
+
+def count_instructions(source: str, count: int):
+    instructions.inc(count, source)
+    instruction_rate.add(count)
+
+
+scheduler.on_quantum = lambda steps: count_instructions("run", steps)
+
+
+def count_trace(trace):
+    # Approximate JSON bytes of a message's trace: one line or a list
+    if isinstance(trace, str):
+        trace_bytes.inc(len(trace) + 2)
+    elif trace:
+        trace_bytes.inc(sum(map(len, trace)) + 3 * len(trace))
 
 
 @app.get("/")
@@ -41,80 +169,607 @@ async def root():
     return {"message": "ISA Simulator API", "version": "1.0.0"}
 
 
+def assemble_cached(source: str) -> AssembleResponse:
+    result = assembly_cache.assemble(source)
+    return AssembleResponse(
+        binary=result.binary,
+        errors=result.errors,
+        success=len(result.errors) == 0,
+        labels=result.labels
+    )
+
+
 @app.post("/assemble", response_model=AssembleResponse)
 async def assemble(request: AssembleRequest):
-    assembler = Assembler()
-    binary, errors = assembler.assemble(request.source)
+    started = time.perf_counter()
+    response = assemble_cached(request.source)
+    assemble_seconds.observe(time.perf_counter() - started, "assemble")
+    assemble_source_bytes.observe(len(request.source), "assemble")
+    return response
+
+
+@app.post("/assemble/batch", response_model=AssembleBatchResponse)
+async def assemble_batch(request: AssembleBatchRequest):
+    started = time.perf_counter()
+    response = AssembleBatchResponse(results=[assemble_cached(source) for source in request.sources])
+    assemble_seconds.observe(time.perf_counter() - started, "batch")
+    for source in request.sources:
+        assemble_source_bytes.observe(len(source), "batch")
+    return response
+
+
+@app.get("/assemble/cache")
+async def assemble_cache_stats():
+    return assembly_cache.stats()
+
+
+@app.get("/metrics")
+async def metrics_text():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/sessions")
+async def session_stats():
+    return session_manager.stats()
+
+
+@app.get("/scheduler")
+async def scheduler_stats():
+    return scheduler.stats()
+
+
+def get_session(session_id: str) -> Session:
+    session = session_manager.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return session
+
+
+@app.get("/sessions/{session_id}/memory")
+async def read_session_memory(session_id: str, start: int = 0, length: int = 256):
+    # Raw bytes of memory[start:start + length]
+    try:
+        data = get_session(session_id).simulator.read_memory(start, length)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(data, media_type="application/octet-stream")
+
+
+@app.put("/sessions/{session_id}/memory")
+async def write_session_memory(session_id: str, request: Request, address: int = 0):
+    # The request body is copied into memory at address
+    session = get_session(session_id)
+    if session.running():
+        raise HTTPException(status_code=409, detail="Run in progress")
+    data = await request.body()
+    try:
+        length = session.simulator.write_memory(address, data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"address": address, "length": length}
+
+
+@app.post("/batch")
+async def batch(request: BatchRequest):
+    # Results are streamed as JSON lines in completion order
+    jobs = []
+    for i, job in enumerate(request.jobs):
+        job = job_from_dict(job.model_dump())
+        job.id = job.id or str(i)
+        job.max_steps = min(job.max_steps, MAX_BATCH_STEPS)
+        job.timeout = min(job.timeout, MAX_BATCH_TIMEOUT)
+        job.trace_last = max(0, min(job.trace_last, MAX_BATCH_TRACE_LAST))
+        jobs.append(job)
     
-    return AssembleResponse(
-        binary=binary,
-        errors=errors,
-        success=len(errors) == 0
-    )
+    async def results():
+        async for result in batch_runner.run_async(jobs):
+            if result.get("state") is not None:
+                count_instructions("batch", result["state"]["instruction_count"])
+            yield json.dumps(result) + "\n"
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    batch_runner.shutdown()
+    scheduler.shutdown()
+
+
+def message_int(message: dict, key: str, default: Optional[int] = None, low: int = 0,
+                high: int = 0xFFFF) -> int:
+    # An integer field of a WebSocket message; ValueError unless it is an
+    # int from low to high
+    value = message.get(key, default)
+    if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+        raise ValueError(f"{key} must be an integer from {low} to {high}")
+    return value
+
+
+async def send_state(websocket: WebSocket, sync: StateSync, message: dict):
+    # Attach the CPU state in the connection's sync mode. Binary frames go
+    # out right after the JSON message they belong to, then frames for
+    # any viewports that changed.
+    count_trace(message.get("trace_log"))
+    count_trace(message.get("trace"))
+    update = sync.update()
+    if isinstance(update, bytes):
+        await websocket.send_json(message)
+        await websocket.send_bytes(update)
+    else:
+        message.update(update)
+        await websocket.send_json(message)
+    for frame in sync.viewport_frames():
+        await websocket.send_bytes(frame)
+
+
+def profile_report(simulator: Simulator, assembly: Optional[AssemblySession],
+                   start_address: int, top: int) -> Optional[dict]:
+    # Profiler report, mapped back to source when the program came from
+    # this connection's incremental assembly
+    if simulator.profiler is None:
+        return None
+    if assembly is None:
+        return simulator.profiler.report(simulator.state.memory, top)
+    labels = {name: start_address + address for name, address in assembly.labels.items()}
+    source_map = {start_address + address: line for address, line in assembly.source_map().items()}
+    return simulator.profiler.report(simulator.state.memory, top, labels, source_map, assembly.lines)
+
+
+async def finish_run(websocket: WebSocket, run: StreamingRun):
+    try:
+        await run.run()
+    except Exception as e:
+        await websocket.send_json({
+            "type": "error",
+            "message": str(e)
+        })
 
 
 @app.websocket("/ws/simulate")
 async def websocket_simulate(websocket: WebSocket):
     await websocket.accept()
-    simulator = Simulator()
+    ws_connections.inc()
+    # ?session=<id> reattaches to the simulator of an earlier connection
+    session, resumed = session_manager.open(websocket, websocket.query_params.get("session"))
+    simulator = session.simulator
+    sync = session.sync
+    
+    async def send(message: dict):
+        await send_state(websocket, sync, message)
+    
+    def running() -> bool:
+        return session.running()
     
     try:
+        await send_state(websocket, sync, {
+            "type": "session",
+            "id": session.id,
+            "resumed": resumed
+        })
+        
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            received = await websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received.get("code", 1000))
+            if received.get("bytes") is not None:
+                # Binary frames from the client are memory writes
+                message = {"action": "write_memory", "frame": received["bytes"]}
+            else:
+                message = json.loads(received["text"])
             
             action = message.get("action")
+            started = time.perf_counter()
             
-            if action == "load":
+            if session.owner is not websocket:
+                # A newer connection resumed this session
+                await websocket.send_json({
+                    "type": "error",
+                    "message": "Session resumed by another connection"
+                })
+                await websocket.close()
+                break
+            
+            elif running() and action not in RUN_SAFE_ACTIONS:
+                await websocket.send_json({
+                    "type": "error",
+                    "message": "Run in progress"
+                })
+            
+            elif action == "load":
                 binary = message.get("binary", [])
                 start_addr = message.get("start_address", 0)
                 simulator.load_program(binary, start_addr)
-                await websocket.send_json({
-                    "type": "state",
-                    "state": simulator.get_state_dict()
-                })
+                await send_state(websocket, sync, {"type": "state"})
             
-            elif action == "step":
+            elif action == "assemble":
+                # Incremental re-assembly; "patch" writes changed words into
+                # the loaded program in place
+                if session.assembly is None:
+                    session.assembly = AssemblySession()
+                update = session.assembly.update(message.get("source", ""))
+                reply = {
+                    "type": "assembled",
+                    "binary": update.binary,
+                    "errors": update.errors,
+                    "success": not update.errors,
+                    "changes": update.changes
+                }
+                if message.get("patch") and update.changes is not None:
+                    simulator.patch_program(update.changes, message.get("start_address", 0))
+                    await send_state(websocket, sync, reply)
+                else:
+                    await websocket.send_json(reply)
+            
+            elif action == "step" and "count" not in message:
+                before = simulator.state.instruction_count
                 trace = simulator.step()
-                await websocket.send_json({
+                count_instructions("step", simulator.state.instruction_count - before)
+                await send_state(websocket, sync, {
                     "type": "state",
-                    "state": simulator.get_state_dict(),
-                    "trace": trace
+                    "trace": trace,
+                    "watchpoint": simulator.watchpoints.take_hit()
                 })
             
-            elif action == "run":
+            elif action == "step":
+                # Up to "count" instructions, stopping early like a run, with
+                # one reply carrying every trace line
+                count = message["count"]
+                try:
+                    if not isinstance(count, int) or not 1 <= count <= MAX_STEP_COUNT:
+                        raise ValueError(f"Step count must be 1 to {MAX_STEP_COUNT}")
+                    until = compile_condition(message["until"]) if "until" in message else None
+                    trace_mode = check_trace_mode(message.get("trace", "full"))
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    before = simulator.state.instruction_count
+                    trace_log = simulator.run(count, trace_mode, until)
+                    steps = simulator.state.instruction_count - before
+                    count_instructions("step", steps)
+                    await send_state(websocket, sync, {
+                        "type": "state",
+                        "steps": steps,
+                        "trace_log": trace_log,
+                        "watchpoint": simulator.watchpoints.take_hit()
+                    })
+            
+            elif action in ("run", "run_until"):
                 max_steps = message.get("max_steps", 10000)
-                trace_log = simulator.run(max_steps)
-                await websocket.send_json({
-                    "type": "complete",
-                    "state": simulator.get_state_dict(),
-                    "trace_log": trace_log
-                })
+                # Runs execute in scheduler quanta on a task so this loop
+                # keeps taking pause/resume/cancel; "stream" adds progress
+                # messages and "priority" weights this session's CPU share.
+                # "until" is a condition checked before every instruction.
+                try:
+                    if action == "run_until" and "until" not in message:
+                        raise ValueError("run_until needs a condition")
+                    until = compile_condition(message["until"]) if "until" in message else None
+                    # "full", "none" or the number of most recent entries
+                    trace_mode = check_trace_mode(message.get("trace", "full"))
+                    if session.client is None:
+                        session.client = scheduler.client()
+                    if "priority" in message:
+                        session.client.set_priority(message["priority"])
+                    run = StreamingRun(simulator, send, max_steps, trace_mode,
+                                       message.get("stream", False), scheduler.quantum,
+                                       scheduler=scheduler, client=session.client, until=until)
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    session.run = run
+                    session.run_task = asyncio.create_task(finish_run(websocket, session.run))
+            
+            elif action in ("pause", "resume", "cancel"):
+                if not running():
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": "No run in progress"
+                    })
+                elif action == "cancel":
+                    # the run task sends "complete" with status "cancelled"
+                    session.run.cancel()
+                elif action == "pause":
+                    session.run.pause()
+                    await send({"type": "paused"})
+                else:
+                    session.run.resume()
+                    await send({"type": "resumed"})
+            
+            elif action == "trace":
+                last = message.get("last")
+                if last is not None and (not isinstance(last, int) or isinstance(last, bool)):
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": f"Invalid trace length: {last!r}"
+                    })
+                else:
+                    trace_log = simulator.trace_lines(last)
+                    count_trace(trace_log)
+                    await websocket.send_json({
+                        "type": "trace",
+                        "trace_log": trace_log
+                    })
             
             elif action == "reset":
                 simulator.reset()
-                await websocket.send_json({
-                    "type": "state",
-                    "state": simulator.get_state_dict()
-                })
+                await send_state(websocket, sync, {"type": "state"})
             
             elif action == "set_breakpoint":
-                addr = message.get("address")
-                if addr is not None:
-                    simulator.breakpoints.append(addr)
+                try:
+                    addr = message_int(message, "address")
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    simulator.breakpoints.add(addr)
                     await websocket.send_json({
                         "type": "breakpoint_set",
                         "address": addr
                     })
             
             elif action == "clear_breakpoint":
-                addr = message.get("address")
-                if addr is not None and addr in simulator.breakpoints:
-                    simulator.breakpoints.remove(addr)
+                try:
+                    addr = message_int(message, "address")
+                except ValueError as e:
                     await websocket.send_json({
-                        "type": "breakpoint_cleared",
-                        "address": addr
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    if addr in simulator.breakpoints:
+                        simulator.breakpoints.discard(addr)
+                        await websocket.send_json({
+                            "type": "breakpoint_cleared",
+                            "address": addr
+                        })
+            
+            elif action == "set_watchpoint":
+                # memory[start:end], end defaults to one word
+                try:
+                    start = message_int(message, "start", 0)
+                    end = message_int(message, "end", start + 2, high=0x10000)
+                    watch = simulator.watchpoints.add(start, end, message.get("kind", WATCH_WRITE))
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    await websocket.send_json({
+                        "type": "watchpoint_set",
+                        "watchpoint": watch.to_dict()
+                    })
+            
+            elif action == "clear_watchpoint":
+                try:
+                    watch_id = message_int(message, "id", high=2 ** 63)
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    if simulator.watchpoints.remove(watch_id):
+                        await websocket.send_json({
+                            "type": "watchpoint_cleared",
+                            "id": watch_id
+                        })
+            
+            elif action == "sync":
+                # Opt in to delta updates and/or binary state frames;
+                # "window" is the [start, end) memory range state carries,
+                # null for none
+                window = message.get("window", STATE_WINDOW)
+                try:
+                    sync.configure(message.get("mode", SYNC_FULL), message.get("encoding", ENCODING_JSON),
+                                   tuple(window) if window is not None else None)
+                except (TypeError, ValueError) as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    await send_state(websocket, sync, {"type": "state"})
+            
+            elif action == "read_memory":
+                # Reply header, then the bytes as a memory frame
+                try:
+                    # Checked before anything is sent, as the frame header
+                    # holds them in 16 bits
+                    frame_id = message_int(message, "id", 0)
+                    start = message_int(message, "start", 0)
+                    length = message_int(message, "length", 256, high=0x10000)
+                    data = simulator.read_memory(start, length)
+                except (TypeError, ValueError) as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    await websocket.send_json({
+                        "type": "memory",
+                        "id": frame_id,
+                        "start": start,
+                        "length": length
                     })
+                    await websocket.send_bytes(encode_memory_frame(frame_id, start, data))
+            
+            elif action == "write_memory":
+                # A memory frame (id, address, bytes) sent as binary
+                try:
+                    frame_id, address, data = decode_memory_frame(message["frame"])
+                    length = simulator.write_memory(address, data)
+                except (KeyError, ValueError) as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    await send_state(websocket, sync, {
+                        "type": "memory_written",
+                        "id": frame_id,
+                        "address": address,
+                        "length": length
+                    })
+            
+            elif action == "viewport":
+                # Watch memory[start:end]; its bytes are pushed as memory
+                # frames tagged with id now and whenever they change
+                try:
+                    viewport_id = message_int(message, "id", 0)
+                    start = message_int(message, "start", 0)
+                    end = message_int(message, "end", min(start + 256, 0x10000), high=0x10000)
+                    sync.set_viewport(viewport_id, start, end)
+                except (TypeError, ValueError) as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    await websocket.send_json({
+                        "type": "viewport",
+                        "id": viewport_id,
+                        "start": start,
+                        "end": end
+                    })
+                    for frame in sync.viewport_frames():
+                        await websocket.send_bytes(frame)
+            
+            elif action == "clear_viewport":
+                try:
+                    viewport_id = message_int(message, "id")
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    if sync.clear_viewport(viewport_id):
+                        await websocket.send_json({
+                            "type": "viewport_cleared",
+                            "id": viewport_id
+                        })
+            
+            elif action == "resync":
+                # Full state for a client that missed a delta
+                sync.invalidate()
+                await send_state(websocket, sync, {"type": "state"})
+            
+            elif action == "history":
+                try:
+                    if message.get("enabled", True):
+                        # Limits are clamped so one message can't allocate
+                        # an arbitrarily large journal
+                        simulator.enable_history(*history_limits(
+                            message.get("max_bytes", DEFAULT_JOURNAL_BYTES),
+                            message.get("max_checkpoints", DEFAULT_MAX_CHECKPOINTS)))
+                    else:
+                        simulator.disable_history()
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    await websocket.send_json({
+                        "type": "history",
+                        "enabled": simulator.history is not None
+                    })
+            
+            elif action == "profile":
+                # "enabled" starts profiling from zero or stops it; the
+                # reply carries the report so far
+                enabled = message.get("enabled")
+                try:
+                    start_address = message_int(message, "start_address", 0)
+                    top = message_int(message, "top", DEFAULT_TOP, high=0x10000)
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    if enabled:
+                        simulator.enable_profiler()
+                    elif enabled is not None:
+                        simulator.disable_profiler()
+                    await websocket.send_json({
+                        "type": "profile",
+                        "enabled": simulator.profiler is not None,
+                        "profile": profile_report(simulator, session.assembly, start_address, top)
+                    })
+            
+            elif action == "timing":
+                # "enabled" with optional cache/penalty/sampling settings
+                # starts a fresh timing model; false removes it
+                enabled = message.get("enabled")
+                try:
+                    if enabled:
+                        simulator.enable_timing(timing_from_dict(message))
+                    elif enabled is not None:
+                        simulator.disable_timing()
+                except (TypeError, ValueError) as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    await websocket.send_json({
+                        "type": "timing",
+                        "enabled": simulator.timing is not None,
+                        "timing": simulator.timing.stats() if simulator.timing is not None else None
+                    })
+            
+            elif action == "checkpoint":
+                checkpoint_id = simulator.checkpoint()
+                await websocket.send_json({
+                    "type": "checkpoint",
+                    "id": checkpoint_id,
+                    "checkpoints": list(simulator.history.checkpoints)
+                })
+            
+            elif action == "restore":
+                try:
+                    simulator.restore(message_int(message, "id", high=2 ** 63))
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                except KeyError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e.args[0])
+                    })
+                else:
+                    await send_state(websocket, sync, {"type": "state"})
+            
+            elif action == "step_back":
+                try:
+                    count = message_int(message, "count", 1, high=2 ** 63)
+                except ValueError as e:
+                    await websocket.send_json({
+                        "type": "error",
+                        "message": str(e)
+                    })
+                else:
+                    steps = simulator.step_back(count)
+                    await send_state(websocket, sync, {
+                        "type": "state",
+                        "steps": steps
+                    })
+            
+            ws_message_seconds.observe(time.perf_counter() - started,
+                                       action if action in WS_ACTIONS else "other")
             
     except WebSocketDisconnect:
         pass
@@ -123,6 +778,9 @@ async def websocket_simulate(websocket: WebSocket):
             "type": "error",
             "message": str(e)
         })
+    finally:
+        ws_connections.dec()
+        session_manager.close(session, websocket)
 
 
 if __name__ == "__main__":
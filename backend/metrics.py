@@ -0,0 +1,161 @@
+# Prometheus-style metrics: counters, gauges and histograms in text format
+# Vishanth Dandu
+
+import bisect
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Bytes
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+LabelValues = Tuple[str, ...]
+# What a collect function returns: one value, or values by label values
+Collected = Union[float, Dict[LabelValues, float]]
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, bool) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    # One metric family. Values are kept per tuple of label values, in the
+    # order of labels. Given collect, values are read from it at render
+    # time instead, for figures other objects already keep.
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 collect: Optional[Callable[[], Collected]] = None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values: Dict[LabelValues, float] = {}
+
+    def _collected(self) -> Dict[LabelValues, float]:
+        if self.collect is None:
+            return self.values
+        value = self.collect()
+        return value if isinstance(value, dict) else {(): value}
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        # (name, formatted labels, value)
+        for values, value in sorted(self._collected().items()):
+            yield self.name, _format_labels(self.labels, values), value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, *labels: str):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+    def inc(self, amount: float = 1, *labels: str):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, amount: float = 1, *labels: str):
+        self.inc(-amount, *labels)
+
+
+class Histogram(Metric):
+    # Cumulative buckets with upper bounds `buckets`, plus _sum and _count
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: [count per bucket..., +Inf count, sum]
+        self.series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        names = self.labels + ('le',)
+        for values, series in sorted(self.series.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                total += count
+                yield (f"{self.name}_bucket",
+                       _format_labels(names, values + (_format_value(bound),)), total)
+            yield f"{self.name}_sum", _format_labels(self.labels, values), series[-1]
+            yield f"{self.name}_count", _format_labels(self.labels, values), total
+
+
+class RateMeter:
+    # Events per second over the last `window` seconds, from per-second
+    # buckets; add() is O(1) and nothing runs between calls
+    def __init__(self, window: int = 10, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.clock = clock
+        self._counts = [0] * window
+        self._second = int(clock())
+
+    def _advance(self, now: int):
+        elapsed = now - self._second
+        if elapsed >= self.window:
+            self._counts[:] = [0] * self.window
+        else:
+            for second in range(self._second + 1, now + 1):
+                self._counts[second % self.window] = 0
+        self._second = max(self._second, now)
+
+    def add(self, count: float):
+        now = int(self.clock())
+        if now != self._second:
+            self._advance(now)
+        self._counts[now % self.window] += count
+
+    def rate(self) -> float:
+        self._advance(int(self.clock()))
+        return sum(self._counts) / self.window
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def add(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,116 @@
+# Execution profiler: opcode counts, PC hotspots, branches and loops
+# Vishanth Dandu
+
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional
+
+from assembler import Assembler
+from dispatch import FLAG_Z, get_dispatch_table, op_brz, op_jmp
+
+DEFAULT_TOP = 10
+# A fall-through can leave pc up to two bytes past the end of memory, where
+# the fetch halts the CPU
+PC_SLOTS = 0x10000 + 2
+
+OPCODE_NAMES = {opcode: name for name, opcode in Assembler.OPCODES.items()}
+
+
+def opcode_name(opcode: int) -> str:
+    return OPCODE_NAMES.get(opcode, f"UNKNOWN({opcode})")
+
+
+class Profiler:
+    # Counters filled in by the simulator's instrumented loop and step():
+    # executions per PC, per opcode, and taken BRZs per PC. Everything
+    # else (branch ratios, loops, source lines) is worked out in report().
+
+    def __init__(self):
+        self.pc_counts = array('Q', bytes(8 * PC_SLOTS))
+        self.opcode_counts = array('Q', bytes(8 * 16))
+        self.taken = array('Q', bytes(8 * PC_SLOTS))
+
+    def clear(self):
+        for counts in (self.pc_counts, self.opcode_counts, self.taken):
+            counts[:] = array('Q', bytes(8 * len(counts)))
+
+    def record(self, pc: int, instruction: int, flag_bits: int):
+        # Count one instruction about to run at pc
+        self.pc_counts[pc] += 1
+        self.opcode_counts[instruction >> 12] += 1
+        if instruction >> 12 == 0x9 and flag_bits & FLAG_Z:
+            self.taken[pc] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.opcode_counts)
+
+    @property
+    def nbytes(self) -> int:
+        return 8 * (len(self.pc_counts) + len(self.opcode_counts) + len(self.taken))
+
+    def report(self, memory, top: int = DEFAULT_TOP, labels: Optional[Dict[str, int]] = None,
+               source_map: Optional[Dict[int, int]] = None,
+               source_lines: Optional[List[str]] = None) -> dict:
+        # JSON-ready summary. Branch targets are decoded from the words now
+        # in memory. labels name addresses as label+offset; source_map
+        # (address -> 1-based line) and source_lines add the source text.
+        table = get_dispatch_table()
+        counts = self.pc_counts
+        executed = [pc for pc in range(len(counts)) if counts[pc]]
+        named = sorted((address, name) for name, address in (labels or {}).items())
+        addresses = [address for address, _ in named]
+
+        def where(pc: int) -> dict:
+            info = {'pc': pc}
+            i = bisect_right(addresses, pc)
+            if i:
+                address, name = named[i - 1]
+                info['label'] = name if address == pc else f"{name}+{pc - address}"
+            line = source_map.get(pc) if source_map is not None else None
+            if line is not None:
+                info['line'] = line
+                if source_lines is not None and 0 < line <= len(source_lines):
+                    info['source'] = source_lines[line - 1].strip()
+            return info
+
+        hotspots = []
+        for pc in sorted(executed, key=lambda pc: -counts[pc])[:top]:
+            info = where(pc)
+            info['count'] = counts[pc]
+            hotspots.append(info)
+
+        branches = []
+        loops = []
+        for pc in executed:
+            if pc >= 0xFFFF:
+                continue
+            word = memory[pc] | (memory[pc + 1] << 8)
+            handler, _, offset, _ = table[word]
+            if handler is op_brz:
+                info = where(pc)
+                taken = self.taken[pc]
+                info.update(executed=counts[pc], taken=taken, not_taken=counts[pc] - taken,
+                            taken_ratio=taken / counts[pc])
+                branches.append(info)
+            elif handler is not op_jmp:
+                continue
+            start = pc + offset
+            if offset > 0 or start < 0:
+                continue
+            # A backward edge closes a loop over [target, pc]
+            iterations = counts[pc] if handler is op_jmp else self.taken[pc]
+            if not iterations:
+                continue
+            loop = {'start': where(start), 'end': where(pc), 'iterations': iterations,
+                    'instructions': sum(counts[start:pc + 2])}
+            loops.append(loop)
+        loops.sort(key=lambda loop: -loop['instructions'])
+
+        return {
+            'instructions': self.total,
+            'opcodes': {opcode_name(op): n for op, n in enumerate(self.opcode_counts) if n},
+            'hotspots': hotspots,
+            'branches': branches,
+            'loops': loops[:top],
+        }
@@ -0,0 +1,247 @@
+# Fair scheduling of simulator runs across sessions
+# Vishanth Dandu
+
+import asyncio
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, List, Optional, Tuple
+
+from conditions import Condition
+from simulator import Simulator
+from tracebuf import TraceBuffer
+
+DEFAULT_QUANTUM = 5000
+MIN_PRIORITY = 0.25
+MAX_PRIORITY = 4.0
+# Smoothing factor for the recent wait-time average
+WAIT_SMOOTHING = 0.1
+# How long a worker is kept for a client that is still owed CPU to queue
+# its next quantum before others get it, in seconds
+HOLD_TIME = 0.002
+
+
+class BudgetExhausted(Exception):
+    def __init__(self, used: float):
+        self.used = used
+        super().__init__(f"CPU budget exhausted after {used:.2f}s")
+
+
+class Client:
+    # Scheduling state of one session. priority weights its share of the
+    # workers; cpu_budget caps its total simulation CPU seconds.
+    __slots__ = ('priority', 'cpu_budget', 'cpu_used', 'vtime', 'steps', 'quanta')
+
+    def __init__(self, priority: float = 1.0, cpu_budget: Optional[float] = None):
+        self.priority = priority
+        self.cpu_budget = cpu_budget
+        self.cpu_used = 0.0
+        # CPU seconds used, divided by priority; lowest runs next
+        self.vtime = 0.0
+        self.steps = 0
+        self.quanta = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.cpu_budget is not None and self.cpu_used >= self.cpu_budget
+
+    def set_priority(self, priority: float):
+        # Clamped to MIN_PRIORITY..MAX_PRIORITY; ValueError for a non-number
+        if (isinstance(priority, bool) or not isinstance(priority, (int, float))
+                or priority != priority):
+            raise ValueError(f"Priority must be a number: {priority!r}")
+        self.priority = min(max(float(priority), MIN_PRIORITY), MAX_PRIORITY)
+
+    def stats(self) -> dict:
+        return {'priority': self.priority, 'cpu_budget': self.cpu_budget,
+                'cpu_used': self.cpu_used, 'steps': self.steps, 'quanta': self.quanta}
+
+
+class _Quantum:
+    __slots__ = ('client', 'simulator', 'count', 'buffer', 'until', 'future', 'queued', 'work')
+
+    def __init__(self, client: Client, simulator: Simulator, count: int,
+                 buffer: Optional[TraceBuffer], until: Optional[Condition],
+                 future: asyncio.Future):
+        self.client = client
+        self.simulator = simulator
+        self.count = count
+        self.buffer = buffer
+        self.until = until
+        self.future = future
+        self.queued = time.perf_counter()
+        # the executor future once dispatched
+        self.work: Optional[asyncio.Future] = None
+
+
+def _run_quantum(simulator: Simulator, count: int, buffer: Optional[TraceBuffer],
+                 until: Optional[Condition]) -> Tuple[Optional[str], float, int]:
+    # Worker side: (note, CPU seconds, instructions executed)
+    started = time.thread_time()
+    before = simulator.state.instruction_count
+    note = simulator.execute(count, buffer, until)
+    return note, time.thread_time() - started, simulator.state.instruction_count - before
+
+
+class Scheduler:
+    # Runs quanta of simulator.execute() on worker threads, off the event
+    # loop, so assembling, stepping and other sessions' messages are
+    # served while long runs go on.
+    #
+    # Ready quanta wait in a heap ordered by their client's virtual time
+    # (CPU seconds used / priority), so busy sessions interleave and each
+    # gets CPU in proportion to its priority. A client coming back from
+    # idle starts at the current virtual clock instead of catching up on
+    # time it did not use. A client's next quantum is only queued once the
+    # previous one has been handled on the event loop, so when a finished
+    # client is still furthest behind, its worker is held for it briefly.
+
+    def __init__(self, workers: int = 1, quantum: int = DEFAULT_QUANTUM,
+                 cpu_budget: Optional[float] = None):
+        self.workers = workers
+        self.quantum = quantum
+        self.cpu_budget = cpu_budget
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._ready: List[Tuple[float, int, _Quantum]] = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._vclock = 0.0
+        self._held: Optional[Client] = None
+        self._hold_timer: Optional[asyncio.TimerHandle] = None
+        # metrics
+        self.dispatched = 0
+        self.quanta = 0
+        self.steps = 0
+        self.cpu_time = 0.0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_recent = 0.0
+        self.max_depth = 0
+        self.exhausted = 0
+        # called on the event loop with the instructions of each quantum
+        self.on_quantum: Optional[Callable[[int], None]] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='simulate')
+        return self._executor
+
+    def client(self, priority: float = 1.0, cpu_budget: Optional[float] = None) -> Client:
+        client = Client(cpu_budget=self.cpu_budget if cpu_budget is None else cpu_budget)
+        client.set_priority(priority)
+        return client
+
+    async def execute(self, client: Client, simulator: Simulator, count: int,
+                      buffer: Optional[TraceBuffer] = None,
+                      until: Optional[Condition] = None) -> Optional[str]:
+        # simulator.execute(count, buffer, until) on a worker once it is client's
+        # turn. Raises BudgetExhausted when the client has used its budget.
+        if client.exhausted:
+            self.exhausted += 1
+            raise BudgetExhausted(client.cpu_used)
+        loop = asyncio.get_running_loop()
+        quantum = _Quantum(client, simulator, count, buffer, until, loop.create_future())
+        client.vtime = max(client.vtime, self._vclock)
+        heapq.heappush(self._ready, (client.vtime, next(self._seq), quantum))
+        self.max_depth = max(self.max_depth, len(self._ready))
+        if self._held is client:
+            self._release(loop)
+        else:
+            self._dispatch(loop)
+        try:
+            return await quantum.future
+        except asyncio.CancelledError:
+            # Hand the simulator back only once the worker is done with it
+            if quantum.work is not None and not quantum.work.done():
+                await asyncio.wait([quantum.work])
+            raise
+
+    def _hold(self, loop: asyncio.AbstractEventLoop, client: Client):
+        self._held = client
+        self._hold_timer = loop.call_later(HOLD_TIME, self._release, loop)
+
+    def _release(self, loop: asyncio.AbstractEventLoop):
+        self._held = None
+        if self._hold_timer is not None:
+            self._hold_timer.cancel()
+            self._hold_timer = None
+        self._dispatch(loop)
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop):
+        free = self.workers - (self._held is not None)
+        while self._ready and self._running < free:
+            vtime, _, quantum = heapq.heappop(self._ready)
+            if quantum.future.cancelled():
+                # the run was cancelled while it waited
+                continue
+            self._vclock = vtime
+            wait = time.perf_counter() - quantum.queued
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.wait_recent += WAIT_SMOOTHING * (wait - self.wait_recent)
+            self.dispatched += 1
+            self._running += 1
+            work = quantum.work = loop.run_in_executor(self.executor, _run_quantum, quantum.simulator,
+                                                       quantum.count, quantum.buffer, quantum.until)
+            work.add_done_callback(partial(self._finished, loop, quantum))
+
+    def _finished(self, loop: asyncio.AbstractEventLoop, quantum: _Quantum, work: asyncio.Future):
+        self._running -= 1
+        future = quantum.future
+        client = quantum.client
+        if work.cancelled():
+            if not future.done():
+                future.cancel()
+        elif work.exception() is not None:
+            if not future.done():
+                future.set_exception(work.exception())
+        else:
+            note, cpu, steps = work.result()
+            client.cpu_used += cpu
+            client.vtime += cpu / client.priority
+            client.steps += steps
+            client.quanta += 1
+            self.quanta += 1
+            self.steps += steps
+            self.cpu_time += cpu
+            if self.on_quantum is not None:
+                self.on_quantum(steps)
+            if not future.done():
+                future.set_result(note)
+                if (self._held is None and self._ready and not client.exhausted
+                        and client.vtime < self._ready[0][0]):
+                    self._hold(loop, client)
+                    return
+        self._dispatch(loop)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, quantum in self._ready if not quantum.future.cancelled())
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'quantum': self.quantum,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_depth,
+            'running': self._running,
+            'quanta': self.quanta,
+            'steps': self.steps,
+            'cpu_time': self.cpu_time,
+            'wait_avg': self.wait_total / self.dispatched if self.dispatched else 0.0,
+            'wait_recent': self.wait_recent,
+            'wait_max': self.wait_max,
+            'budget_exhausted': self.exhausted,
+        }
+
+    def shutdown(self):
+        if self._hold_timer is not None:
+            self._hold_timer.cancel()
+            self._hold_timer = None
+        self._held = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
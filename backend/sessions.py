@@ -0,0 +1,167 @@
+# Simulator sessions that survive WebSocket reconnects
+# Vishanth Dandu
+
+import asyncio
+import secrets
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from incremental import AssemblySession
+from scheduler import Client
+from simulator import Simulator
+from statesync import StateSync
+from streaming import StreamingRun
+
+DEFAULT_SESSION_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_POOL_SIZE = 8
+# Rough per-line footprint of an incremental assembly's caches
+ASSEMBLY_LINE_BYTES = 200
+
+
+class Session:
+    # Everything a connection keeps between messages. owner is the
+    # connection currently attached, None while the session waits for a
+    # reconnect.
+    __slots__ = ('id', 'simulator', 'sync', 'assembly', 'run', 'run_task', 'client', 'owner',
+                 'nbytes')
+
+    def __init__(self, session_id: str, simulator: Simulator):
+        self.id = session_id
+        self.simulator = simulator
+        self.sync = StateSync(simulator)
+        self.assembly: Optional[AssemblySession] = None
+        self.run: Optional[StreamingRun] = None
+        self.run_task: Optional[asyncio.Task] = None
+        # scheduler state, kept across runs so budgets and fairness hold
+        self.client: Optional[Client] = None
+        self.owner: Optional[object] = None
+        self.nbytes = 0
+
+    def running(self) -> bool:
+        return self.run_task is not None and not self.run_task.done()
+
+    def cancel_run(self):
+        if self.running():
+            self.run_task.cancel()
+
+    def memory_usage(self) -> int:
+        total = self.simulator.memory_usage()
+        if self.assembly is not None:
+            total += ASSEMBLY_LINE_BYTES * len(self.assembly.lines)
+        return total
+
+
+class SessionManager:
+    # Sessions by id in least-recently-used order.
+    #
+    # A detached session stays resumable until the byte or session-count
+    # budget needs its room; the oldest detached sessions go first and
+    # attached ones are never evicted. Sizes are measured when a session
+    # opens and detaches, and for attached sessions again by stats().
+    # Evicted simulators are reset and pooled, along with a few made up
+    # front, so a new connection starts without allocating one.
+    #
+    # Detaching cancels the session's run; a reconnect gets the simulator
+    # back where the run stopped, not the run itself. A simulator whose
+    # cancelled run is still finishing a quantum on a worker is pooled
+    # only once its run task is done.
+
+    def __init__(self, max_bytes: int = DEFAULT_SESSION_BYTES,
+                 max_sessions: int = DEFAULT_MAX_SESSIONS, pool_size: int = DEFAULT_POOL_SIZE):
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self.pool_size = pool_size
+        self.sessions: 'OrderedDict[str, Session]' = OrderedDict()
+        self._pool: List[Simulator] = [Simulator() for _ in range(pool_size)]
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, session_id: str) -> Optional[Session]:
+        return self.sessions.get(session_id)
+
+    def open(self, owner: object, session_id: Optional[str] = None) -> Tuple[Session, bool]:
+        # Attach owner to session_id if it is still held, else to a new
+        # session. Returns (session, resumed). A resumed session that is
+        # still attached elsewhere (a reconnect racing the old socket's
+        # close) is taken over and its run cancelled.
+        session = self.sessions.get(session_id) if session_id else None
+        resumed = session is not None
+        if resumed:
+            self.sessions.move_to_end(session_id)
+            if session.owner is not None:
+                session.cancel_run()
+            # the client's copy of the state is unknown
+            session.sync.invalidate()
+        else:
+            session = Session(secrets.token_urlsafe(16), self._take())
+            session.nbytes = session.memory_usage()
+            self.sessions[session.id] = session
+        session.owner = owner
+        self.evict()
+        return session, resumed
+
+    def close(self, session: Session, owner: object):
+        # Detach owner; no-op if the session was taken over since
+        if session.owner is not owner:
+            return
+        session.cancel_run()
+        session.owner = None
+        session.nbytes = session.memory_usage()
+        self.evict()
+
+    def discard(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.cancel_run()
+        session.owner = None
+        self._recycle_when_idle(session)
+        return True
+
+    def evict(self):
+        # Drop least recently used detached sessions until both budgets hold
+        total = sum(session.nbytes for session in self.sessions.values())
+        if total <= self.max_bytes and len(self.sessions) <= self.max_sessions:
+            return
+        for session_id, session in list(self.sessions.items()):
+            if total <= self.max_bytes and len(self.sessions) <= self.max_sessions:
+                break
+            if session.owner is not None:
+                continue
+            del self.sessions[session_id]
+            total -= session.nbytes
+            self.evictions += 1
+            self._recycle_when_idle(session)
+
+    def _take(self) -> Simulator:
+        return self._pool.pop() if self._pool else Simulator()
+
+    def _recycle_when_idle(self, session: Session):
+        if session.running():
+            session.run_task.add_done_callback(lambda _: self._recycle(session.simulator))
+        else:
+            self._recycle(session.simulator)
+
+    def _recycle(self, simulator: Simulator):
+        if len(self._pool) < self.pool_size:
+            simulator.reset()
+            simulator.disable_history()
+            simulator.disable_profiler()
+            simulator.disable_timing()
+            simulator.compile_blocks = True
+            self._pool.append(simulator)
+
+    def stats(self) -> dict:
+        attached = 0
+        total = 0
+        for session in self.sessions.values():
+            if session.owner is not None:
+                attached += 1
+                session.nbytes = session.memory_usage()
+            total += session.nbytes
+        return {'sessions': len(self.sessions), 'attached': attached,
+                'pooled': len(self._pool), 'bytes': total, 'max_bytes': self.max_bytes,
+                'max_sessions': self.max_sessions, 'evictions': self.evictions}
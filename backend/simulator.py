@@ -1,20 +1,145 @@
 # ISA Simulator - 16-bit instruction set simulator
 # Vishanth Dandu
 
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass, field
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import MutableMapping
+from typing import List, Mapping, Optional, Set, Tuple, Union
+
+from blocks import BlockCache
+from conditions import Condition
+from dispatch import (FLAG_C, FLAG_N, FLAG_Z, ZN_FLAGS, format_trace, get_dispatch_table,
+                      op_brz, op_jmp, op_load, op_store)
+from history import DEFAULT_JOURNAL_BYTES, DEFAULT_MAX_CHECKPOINTS, History
+from image import ProgramImage, read_image, release_image
+from profiler import Profiler
+from timing import TimingModel
+from tracebuf import TRACE_FULL, TraceBuffer, make_trace_buffer
+from watch import PAGE_SHIFT, WatchSet
+
+MEMORY_SIZE = 0x10000  # 64KB
+# Memory range get_state_dict() includes by default
+STATE_MEMORY_WINDOW = (0, 1024)
+
+FLAG_BITS = {'Z': FLAG_Z, 'N': FLAG_N, 'C': FLAG_C}
+
+_ZERO_MEMORY = bytes(MEMORY_SIZE)
+_WORD = struct.Struct('<H')
+
+
+def check_range(start: int, length: int):
+    # Raise ValueError unless memory[start:start + length] is in bounds
+    if not (0 <= start and 0 <= length and start + length <= MEMORY_SIZE):
+        raise ValueError(f"Memory range out of bounds: {start:#06x}+{length}")
+
+
+def pack_flags(flags: Mapping[str, bool]) -> int:
+    bits = 0
+    for name, value in flags.items():
+        if value:
+            bits |= FLAG_BITS[name]
+    return bits
+
+
+class FlagView(MutableMapping):
+    # dict-style access to the packed flag bits of a CPUState
+    __slots__ = ('_state',)
+    
+    def __init__(self, state: 'CPUState'):
+        self._state = state
+    
+    def __getitem__(self, name: str) -> bool:
+        return bool(self._state.flag_bits & FLAG_BITS[name])
+    
+    def __setitem__(self, name: str, value: bool):
+        bit = FLAG_BITS[name]
+        if value:
+            self._state.flag_bits |= bit
+        else:
+            self._state.flag_bits &= ~bit
+    
+    def __delitem__(self, name: str):
+        raise TypeError("CPU flags cannot be removed")
+    
+    def __iter__(self):
+        return iter(FLAG_BITS)
+    
+    def __len__(self) -> int:
+        return len(FLAG_BITS)
+    
+    def __repr__(self) -> str:
+        return repr(dict(self))
 
 
-@dataclass
 class CPUState:
-    # CPU state storage
-    registers: List[int] = field(default_factory=lambda: [0] * 8)
-    memory: List[int] = field(default_factory=lambda: [0] * 65536)  # 64KB
-    pc: int = 0
-    flags: Dict[str, bool] = field(default_factory=lambda: {'Z': False, 'N': False, 'C': False})
-    halted: bool = False
-    cycle_count: int = 0
-    instruction_count: int = 0
+    # CPU state storage: byte-addressed memory in a single bytearray, the
+    # eight registers as a fixed-length list and Z/N/C packed into flag_bits
+    __slots__ = ('registers', 'memory', 'pc', 'flag_bits', 'halted',
+                 'cycle_count', 'instruction_count')
+    
+    def __init__(self):
+        self.registers: List[int] = [0] * 8
+        self.memory = bytearray(MEMORY_SIZE)
+        self.pc = 0
+        self.flag_bits = 0
+        self.halted = False
+        self.cycle_count = 0
+        self.instruction_count = 0
+    
+    @property
+    def flags(self) -> FlagView:
+        return FlagView(self)
+    
+    @flags.setter
+    def flags(self, values: Mapping[str, bool]):
+        self.flag_bits = pack_flags(values)
+    
+    def clear(self):
+        # Zero everything in place so existing memory views stay valid
+        self.memory[:] = _ZERO_MEMORY
+        self.registers[:] = [0] * 8
+        self.pc = 0
+        self.flag_bits = 0
+        self.halted = False
+        self.cycle_count = 0
+        self.instruction_count = 0
+    
+    def read_word(self, addr: int) -> int:
+        # Little-endian 16-bit read
+        return _WORD.unpack_from(self.memory, addr)[0]
+    
+    def write_word(self, addr: int, value: int):
+        _WORD.pack_into(self.memory, addr, value & 0xFFFF)
+    
+    def write_words(self, addr: int, words: List[int]) -> int:
+        # Bulk little-endian write; words that would not fit are dropped.
+        # Returns the number of words written.
+        try:
+            packed = array('H', words)
+        except OverflowError:
+            packed = array('H', [word & 0xFFFF for word in words])
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        count = min(len(packed), max(0, (MEMORY_SIZE - addr) // 2))
+        data = memoryview(packed).cast('B')[:count * 2]
+        self.memory[addr:addr + len(data)] = data
+        return count
+    
+    def memory_view(self, start: int = 0, end: Optional[int] = None) -> memoryview:
+        # Zero-copy, read-only window onto memory
+        return memoryview(self.memory)[start:end].toreadonly()
+    
+    def snapshot(self) -> tuple:
+        return (bytes(self.memory), tuple(self.registers), self.pc, self.flag_bits,
+                self.halted, self.cycle_count, self.instruction_count)
+    
+    def restore(self, snapshot: tuple):
+        memory, registers, self.pc, self.flag_bits, self.halted, \
+            self.cycle_count, self.instruction_count = snapshot
+        self.memory[:] = memory
+        self.registers[:] = registers
 
 
 class InstructionDecoder:
@@ -68,20 +193,33 @@ class Simulator:
     def __init__(self):
         self.state = CPUState()
         self.decoder = InstructionDecoder()
-        self.breakpoints: List[int] = []
-        self.watchpoints: List[int] = []
+        self.table = get_dispatch_table()
+        self.breakpoints: Set[int] = set()
+        self.watchpoints = WatchSet()
+        self.last_trace: Optional[TraceBuffer] = None
+        # trace-free runs compile hot basic blocks
+        self.compile_blocks = True
+        self.block_cache = BlockCache()
+        # undo journal and checkpoints, None until enabled
+        self.history: Optional[History] = None
+        # execution counters, None until enabled
+        self.profiler: Optional[Profiler] = None
+        # cache/pipeline cycle accounting, None until enabled
+        self.timing: Optional[TimingModel] = None
     
     def reset(self):
         # clear everything
-        self.state.memory = [0] * 65536
-        self.state.pc = 0
-        self.state.halted = False
-        self.state.cycle_count = 0
-        self.state.instruction_count = 0
-        self.state.registers = [0] * 8
-        self.state.flags = {'Z': False, 'N': False, 'C': False}
-        self.breakpoints = []
-        self.watchpoints = []
+        self.state.clear()
+        self.breakpoints.clear()
+        self.watchpoints.clear()
+        self.last_trace = None
+        self.block_cache.clear()
+        if self.history is not None:
+            self.history.clear()
+        if self.profiler is not None:
+            self.profiler.clear()
+        if self.timing is not None:
+            self.timing.clear()
     
     def load_program(self, binary: List[int], start_address: int = 0):
         # reset and load program
@@ -89,14 +227,69 @@ class Simulator:
         self.state.halted = False
         self.state.cycle_count = 0
         self.state.instruction_count = 0
-        self.state.registers = [0] * 8
-        self.state.flags = {'Z': False, 'N': False, 'C': False}
+        self.state.registers[:] = [0] * 8
+        self.state.flag_bits = 0
         
-        for i, word in enumerate(binary):
-            addr = start_address + (i * 2)
-            if addr < len(self.state.memory) - 1:
-                self.state.memory[addr] = word & 0xFF
-                self.state.memory[addr + 1] = (word >> 8) & 0xFF
+        # words at or past the last byte of memory are skipped
+        if 0 <= start_address < MEMORY_SIZE - 1:
+            self.state.write_words(start_address, binary)
+        self.block_cache.clear()
+        if self.history is not None:
+            self.history.clear()
+    
+    def load_image(self, image: ProgramImage):
+        # Like load_program, but copies each section straight into memory
+        # and starts at the image's entry
+        memory = self.state.memory
+        for section in image.sections:
+            memory[section.address:section.address + len(section.data)] = section.data
+        self.load_program([], image.entry)
+    
+    def load_image_file(self, path: str) -> dict:
+        # Load an image file through a read-only memory map, so section
+        # data is copied from the page cache once. Returns its symbols.
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            image = read_image(mapped)
+            try:
+                self.load_image(image)
+            finally:
+                release_image(image)
+        return image.symbols
+    
+    def read_memory(self, start: int, length: int) -> bytes:
+        check_range(start, length)
+        return bytes(self.state.memory_view(start, start + length))
+    
+    def write_memory(self, address: int, data) -> int:
+        # Copy a bytes-like object into memory with one slice assignment.
+        # Compiled blocks over the range are dropped and history notes the
+        # write; watchpoints do not fire. Returns the number of bytes.
+        with memoryview(data) as raw, raw.cast('B') as view:
+            length = len(view)
+            check_range(address, length)
+            self.state.memory[address:address + length] = view
+        if length:
+            self.block_cache.invalidate(address, address + length)
+            if self.history is not None:
+                self.history.note_write(address, address + length)
+        return length
+    
+    def patch_program(self, changes: List[Tuple[int, int]], start_address: int = 0):
+        # Apply (word index, word) changes from an incremental re-assembly
+        # to the loaded program without resetting the CPU
+        if not changes:
+            return
+        addresses = []
+        for index, word in changes:
+            addr = start_address + 2 * index
+            if 0 <= addr < MEMORY_SIZE - 1:
+                self.state.write_word(addr, word)
+                addresses.append(addr)
+        if addresses:
+            low, high = min(addresses), max(addresses) + 2
+            self.block_cache.invalidate(low, high)
+            if self.history is not None:
+                self.history.note_write(low, high)
     
     def fetch_instruction(self) -> int:
         # fetch instruction at PC
@@ -108,89 +301,14 @@ class Simulator:
         return low | (high << 8)
     
     def update_flags(self, result: int):
-        self.state.flags['Z'] = (result == 0)
-        self.state.flags['N'] = (result & 0x8000) != 0
+        self.state.flag_bits = (self.state.flag_bits & FLAG_C) | ZN_FLAGS[result & 0xFFFF]
     
     def execute_instruction(self, instruction: int) -> Optional[str]:
-        opcode = (instruction >> 12) & 0xF
-        trace = f"PC={self.state.pc:04X} I={instruction:04X} "
-        
-        if opcode == 0x0:
-            trace += "NOP"
-        
-        elif opcode == 0x1:
-            _, rd, rs1, rs2 = self.decoder.decode_r_type(instruction)
-            result = self.state.registers[rs1] + self.state.registers[rs2]
-            result &= 0xFFFF
-            self.state.registers[rd] = result
-            self.update_flags(result)
-            self.state.flags['C'] = (result < self.state.registers[rs1])
-            trace += f"ADD R{rd}, R{rs1}, R{rs2}"
-        elif opcode == 0x2:
-            _, rd, rs1, rs2 = self.decoder.decode_r_type(instruction)
-            result = self.state.registers[rs1] - self.state.registers[rs2]
-            result &= 0xFFFF
-            self.state.registers[rd] = result
-            self.update_flags(result)
-            trace += f"SUB R{rd}, R{rs1}, R{rs2}"
-        elif opcode == 0x3:
-            _, rd, rs1, rs2 = self.decoder.decode_r_type(instruction)
-            result = self.state.registers[rs1] & self.state.registers[rs2]
-            self.state.registers[rd] = result
-            self.update_flags(result)
-            trace += f"AND R{rd}, R{rs1}, R{rs2}"
-        elif opcode == 0x4:
-            _, rd, rs1, rs2 = self.decoder.decode_r_type(instruction)
-            result = self.state.registers[rs1] | self.state.registers[rs2]
-            self.state.registers[rd] = result
-            self.update_flags(result)
-            trace += f"OR R{rd}, R{rs1}, R{rs2}"
-        elif opcode == 0x5:
-            _, rd, rs, imm = self.decoder.decode_i_type(instruction)
-            result = self.state.registers[rs] + imm
-            result &= 0xFFFF
-            self.state.registers[rd] = result
-            self.update_flags(result)
-            trace += f"ADDI R{rd}, R{rs}, {imm}"
-        elif opcode == 0x6:
-            _, rd, base, offset = self.decoder.decode_m_type(instruction)
-            addr = (self.state.registers[base] + offset) & 0xFFFF
-            if addr < len(self.state.memory) - 1:
-                low = self.state.memory[addr]
-                high = self.state.memory[addr + 1]
-                self.state.registers[rd] = low | (high << 8)
-            trace += f"LOAD R{rd}, R{base}, {offset}"
-        elif opcode == 0x7:
-            _, rd, base, offset = self.decoder.decode_m_type(instruction)
-            addr = (self.state.registers[base] + offset) & 0xFFFF
-            value = self.state.registers[rd]
-            if addr < len(self.state.memory) - 1:
-                self.state.memory[addr] = value & 0xFF
-                self.state.memory[addr + 1] = (value >> 8) & 0xFF
-            trace += f"STORE R{rd}, R{base}, {offset}"
-        elif opcode == 0x8:
-            _, cond, offset = self.decoder.decode_j_type(instruction)
-            self.state.pc += offset
-            trace += f"JMP {offset:+d}"
-            return trace
-        elif opcode == 0x9:
-            _, cond, offset = self.decoder.decode_j_type(instruction)
-            if self.state.flags['Z']:
-                self.state.pc += offset
-                trace += f"BRZ (taken) {offset:+d}"
-            else:
-                trace += f"BRZ (not taken) {offset:+d}"
-            if self.state.flags['Z']:
-                return trace
-        elif opcode == 0xA:
-            self.state.halted = True
-            trace += "HALT"
-            return trace
-        else:
-            trace += f"UNKNOWN({opcode})"
-        
-        self.state.pc += 2
-        return trace
+        pc = self.state.pc
+        instruction &= 0xFFFF
+        handler, a, b, c = self.table[instruction]
+        handler(self.state, a, b, c)
+        return format_trace(pc, instruction, self.state.flag_bits & FLAG_Z)
     
     def step(self) -> Optional[str]:
         if self.state.halted:
@@ -199,36 +317,282 @@ class Simulator:
         if self.state.pc in self.breakpoints:
             return f"BREAKPOINT at PC={self.state.pc:04X}"
         
+        pc = self.state.pc
         instruction = self.fetch_instruction()
+        entry = self.table[instruction & 0xFFFF]
+        if self.history is not None:
+            self.history.record(pc, entry)
+        if self.profiler is not None:
+            self.profiler.record(pc, instruction, self.state.flag_bits)
+        stall = 0
+        if self.timing is not None:
+            stall = self.timing.account(pc, entry, self.state)
+        if self.watchpoints and (entry[0] is op_load or entry[0] is op_store):
+            # a hit is left in watchpoints.hit
+            self.watchpoints.check(self.state, pc, *entry)
         trace = self.execute_instruction(instruction)
-        self.state.cycle_count += 1
+        self.state.cycle_count += 1 + stall
         self.state.instruction_count += 1
         return trace
     
-    def run(self, max_steps: int = 10000) -> List[str]:
-        trace_log = []
+    def run(self, max_steps: int = 10000, trace: Union[str, int] = TRACE_FULL,
+            until: Optional[Condition] = None) -> List[str]:
+        # trace is TRACE_FULL, TRACE_NONE or the number of most recent
+        # entries to keep. Records are stored raw in self.last_trace and
+        # only formatted here for the entries the caller asked for.
+        buffer = make_trace_buffer(trace)
+        self.last_trace = buffer
+        note = self.execute(max_steps, buffer, until)
+        trace_log = buffer.lines() if buffer is not None else []
+        if note:
+            trace_log.append(note)
+        return trace_log
+    
+    def execute(self, max_steps: int, buffer: Optional[TraceBuffer] = None,
+                until: Optional[Condition] = None) -> Optional[str]:
+        # Same semantics as calling step() in a loop, with the fetch and
+        # dispatch inlined and the counters updated once at the end.
+        # Returns the breakpoint, watchpoint or condition note if one
+        # stopped the run. until is tested before each instruction, like a
+        # breakpoint, so a condition that already holds stops the run
+        # before it starts.
+        timing = self.timing
+        if timing is not None and timing.sample_interval:
+            return self._execute_sampled(timing, max_steps, buffer, until)
+        return self._execute(max_steps, buffer, timing, until)
+    
+    def _break_note(self, pc: int, until: Optional[Condition]) -> str:
+        # Stopped at pc by a breakpoint or a pc-only condition
+        if until is not None and pc not in self.breakpoints:
+            return until.note(pc)
+        return f"BREAKPOINT at PC={pc:04X}"
+    
+    def _execute_sampled(self, timing: TimingModel, max_steps: int,
+                         buffer: Optional[TraceBuffer],
+                         until: Optional[Condition] = None) -> Optional[str]:
+        # Alternate detailed windows with functional fast-forwarding
+        state = self.state
+        steps = 0
+        while not state.halted and steps < max_steps:
+            before = state.instruction_count
+            budget = timing.detailed_budget()
+            if budget:
+                note = self._execute(min(budget, max_steps - steps), buffer, timing, until)
+                steps += state.instruction_count - before
+            else:
+                note = self._execute(min(timing.fast_forward_budget(), max_steps - steps), buffer,
+                                     None, until)
+                done = state.instruction_count - before
+                state.cycle_count += timing.skip(done)
+                steps += done
+            if note:
+                return note
+        return None
+    
+    def _execute(self, max_steps: int, buffer: Optional[TraceBuffer],
+                 timing: Optional[TimingModel],
+                 until: Optional[Condition] = None) -> Optional[str]:
+        # Each kind of run gets its own loop, so runs without a trace,
+        # history, profiler, timing, breakpoints, watchpoints or conditions
+        # pay nothing for them. Conditions on pc alone run as breakpoints.
+        state = self.state
+        memory = state.memory
+        table = self.table
+        breakpoints = self.breakpoints
+        test = None
+        if until is not None:
+            if until.pcs is not None:
+                breakpoints = breakpoints | until.pcs
+            else:
+                test = until.test
+        history = self.history
+        watch = self.watchpoints if self.watchpoints else None
+        profiler = self.profiler
+        instrumented = (buffer is not None or history is not None or watch is not None
+                        or profiler is not None or timing is not None or test is not None)
+        stalls = timing.stall_cycles if timing is not None else 0
         steps = 0
         
-        while not self.state.halted and steps < max_steps:
-            if self.state.pc in self.breakpoints:
-                trace_log.append(f"BREAKPOINT at PC={self.state.pc:04X}")
-                break
-            
-            trace = self.step()
-            if trace:
-                trace_log.append(trace)
-            steps += 1
+        try:
+            if not instrumented and self.compile_blocks:
+                # Hot blocks run as compiled functions; everything else, and
+                # anything that would overrun max_steps or skip a breakpoint,
+                # goes through the interpreter
+                blocks = self.block_cache
+                compiled = blocks.blocks
+                at_entry = True
+                while not state.halted and steps < max_steps:
+                    pc = state.pc
+                    if pc in breakpoints:
+                        return self._break_note(pc, until)
+                    
+                    if at_entry:
+                        block = compiled.get(pc)
+                        if block is None or not memory.startswith(block.code, pc):
+                            block = blocks.lookup(memory, pc)
+                        if (block is not None and steps + block.length <= max_steps
+                                and (not breakpoints or block.interior.isdisjoint(breakpoints))):
+                            steps += block.fn(state, max_steps - steps)
+                            continue
+                    
+                    if 0 <= pc < 0xFFFF:
+                        instruction = memory[pc] | (memory[pc + 1] << 8)
+                    else:
+                        state.halted = True
+                        instruction = 0
+                    handler, a, b, c = table[instruction]
+                    handler(state, a, b, c)
+                    steps += 1
+                    at_entry = handler is op_jmp or handler is op_brz
+            elif not instrumented and breakpoints:
+                while not state.halted and steps < max_steps:
+                    pc = state.pc
+                    if pc in breakpoints:
+                        return self._break_note(pc, until)
+                    
+                    if 0 <= pc < 0xFFFF:
+                        instruction = memory[pc] | (memory[pc + 1] << 8)
+                    else:
+                        state.halted = True
+                        instruction = 0
+                    handler, a, b, c = table[instruction]
+                    handler(state, a, b, c)
+                    steps += 1
+            elif not instrumented:
+                while not state.halted and steps < max_steps:
+                    pc = state.pc
+                    if 0 <= pc < 0xFFFF:
+                        instruction = memory[pc] | (memory[pc + 1] << 8)
+                    else:
+                        state.halted = True
+                        instruction = 0
+                    handler, a, b, c = table[instruction]
+                    handler(state, a, b, c)
+                    steps += 1
+            else:
+                # Trace records, the undo journal, profile counters, timing
+                # and/or watchpoints
+                record = buffer.record if buffer is not None else None
+                journal = history.record if history is not None else None
+                account = timing.account if timing is not None else None
+                watched = watch.pages if watch is not None else None
+                if profiler is not None:
+                    pc_counts = profiler.pc_counts
+                    opcode_counts = profiler.opcode_counts
+                    taken = profiler.taken
+                registers = state.registers
+                cycle = state.cycle_count
+                while not state.halted and steps < max_steps:
+                    pc = state.pc
+                    if pc in breakpoints:
+                        return self._break_note(pc, until)
+                    if test is not None and test(state, steps, cycle + steps):
+                        return until.note(pc)
+                    
+                    if 0 <= pc < 0xFFFF:
+                        instruction = memory[pc] | (memory[pc + 1] << 8)
+                    else:
+                        state.halted = True
+                        instruction = 0
+                    entry = table[instruction]
+                    if journal is not None:
+                        journal(pc, entry)
+                    handler, a, b, c = entry
+                    if profiler is not None:
+                        pc_counts[pc] += 1
+                        opcode_counts[instruction >> 12] += 1
+                        if handler is op_brz and state.flag_bits & FLAG_Z:
+                            taken[pc] += 1
+                    if account is not None:
+                        cycle += account(pc, entry, state)
+                    note = None
+                    if watched is not None and (handler is op_load or handler is op_store):
+                        addr = (registers[b] + c) & 0xFFFF
+                        # only accesses to a watched page take the slow check
+                        if watched[addr >> PAGE_SHIFT] or watched[(addr + 1) >> PAGE_SHIFT]:
+                            note = watch.check(state, pc, handler, a, b, c)
+                    handler(state, a, b, c)
+                    if record is not None:
+                        record(pc, instruction, state.flag_bits & FLAG_Z, cycle + steps)
+                    steps += 1
+                    if note:
+                        return note
+        finally:
+            state.cycle_count += steps
+            state.instruction_count += steps
+            if timing is not None:
+                state.cycle_count += timing.stall_cycles - stalls
         
-        return trace_log
+        return None
+    
+    def enable_history(self, max_journal_bytes: int = DEFAULT_JOURNAL_BYTES,
+                       max_checkpoints: int = DEFAULT_MAX_CHECKPOINTS):
+        # Start journaling; runs take the interpreter path while enabled
+        self.history = History(self.state, max_journal_bytes, max_checkpoints)
+    
+    def disable_history(self):
+        self.history = None
+    
+    def enable_profiler(self):
+        # Start counting from zero; runs take the interpreter path while enabled
+        self.profiler = Profiler()
+    
+    def disable_profiler(self):
+        self.profiler = None
+    
+    def enable_timing(self, model: Optional[TimingModel] = None):
+        # Charge cycles through a timing model (default caches and
+        # penalties); runs take the interpreter path while it is detailed
+        self.timing = model if model is not None else TimingModel()
+    
+    def disable_timing(self):
+        self.timing = None
+    
+    def checkpoint(self) -> int:
+        # Returns an id for restore(); enables history on first use
+        if self.history is None:
+            self.enable_history()
+        return self.history.checkpoint()
+    
+    def restore(self, checkpoint_id: int):
+        if self.history is None:
+            raise KeyError(f"Unknown checkpoint: {checkpoint_id}")
+        self.history.restore(checkpoint_id)
+    
+    def step_back(self, count: int = 1) -> int:
+        # Undo up to count instructions; returns how many were undone
+        if self.history is None:
+            return 0
+        return self.history.step_back(count)
+    
+    def memory_usage(self) -> int:
+        # Approximate bytes held by memory, history, profiler, trace and
+        # compiled blocks
+        total = len(self.state.memory) + self.block_cache.nbytes
+        if self.history is not None:
+            total += self.history.nbytes
+        if self.profiler is not None:
+            total += self.profiler.nbytes
+        if self.last_trace is not None:
+            total += self.last_trace.nbytes
+        return total
+    
+    def trace_lines(self, last: Optional[int] = None) -> List[str]:
+        # Format entries from the last run() on demand
+        if self.last_trace is None:
+            return []
+        return self.last_trace.lines(last)
     
-    def get_state_dict(self) -> dict:
+    def get_state_dict(self, window: Optional[Tuple[int, int]] = STATE_MEMORY_WINDOW) -> dict:
+        # 'memory' holds memory[start:end] of window, [] when window is None
+        start, end = window if window is not None else (0, 0)
         return {
-            'registers': self.state.registers,
+            'registers': list(self.state.registers),
             'pc': self.state.pc,
-            'flags': self.state.flags,
+            'flags': dict(self.state.flags),
             'halted': self.state.halted,
             'cycle_count': self.state.cycle_count,
             'instruction_count': self.state.instruction_count,
-            'memory': self.state.memory[:1024]
+            'memory': list(self.state.memory_view(start, end))
         }
 
@@ -0,0 +1,284 @@
+# CPU state updates for WebSocket clients - full snapshots, deltas and binary frames
+# Vishanth Dandu
+
+import struct
+from typing import Dict, List, Optional, Tuple, Union
+
+from simulator import FLAG_BITS, MEMORY_SIZE, STATE_MEMORY_WINDOW, Simulator, check_range
+
+SYNC_FULL = 'full'
+SYNC_DELTA = 'delta'
+ENCODING_JSON = 'json'
+ENCODING_BINARY = 'binary'
+
+# Memory range covered by updates unless a client picks another
+STATE_WINDOW = STATE_MEMORY_WINDOW
+
+MAX_VIEWPORTS = 16
+
+# Binary frame layout (little-endian):
+#   kind u8, seq u32, register mask u8, field mask u8
+#   one u16 per register in the mask, lowest index first
+#   FIELD_PC:     pc u32
+#   FIELD_FLAGS:  flag_bits | halted << 3, u8
+#   FIELD_COUNTS: cycle_count u64, instruction_count u64
+#   run count u16, then per run: address u16, length u16, bytes
+#
+# Memory frames carry one range, in both directions: reads and viewport
+# pushes from the server, writes from the client.
+#   kind u8, id u16, address u16, length u32, bytes
+FRAME_FULL = 0x01
+FRAME_DELTA = 0x02
+FRAME_MEMORY = 0x03
+FIELD_PC = 0x1
+FIELD_FLAGS = 0x2
+FIELD_COUNTS = 0x4
+
+_HEADER = struct.Struct('<BIBB')
+_PC = struct.Struct('<I')
+_FLAGS = struct.Struct('<B')
+_COUNTS = struct.Struct('<QQ')
+_RUN_COUNT = struct.Struct('<H')
+_RUN = struct.Struct('<HH')
+_MEMORY = struct.Struct('<BHHI')
+
+# Changed bytes closer than this are sent as one run
+RUN_GAP = 4
+_CHUNK = 64
+
+MemoryRuns = List[Tuple[int, bytes]]
+
+
+def diff_memory(old: bytes, new: bytes, base: int = 0) -> MemoryRuns:
+    # (address, bytes) runs where new differs from old
+    if old == new:
+        return []
+    runs: MemoryRuns = []
+    run_start = run_end = -1
+    for chunk in range(0, len(new), _CHUNK):
+        if old[chunk:chunk + _CHUNK] == new[chunk:chunk + _CHUNK]:
+            continue
+        for i in range(chunk, min(chunk + _CHUNK, len(new))):
+            if old[i] != new[i]:
+                if run_start >= 0 and i - run_end <= RUN_GAP:
+                    run_end = i + 1
+                else:
+                    if run_start >= 0:
+                        runs.append((base + run_start, new[run_start:run_end]))
+                    run_start, run_end = i, i + 1
+    if run_start >= 0:
+        runs.append((base + run_start, new[run_start:run_end]))
+    return runs
+
+
+def encode_frame(kind: int, seq: int, registers: List[Tuple[int, int]],
+                 pc: Optional[int], flag_bits: Optional[int], halted: bool,
+                 counts: Optional[Tuple[int, int]], runs: MemoryRuns) -> bytes:
+    mask = 0
+    for index, _ in registers:
+        mask |= 1 << index
+    fields = ((FIELD_PC if pc is not None else 0)
+              | (FIELD_FLAGS if flag_bits is not None else 0)
+              | (FIELD_COUNTS if counts is not None else 0))
+    parts = [_HEADER.pack(kind, seq & 0xFFFFFFFF, mask, fields)]
+    if registers:
+        parts.append(struct.pack(f'<{len(registers)}H', *(value for _, value in sorted(registers))))
+    if pc is not None:
+        parts.append(_PC.pack(pc))
+    if flag_bits is not None:
+        parts.append(_FLAGS.pack(flag_bits | (halted << 3)))
+    if counts is not None:
+        parts.append(_COUNTS.pack(*counts))
+    parts.append(_RUN_COUNT.pack(len(runs)))
+    for addr, data in runs:
+        parts.append(_RUN.pack(addr, len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def decode_frame(frame: bytes) -> dict:
+    # Inverse of encode_frame, in the same shape as a JSON delta
+    kind, seq, mask, fields = _HEADER.unpack_from(frame, 0)
+    offset = _HEADER.size
+    update = {'kind': 'full' if kind == FRAME_FULL else 'delta', 'seq': seq}
+    indices = [i for i in range(8) if mask & (1 << i)]
+    values = struct.unpack_from(f'<{len(indices)}H', frame, offset)
+    offset += 2 * len(indices)
+    if indices:
+        update['registers'] = [list(pair) for pair in zip(indices, values)]
+    if fields & FIELD_PC:
+        update['pc'] = _PC.unpack_from(frame, offset)[0]
+        offset += _PC.size
+    if fields & FIELD_FLAGS:
+        bits = _FLAGS.unpack_from(frame, offset)[0]
+        offset += _FLAGS.size
+        update['flags'] = {name: bool(bits & bit) for name, bit in FLAG_BITS.items()}
+        update['halted'] = bool(bits & 0x8)
+    if fields & FIELD_COUNTS:
+        update['cycle_count'], update['instruction_count'] = _COUNTS.unpack_from(frame, offset)
+        offset += _COUNTS.size
+    count = _RUN_COUNT.unpack_from(frame, offset)[0]
+    offset += _RUN_COUNT.size
+    runs = []
+    for _ in range(count):
+        addr, length = _RUN.unpack_from(frame, offset)
+        offset += _RUN.size
+        runs.append([addr, list(frame[offset:offset + length])])
+        offset += length
+    if runs:
+        update['memory'] = runs
+    return update
+
+
+def encode_memory_frame(frame_id: int, address: int, data) -> bytes:
+    return _MEMORY.pack(FRAME_MEMORY, frame_id & 0xFFFF, address, len(data)) + bytes(data)
+
+
+def decode_memory_frame(frame: bytes) -> Tuple[int, int, memoryview]:
+    # (id, address, data) with data a view into frame
+    if len(frame) < _MEMORY.size:
+        raise ValueError("Memory frame too short")
+    kind, frame_id, address, length = _MEMORY.unpack_from(frame)
+    if kind != FRAME_MEMORY:
+        raise ValueError(f"Not a memory frame: kind {kind:#04x}")
+    if len(frame) - _MEMORY.size != length:
+        raise ValueError(f"Memory frame length mismatch: {length}")
+    return frame_id, address, memoryview(frame)[_MEMORY.size:]
+
+
+class StateSync:
+    # Per-connection record of what the client has been sent.
+    #
+    # In SYNC_FULL mode every update is get_state_dict(), as the protocol
+    # has always done. In SYNC_DELTA mode the first update is a full state
+    # and later ones carry only registers, flags, counters and memory bytes
+    # that changed, numbered by seq so a client that misses one can ask for
+    # a resync. ENCODING_BINARY encodes either kind as a compact frame.
+    #
+    # window is the memory range updates cover, None for none. Viewports
+    # are further ranges, each pushed as a memory frame by
+    # viewport_frames() only when its bytes changed since the last push.
+
+    def __init__(self, simulator: Simulator, mode: str = SYNC_FULL, encoding: str = ENCODING_JSON,
+                 window: Optional[Tuple[int, int]] = STATE_WINDOW):
+        self.simulator = simulator
+        self.seq = 0
+        self.viewports: Dict[int, Tuple[int, int]] = {}
+        self._viewport_data: Dict[int, bytes] = {}
+        self.configure(mode, encoding, window)
+
+    def configure(self, mode: str, encoding: str,
+                  window: Optional[Tuple[int, int]] = STATE_WINDOW):
+        if mode not in (SYNC_FULL, SYNC_DELTA):
+            raise ValueError(f"Invalid sync mode: {mode!r}")
+        if encoding not in (ENCODING_JSON, ENCODING_BINARY):
+            raise ValueError(f"Invalid sync encoding: {encoding!r}")
+        if window is not None:
+            start, end = window
+            check_range(start, end - start)
+            if end - start >= MEMORY_SIZE:
+                # run lengths in binary frames are u16
+                raise ValueError("State window must be smaller than memory")
+            window = (start, end)
+        self.mode = mode
+        self.encoding = encoding
+        self.window = window
+        self.invalidate()
+
+    def invalidate(self):
+        # Next update is a full state and every viewport is pushed again
+        self._registers: Optional[Tuple[int, ...]] = None
+        self._viewport_data.clear()
+
+    def set_viewport(self, viewport_id: int, start: int, end: int):
+        if not 0 <= viewport_id <= 0xFFFF:
+            raise ValueError(f"Invalid viewport id: {viewport_id}")
+        check_range(start, end - start)
+        if viewport_id not in self.viewports and len(self.viewports) >= MAX_VIEWPORTS:
+            raise ValueError(f"At most {MAX_VIEWPORTS} viewports")
+        self.viewports[viewport_id] = (start, end)
+        self._viewport_data.pop(viewport_id, None)
+
+    def clear_viewport(self, viewport_id: int) -> bool:
+        self._viewport_data.pop(viewport_id, None)
+        return self.viewports.pop(viewport_id, None) is not None
+
+    def viewport_frames(self) -> List[bytes]:
+        # Memory frames for viewports whose bytes changed since last sent
+        if not self.viewports:
+            return []
+        memory = self.simulator.state.memory
+        sent = self._viewport_data
+        frames = []
+        for viewport_id, (start, end) in self.viewports.items():
+            old = sent.get(viewport_id)
+            if old is not None and memory.startswith(old, start):
+                continue
+            data = bytes(memory[start:end])
+            sent[viewport_id] = data
+            frames.append(encode_memory_frame(viewport_id, start, data))
+        return frames
+
+    def _remember(self) -> bytes:
+        state = self.simulator.state
+        start, end = self.window if self.window is not None else (0, 0)
+        memory = bytes(state.memory_view(start, end))
+        self._registers = tuple(state.registers)
+        self._pc = state.pc
+        self._flag_bits = state.flag_bits
+        self._halted = state.halted
+        self._counts = (state.cycle_count, state.instruction_count)
+        self._memory = memory
+        self.seq += 1
+        return memory
+
+    def full(self) -> Union[dict, bytes]:
+        # Complete state, resetting the delta baseline
+        memory = self._remember()
+        if self.encoding == ENCODING_BINARY:
+            state = self.simulator.state
+            runs = [(self.window[0], memory)] if memory else []
+            return encode_frame(FRAME_FULL, self.seq, list(enumerate(state.registers)),
+                                state.pc, state.flag_bits, state.halted, self._counts, runs)
+        update = {'state': self.simulator.get_state_dict(self.window)}
+        if self.mode == SYNC_DELTA:
+            update['seq'] = self.seq
+        return update
+
+    def update(self) -> Union[dict, bytes]:
+        # Fields to attach to an outgoing message (JSON) or a frame to send
+        # after it (binary)
+        if self.mode == SYNC_FULL or self._registers is None:
+            return self.full()
+
+        state = self.simulator.state
+        old_registers = self._registers
+        old_pc, old_flag_bits, old_halted = self._pc, self._flag_bits, self._halted
+        old_counts, old_memory = self._counts, self._memory
+        memory = self._remember()
+
+        registers = [(i, value) for i, (value, old) in enumerate(zip(state.registers, old_registers))
+                     if value != old]
+        pc = state.pc if state.pc != old_pc else None
+        flags_changed = state.flag_bits != old_flag_bits or state.halted != old_halted
+        counts = self._counts if self._counts != old_counts else None
+        runs = diff_memory(old_memory, memory, self.window[0]) if memory else []
+
+        if self.encoding == ENCODING_BINARY:
+            return encode_frame(FRAME_DELTA, self.seq, registers, pc,
+                                state.flag_bits if flags_changed else None, state.halted,
+                                counts, runs)
+
+        delta = {}
+        if registers:
+            delta['registers'] = [list(pair) for pair in registers]
+        if pc is not None:
+            delta['pc'] = pc
+        if flags_changed:
+            delta['flags'] = dict(state.flags)
+            delta['halted'] = state.halted
+        if counts is not None:
+            delta['cycle_count'], delta['instruction_count'] = counts
+        if runs:
+            delta['memory'] = [[addr, list(data)] for addr, data in runs]
+        return {'delta': delta, 'seq': self.seq}
@@ -0,0 +1,151 @@
+# Time-sliced, pausable runs for WebSocket sessions
+# Vishanth Dandu
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, Union
+
+from conditions import Condition
+from scheduler import BudgetExhausted, Client, Scheduler
+from simulator import Simulator
+from tracebuf import TRACE_FULL, make_trace_buffer
+
+# Instructions per slice; the event loop gets control back between slices
+SLICE_STEPS = 5000
+# Minimum seconds between progress messages
+PROGRESS_INTERVAL = 0.1
+# Newest records kept between progress messages of a streamed full trace
+STREAM_TRACE_CAPACITY = 1 << 16
+
+RUN_HALTED = 'halted'
+RUN_BREAKPOINT = 'breakpoint'
+RUN_WATCHPOINT = 'watchpoint'
+RUN_MAX_STEPS = 'max_steps'
+RUN_CANCELLED = 'cancelled'
+RUN_BUDGET = 'budget'
+RUN_CONDITION = 'condition'
+
+
+class StreamingRun:
+    # Runs the simulator in slices of slice_steps instructions, yielding to
+    # the event loop after each so other connections keep being served.
+    #
+    # With stream set, a progress message with the trace lines recorded
+    # since the previous one goes out at most every `interval` seconds, and
+    # max_steps may be None to run until the program halts or is cancelled.
+    # `send` delivers a message with the CPU state attached.
+    #
+    # Given a scheduler and its client for the session, slices run as the
+    # scheduler's quanta on a worker thread instead of on the event loop.
+    # With until, the run also stops once that condition holds.
+
+    def __init__(self, simulator: Simulator, send: Callable[[dict], Awaitable[None]],
+                 max_steps: Optional[int] = 10000, trace: Union[str, int] = TRACE_FULL,
+                 stream: bool = False, slice_steps: int = SLICE_STEPS,
+                 interval: float = PROGRESS_INTERVAL, scheduler: Optional[Scheduler] = None,
+                 client: Optional[Client] = None, until: Optional[Condition] = None):
+        if max_steps is None and not stream:
+            raise ValueError("Unbounded runs must be streamed")
+        self.simulator = simulator
+        self.send = send
+        self.max_steps = max_steps
+        self.stream = stream
+        self.slice_steps = slice_steps
+        self.interval = interval
+        self.scheduler = scheduler
+        self.client = client if client is not None or scheduler is None else scheduler.client()
+        self.until = until
+        # Streamed full traces keep a bounded window; the rest went out
+        # in earlier progress messages
+        self.buffer = make_trace_buffer(trace, STREAM_TRACE_CAPACITY if stream else None)
+        self.steps = 0
+        self.cancelled = False
+        self._sent = 0
+        self._running = asyncio.Event()
+        self._running.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self._running.set()
+
+    def _new_lines(self) -> dict:
+        # Trace lines recorded since the last progress message
+        buffer = self.buffer
+        if buffer is None:
+            return {'trace': [], 'dropped': 0}
+        new = buffer.total - self._sent
+        lines = buffer.lines(new)
+        self._sent = buffer.total
+        return {'trace': lines, 'dropped': new - len(lines)}
+
+    async def run(self) -> str:
+        # Execute to completion and send the final "complete" message;
+        # returns the RUN_* status
+        simulator = self.simulator
+        state = simulator.state
+        simulator.last_trace = self.buffer
+        note = None
+        last_progress = time.perf_counter()
+
+        while True:
+            if not self._running.is_set():
+                await self._running.wait()
+            if self.cancelled:
+                status = RUN_CANCELLED
+                break
+            count = self.slice_steps
+            if self.max_steps is not None:
+                count = min(count, self.max_steps - self.steps)
+            before = state.instruction_count
+            if self.scheduler is not None:
+                try:
+                    note = await self.scheduler.execute(self.client, simulator, count, self.buffer,
+                                                        self.until)
+                except BudgetExhausted as e:
+                    status = RUN_BUDGET
+                    note = str(e)
+                    break
+            else:
+                note = simulator.execute(count, self.buffer, self.until)
+            self.steps += state.instruction_count - before
+            if note:
+                if note.startswith('WATCHPOINT'):
+                    status = RUN_WATCHPOINT
+                elif note.startswith('CONDITION'):
+                    status = RUN_CONDITION
+                else:
+                    status = RUN_BREAKPOINT
+                break
+            if state.halted:
+                status = RUN_HALTED
+                break
+            if self.max_steps is not None and self.steps >= self.max_steps:
+                status = RUN_MAX_STEPS
+                break
+            if self.stream and time.perf_counter() - last_progress >= self.interval:
+                await self.send({'type': 'progress', 'steps': self.steps, **self._new_lines()})
+                last_progress = time.perf_counter()
+            await asyncio.sleep(0)
+
+        if self.stream:
+            message = {'type': 'complete', 'status': status, 'steps': self.steps,
+                       **self._new_lines()}
+            trace_log = message.pop('trace')
+        else:
+            message = {'type': 'complete'}
+            trace_log = self.buffer.lines() if self.buffer is not None else []
+        if note:
+            trace_log.append(note)
+        message['trace_log'] = trace_log
+        await self.send(message)
+        return status
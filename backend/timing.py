@@ -0,0 +1,236 @@
+# Cache and pipeline timing model
+# Vishanth Dandu
+
+from typing import Dict, List, Optional, Tuple
+
+from dispatch import (FLAG_Z, op_add, op_addi, op_and, op_brz, op_jmp, op_load, op_or,
+                      op_store, op_sub)
+
+DEFAULT_MISS_PENALTY = 10
+DEFAULT_LOAD_USE_PENALTY = 1
+DEFAULT_BRANCH_PENALTY = 2
+# Largest cache accepted: the whole 64K address space
+MAX_CACHE_SIZE = 0x10000
+
+
+def _power_of_two(value: int) -> bool:
+    return isinstance(value, int) and value > 0 and value & (value - 1) == 0
+
+
+class Cache:
+    # Set-associative cache with LRU replacement. Only tags are kept, as
+    # line numbers, newest last in each set.
+
+    def __init__(self, size: int = 1024, associativity: int = 2, line_size: int = 16):
+        if not (_power_of_two(size) and _power_of_two(associativity) and _power_of_two(line_size)):
+            raise ValueError(f"Cache geometry must be powers of two: {size}/{associativity}/{line_size}")
+        if size > MAX_CACHE_SIZE:
+            raise ValueError(f"Cache larger than {MAX_CACHE_SIZE} bytes: {size}")
+        if line_size * associativity > size:
+            raise ValueError(f"Cache too small for {associativity} ways of {line_size} bytes: {size}")
+        self.size = size
+        self.associativity = associativity
+        self.line_size = line_size
+        self.line_shift = line_size.bit_length() - 1
+        self.set_mask = size // (line_size * associativity) - 1
+        self.clear()
+
+    def clear(self):
+        self.sets: List[List[int]] = [[] for _ in range(self.set_mask + 1)]
+        self.hits = 0
+        self.misses = 0
+
+    def access(self, addr: int) -> bool:
+        # Touch the line holding addr; True on a hit
+        line = addr >> self.line_shift
+        ways = self.sets[line & self.set_mask]
+        if ways and ways[-1] == line:
+            self.hits += 1
+            return True
+        if line in ways:
+            ways.remove(line)
+            ways.append(line)
+            self.hits += 1
+            return True
+        self.misses += 1
+        if len(ways) == self.associativity:
+            del ways[0]
+        ways.append(line)
+        return False
+
+    def stats(self) -> dict:
+        accesses = self.hits + self.misses
+        return {'size': self.size, 'associativity': self.associativity,
+                'line_size': self.line_size, 'accesses': accesses, 'hits': self.hits,
+                'misses': self.misses, 'miss_rate': self.misses / accesses if accesses else 0.0}
+
+
+def _operands(handler) -> Tuple[bool, bool, bool]:
+    # Which of an entry's (a, b, c) fields name registers the instruction reads
+    if handler in (op_add, op_sub, op_and, op_or):
+        return False, True, True
+    if handler is op_addi or handler is op_load:
+        return False, True, False
+    if handler is op_store:
+        return True, True, False
+    return False, False, False
+
+
+class TimingModel:
+    # In-order pipeline at one instruction per cycle plus stalls: cache
+    # misses on instruction fetch and on LOAD/STORE, a load-use bubble when
+    # an instruction reads the register the previous LOAD wrote, and a
+    # redirect penalty for every taken JMP/BRZ (fall-through is predicted).
+    #
+    # With sample_interval set, runs are sampled: each interval starts with
+    # a detailed window of sample_window instructions and fast-forwards
+    # through the rest on the fast loops, charging them the CPI measured in
+    # the windows so far. The first warmup instructions of a window only
+    # warm the caches and are not measured.
+
+    def __init__(self, icache: Optional[Cache] = None, dcache: Optional[Cache] = None,
+                 miss_penalty: int = DEFAULT_MISS_PENALTY,
+                 load_use_penalty: int = DEFAULT_LOAD_USE_PENALTY,
+                 branch_penalty: int = DEFAULT_BRANCH_PENALTY,
+                 sample_interval: Optional[int] = None, sample_window: int = 1000,
+                 warmup: int = 0):
+        if sample_interval is not None and not 0 < sample_window <= sample_interval:
+            raise ValueError(f"Sample window must be within the interval: {sample_window}/{sample_interval}")
+        if not 0 <= warmup < sample_window:
+            raise ValueError(f"Warmup must be shorter than the sample window: {warmup}")
+        self.icache = icache if icache is not None else Cache()
+        self.dcache = dcache if dcache is not None else Cache()
+        self.miss_penalty = miss_penalty
+        self.load_use_penalty = load_use_penalty
+        self.branch_penalty = branch_penalty
+        self.sample_interval = sample_interval
+        self.sample_window = sample_window
+        self.warmup = warmup if sample_interval else 0
+        self._reads: Dict[object, Tuple[int, ...]] = {}
+        self.clear()
+
+    def clear(self):
+        self.icache.clear()
+        self.dcache.clear()
+        # instructions run through account() and their stall cycles
+        self.instructions = 0
+        self.stall_cycles = 0
+        self.stalls = {'icache': 0, 'dcache': 0, 'load_use': 0, 'branch': 0}
+        # measured part of the detailed windows
+        self.measured_instructions = 0
+        self.measured_cycles = 0
+        self.fast_forwarded = 0
+        self.estimated_cycles = 0
+        # position within the current sample interval
+        self.phase = 0
+        self._load_rd = -1
+
+    def _reads_of(self, entry) -> Tuple[int, ...]:
+        reads = self._reads.get(entry)
+        if reads is None:
+            handler, a, b, c = entry
+            reads = tuple(r for r, used in zip((a, b, c), _operands(handler)) if used)
+            self._reads[entry] = reads
+        return reads
+
+    def account(self, pc: int, entry, state) -> int:
+        # Stall cycles for the instruction about to run at pc; called
+        # before it executes, so flags and registers are its inputs
+        handler, a, b, c = entry
+        stall = 0
+        stalls = self.stalls
+        if not self.icache.access(pc):
+            stall += self.miss_penalty
+            stalls['icache'] += self.miss_penalty
+        if handler is op_load or handler is op_store:
+            if not self.dcache.access((state.registers[b] + c) & 0xFFFF):
+                stall += self.miss_penalty
+                stalls['dcache'] += self.miss_penalty
+        if self._load_rd >= 0 and self._load_rd in self._reads_of(entry):
+            stall += self.load_use_penalty
+            stalls['load_use'] += self.load_use_penalty
+        self._load_rd = a if handler is op_load else -1
+        if handler is op_jmp or (handler is op_brz and state.flag_bits & FLAG_Z):
+            stall += self.branch_penalty
+            stalls['branch'] += self.branch_penalty
+
+        self.instructions += 1
+        self.stall_cycles += stall
+        if self.sample_interval:
+            if self.phase >= self.warmup:
+                self.measured_instructions += 1
+                self.measured_cycles += 1 + stall
+            self.phase += 1
+        return stall
+
+    @property
+    def cpi(self) -> float:
+        # Cycles per instruction over the detailed (measured) instructions
+        if self.sample_interval:
+            if not self.measured_instructions:
+                return 1.0
+            return self.measured_cycles / self.measured_instructions
+        if not self.instructions:
+            return 1.0
+        return (self.instructions + self.stall_cycles) / self.instructions
+
+    def detailed_budget(self) -> int:
+        # Instructions left in the current detailed window, 0 when the
+        # run should fast-forward
+        if self.phase < self.sample_window:
+            return self.sample_window - self.phase
+        return 0
+
+    def fast_forward_budget(self) -> int:
+        return max(0, self.sample_interval - self.phase)
+
+    def skip(self, count: int) -> int:
+        # Record count fast-forwarded instructions; returns the extra cycles
+        # to charge them beyond one each
+        self.fast_forwarded += count
+        self.phase += count
+        if self.phase >= self.sample_interval:
+            self.phase = 0
+            # the pipeline drained while fast-forwarding
+            self._load_rd = -1
+        extra = round(count * (self.cpi - 1))
+        self.estimated_cycles += count + extra
+        return extra
+
+    def stats(self) -> dict:
+        detailed = self.instructions + self.stall_cycles
+        stats = {
+            'instructions': self.instructions + self.fast_forwarded,
+            'cycles': detailed + self.estimated_cycles,
+            'cpi': self.cpi,
+            'icache': self.icache.stats(),
+            'dcache': self.dcache.stats(),
+            'stalls': dict(self.stalls),
+        }
+        if self.sample_interval:
+            stats['sampling'] = {'interval': self.sample_interval, 'window': self.sample_window,
+                                 'warmup': self.warmup, 'detailed': self.instructions,
+                                 'measured': self.measured_instructions,
+                                 'fast_forwarded': self.fast_forwarded}
+        return stats
+
+
+_CACHE_FIELDS = ('size', 'associativity', 'line_size')
+_MODEL_FIELDS = ('miss_penalty', 'load_use_penalty', 'branch_penalty',
+                 'sample_interval', 'sample_window', 'warmup')
+
+
+def timing_from_dict(data: dict) -> TimingModel:
+    # Model from a JSON config; "icache" and "dcache" hold cache geometry.
+    # Raises ValueError for anything but non-negative int settings.
+    caches = []
+    for name in ('icache', 'dcache'):
+        geometry = data.get(name, {})
+        if not isinstance(geometry, dict):
+            raise ValueError(f"{name} must be an object")
+        caches.append(Cache(**{k: v for k, v in geometry.items() if k in _CACHE_FIELDS}))
+    settings = {k: v for k, v in data.items() if k in _MODEL_FIELDS and v is not None}
+    for name, value in settings.items():
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{name} must be a non-negative integer")
+    return TimingModel(*caches, **settings)
@@ -0,0 +1,127 @@
+# Structured execution trace storage
+# Vishanth Dandu
+
+from array import array
+from typing import Iterator, List, Optional, Tuple, Union
+
+from dispatch import format_trace
+
+TRACE_NONE = 'none'
+TRACE_FULL = 'full'
+# Most recent entries a client may ask to keep; a ring buffer allocates
+# 16 bytes per entry up front
+MAX_TRACE_ENTRIES = 1 << 20
+
+
+class TraceBuffer:
+    # Raw (pc, instruction, zero flag, cycle) records kept in two flat arrays.
+    # With a capacity it behaves as a ring buffer holding the newest records;
+    # without one it grows for as long as the run goes. Text is only built
+    # when lines() is called.
+
+    def __init__(self, capacity: Optional[int] = None):
+        if capacity is not None and capacity < 1:
+            raise ValueError(f"Trace capacity must be positive: {capacity}")
+        self.capacity = capacity
+        self.total = 0
+        self._next = 0
+        if capacity is None:
+            # pc | word << 17 | zero flag << 33; pc takes 17 bits since a run
+            # that falls off the end of memory stops at 0x10000
+            self._info = array('Q')
+            self._cycles = array('Q')
+            self.record = self._append
+        else:
+            self._info = array('Q', bytes(8 * capacity))
+            self._cycles = array('Q', bytes(8 * capacity))
+            self.record = self._store
+
+    def _append(self, pc: int, word: int, zero: bool, cycle: int):
+        self._info.append(pc | (word << 17) | (zero << 33))
+        self._cycles.append(cycle)
+        self.total += 1
+
+    def _store(self, pc: int, word: int, zero: bool, cycle: int):
+        i = self._next
+        self._info[i] = pc | (word << 17) | (zero << 33)
+        self._cycles[i] = cycle
+        i += 1
+        self._next = 0 if i == self.capacity else i
+        self.total += 1
+
+    def __len__(self) -> int:
+        if self.capacity is None:
+            return self.total
+        return min(self.total, self.capacity)
+
+    @property
+    def nbytes(self) -> int:
+        return self._info.itemsize * (len(self._info) + len(self._cycles))
+
+    @property
+    def dropped(self) -> int:
+        # Records overwritten by the ring
+        return self.total - len(self)
+
+    def clear(self):
+        self.total = 0
+        self._next = 0
+        if self.capacity is None:
+            self._info = array('Q')
+            self._cycles = array('Q')
+
+    def _infos(self, last: Optional[int]) -> Tuple[array, range]:
+        # Positions of the requested records, oldest first
+        count = len(self)
+        if last is not None:
+            count = min(count, max(last, 0))
+        if self.capacity is None or self.total <= self.capacity:
+            start = len(self) - count
+        else:
+            start = self._next + self.capacity - count
+        return self._info, range(start, start + count)
+
+    def records(self, last: Optional[int] = None) -> Iterator[Tuple[int, int, bool, int]]:
+        # Yield (pc, word, zero flag, cycle) oldest first
+        infos, positions = self._infos(last)
+        size = len(infos)
+        for i in positions:
+            info = infos[i % size]
+            yield info & 0x1FFFF, (info >> 17) & 0xFFFF, bool(info >> 33), self._cycles[i % size]
+
+    def lines(self, last: Optional[int] = None) -> List[str]:
+        # Loops repeat the same (pc, word, flag) records, so each distinct
+        # record is formatted once and the string reused
+        infos, positions = self._infos(last)
+        size = len(infos)
+        formatted = {}
+        lines = []
+        for i in positions:
+            info = infos[i % size]
+            line = formatted.get(info)
+            if line is None:
+                line = formatted[info] = format_trace(info & 0x1FFFF, (info >> 17) & 0xFFFF, bool(info >> 33))
+            lines.append(line)
+        return lines
+
+
+def check_trace_mode(trace) -> Union[str, int]:
+    # A client's trace mode, with entry counts clamped to MAX_TRACE_ENTRIES;
+    # raises ValueError for anything that is not a valid mode
+    if trace == TRACE_FULL or trace == TRACE_NONE:
+        return trace
+    if isinstance(trace, int) and not isinstance(trace, bool) and trace >= 1:
+        return min(trace, MAX_TRACE_ENTRIES)
+    raise ValueError(f"Invalid trace mode: {trace!r}")
+
+
+def make_trace_buffer(trace: Union[str, int], full_capacity: Optional[int] = None) -> Optional[TraceBuffer]:
+    # Buffer for a trace mode: TRACE_FULL, TRACE_NONE or the number of most
+    # recent entries to keep. full_capacity bounds TRACE_FULL when set.
+    if trace == TRACE_FULL:
+        return TraceBuffer(full_capacity)
+    if trace == TRACE_NONE:
+        return None
+    if isinstance(trace, int) and not isinstance(trace, bool):
+        return TraceBuffer(trace)
+    raise ValueError(f"Invalid trace mode: {trace!r}")
@@ -0,0 +1,428 @@
+# Trace files: full execution traces streamed to disk, read through mmap
+# Vishanth Dandu
+
+import bisect
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from dispatch import (FLAG_Z, format_trace, get_dispatch_table, op_add, op_addi, op_and, op_load,
+                      op_or, op_store, op_sub)
+
+# Layout, all little-endian:
+#   header:  magic, version, flags, records per chunk, reserved
+#   chunks:  record count, payload length, opcode mask, lowest and highest
+#            memory address accessed, reserved; then the payload, padded
+#            to 8 bytes
+#   index:   file offset of every chunk, u64 each
+#   trailer: index offset, record count, chunk count, end magic
+# A chunk's payload (zlib-compressed with TRACE_COMPRESSED) holds its
+# records column by column, in the order of COLUMNS. A file whose writer
+# never closed it has no index; its chunks are found by walking them.
+TRACE_MAGIC = b'ISAT'
+TRACE_END_MAGIC = b'TEND'
+TRACE_VERSION = 2
+TRACE_COMPRESSED = 0x1
+
+DEFAULT_CHUNK_RECORDS = 1 << 16
+
+# (name, array typecode); widest first so every column stays aligned. pc
+# is 32-bit since a run that falls off the end of memory stops at 0x10000
+COLUMNS = (('cycle', 'Q'), ('pc', 'I'), ('word', 'H'), ('value', 'H'), ('addr', 'H'),
+           ('mem', 'H'), ('rd', 'B'), ('flags', 'B'))
+# rd of instructions that write no register
+NO_REGISTER = 0xFF
+
+_HEADER = struct.Struct('<4sHHI4x')
+_CHUNK = struct.Struct('<IIHHH2x')
+_TRAILER = struct.Struct('<QQI4s')
+
+# Per-instruction record kinds
+_KIND_NONE = 0
+_KIND_REGISTER = 1
+_KIND_LOAD = 2
+_KIND_STORE = 3
+_REGISTER_WRITERS = (op_add, op_sub, op_and, op_or, op_addi)
+
+OPCODES = {'nop': 0x0, 'add': 0x1, 'sub': 0x2, 'and': 0x3, 'or': 0x4, 'addi': 0x5, 'load': 0x6,
+           'store': 0x7, 'jmp': 0x8, 'brz': 0x9, 'halt': 0xA}
+
+
+class TraceRecord(NamedTuple):
+    index: int
+    cycle: int
+    pc: int
+    word: int
+    # register written and its new value; rd is NO_REGISTER for none
+    rd: int
+    value: int
+    # address and word of a LOAD or STORE, 0 otherwise
+    addr: int
+    mem: int
+    flags: int
+
+    @property
+    def opcode(self) -> int:
+        return self.word >> 12
+
+    def line(self) -> str:
+        # The text trace line Simulator.run() gives for this instruction
+        return format_trace(self.pc, self.word, bool(self.flags & FLAG_Z))
+
+
+def _kinds() -> Dict[object, int]:
+    kinds = {handler: _KIND_REGISTER for handler in _REGISTER_WRITERS}
+    kinds[op_load] = _KIND_LOAD
+    kinds[op_store] = _KIND_STORE
+    return kinds
+
+
+def _pad(length: int) -> int:
+    return -length % 8
+
+
+class TraceWriter:
+    # Streams records to a file a chunk at a time, so memory stays at one
+    # chunk however long the run. record() has TraceBuffer's signature and
+    # is called after each instruction, so a writer can be passed to
+    # Simulator.execute() as its trace buffer.
+    #
+    # Records also carry the register written, the memory access and the
+    # flags, read from state after the instruction. A LOAD into its own
+    # base register needs the base as it was before, which is kept from
+    # earlier records: registers must not change between records except
+    # through traced instructions.
+
+    def __init__(self, file: Union[str, BinaryIO], state, chunk_records: int = DEFAULT_CHUNK_RECORDS,
+                 compress: bool = False, compress_level: int = 6):
+        if chunk_records < 1:
+            raise ValueError(f"Chunk size must be positive: {chunk_records}")
+        self._own = isinstance(file, str)
+        self.file = open(file, 'wb') if self._own else file
+        self.state = state
+        self.chunk_records = chunk_records
+        self.compress = compress
+        self.compress_level = compress_level
+        self.total = 0
+        self.bytes_written = 0
+        self.closed = False
+        self._table = get_dispatch_table()
+        self._kinds = _kinds()
+        self._registers = list(state.registers)
+        self._offsets = array('Q')
+        self._columns = {name: array(code) for name, code in COLUMNS}
+        self._write(_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_COMPRESSED if compress else 0,
+                                 chunk_records))
+
+    def __enter__(self) -> 'TraceWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write(self, data: bytes):
+        self.file.write(data)
+        self.bytes_written += len(data)
+
+    def record(self, pc: int, word: int, zero: bool, cycle: int):
+        handler, a, b, c = self._table[word]
+        kind = self._kinds.get(handler, _KIND_NONE)
+        registers = self.state.registers
+        columns = self._columns
+        rd = NO_REGISTER
+        value = addr = mem = 0
+        if kind:
+            if kind == _KIND_STORE:
+                addr = (registers[b] + c) & 0xFFFF
+                mem = registers[a]
+            else:
+                rd = a
+                value = registers[a]
+                if kind == _KIND_LOAD:
+                    base = self._registers[b] if a == b else registers[b]
+                    addr = (base + c) & 0xFFFF
+                    mem = value
+                self._registers[a] = value
+        columns['cycle'].append(cycle)
+        columns['pc'].append(pc)
+        columns['word'].append(word)
+        columns['value'].append(value)
+        columns['addr'].append(addr)
+        columns['mem'].append(mem)
+        columns['rd'].append(rd)
+        columns['flags'].append(self.state.flag_bits)
+        self.total += 1
+        if len(columns['pc']) >= self.chunk_records:
+            self.flush()
+
+    def flush(self):
+        # Write out the records gathered so far as a chunk
+        columns = self._columns
+        count = len(columns['pc'])
+        if not count:
+            return
+        words = columns['word']
+        mask = 0
+        for opcode in set(word >> 12 for word in words):
+            mask |= 1 << opcode
+        accessed = [addr for addr, word in zip(columns['addr'], words) if 0x6 <= word >> 12 <= 0x7]
+        low, high = (min(accessed), max(accessed)) if accessed else (0xFFFF, 0)
+
+        parts = []
+        for name, _ in COLUMNS:
+            column = columns[name]
+            if sys.byteorder == 'big':
+                column.byteswap()
+            parts.append(column.tobytes())
+        payload = b''.join(parts)
+        if self.compress:
+            payload = zlib.compress(payload, self.compress_level)
+        self._offsets.append(self.bytes_written)
+        self._write(_CHUNK.pack(count, len(payload), mask, low, high))
+        self._write(payload + bytes(_pad(len(payload))))
+        self._columns = {name: array(code) for name, code in COLUMNS}
+
+    def abort(self):
+        # Write out whole records and close without an index, leaving an
+        # unfinished file; used when the run failed
+        if self.closed:
+            return
+        count = min(len(column) for column in self._columns.values())
+        for column in self._columns.values():
+            del column[count:]
+        self.flush()
+        self.closed = True
+        if self._own:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def close(self):
+        # Flush and write the chunk index; the file is complete after this
+        if self.closed:
+            return
+        self.flush()
+        index_offset = self.bytes_written
+        offsets = array('Q', self._offsets)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        self._write(offsets.tobytes())
+        self._write(_TRAILER.pack(index_offset, self.total, len(self._offsets), TRACE_END_MAGIC))
+        self.closed = True
+        if self._own:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+class _Chunk:
+    __slots__ = ('offset', 'start', 'count', 'length', 'mask', 'low', 'high')
+
+    def __init__(self, offset: int, start: int, count: int, length: int, mask: int, low: int,
+                 high: int):
+        self.offset = offset
+        self.start = start
+        self.count = count
+        self.length = length
+        self.mask = mask
+        self.low = low
+        self.high = high
+
+
+class TraceReader:
+    # Random access to a trace file through a read-only memory map. Only
+    # the chunk being read is decoded (and decompressed); uncompressed
+    # columns are views straight onto the map. Filters skip chunks whose
+    # opcode mask or address range rules them out.
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("Empty trace file")
+        self._view = memoryview(self._map)
+        self._cached: Optional[Tuple[int, Dict[str, memoryview]]] = None
+        try:
+            self._read_layout()
+        except (ValueError, struct.error) as e:
+            self.close()
+            raise ValueError(f"Bad trace file: {e}")
+
+    def __enter__(self) -> 'TraceReader':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_layout(self):
+        view = self._view
+        magic, version, flags, self.chunk_records = _HEADER.unpack_from(view)
+        if magic != TRACE_MAGIC:
+            raise ValueError(f"magic {magic!r}")
+        if version != TRACE_VERSION:
+            raise ValueError(f"unsupported version {version}")
+        self.compressed = bool(flags & TRACE_COMPRESSED)
+
+        offsets = None
+        self.complete = False
+        if len(view) >= _HEADER.size + _TRAILER.size:
+            index_offset, total, count, end = _TRAILER.unpack_from(view, len(view) - _TRAILER.size)
+            if end == TRACE_END_MAGIC:
+                offsets = array('Q')
+                offsets.frombytes(view[index_offset:index_offset + 8 * count])
+                if sys.byteorder == 'big':
+                    offsets.byteswap()
+                self.complete = True
+                limit = index_offset
+        if offsets is None:
+            # Unfinished file: walk the chunks that were written in full
+            offsets = array('Q')
+            limit = len(view)
+            offset = _HEADER.size
+            while offset + _CHUNK.size <= limit:
+                _, length, _, _, _ = _CHUNK.unpack_from(view, offset)
+                end = offset + _CHUNK.size + length + _pad(length)
+                if end > limit:
+                    break
+                offsets.append(offset)
+                offset = end
+
+        self.chunks: List[_Chunk] = []
+        start = 0
+        for offset in offsets:
+            count, length, mask, low, high = _CHUNK.unpack_from(view, offset)
+            if offset + _CHUNK.size + length > limit:
+                raise ValueError(f"chunk at {offset} out of bounds")
+            self.chunks.append(_Chunk(offset, start, count, length, mask, low, high))
+            start += count
+        self._starts = [chunk.start for chunk in self.chunks]
+        self.total = start
+
+    def __len__(self) -> int:
+        return self.total
+
+    def close(self):
+        # Views handed out by columns() are released with the map
+        if self._cached is not None:
+            for column in self._cached[1].values():
+                column.release()
+            self._cached = None
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def columns(self, chunk_index: int) -> Dict[str, memoryview]:
+        # Column views of one chunk, by name
+        if self._cached is not None and self._cached[0] == chunk_index:
+            return self._cached[1]
+        chunk = self.chunks[chunk_index]
+        begin = chunk.offset + _CHUNK.size
+        payload = self._view[begin:begin + chunk.length]
+        if self.compressed:
+            payload = memoryview(zlib.decompress(payload))
+        columns = {}
+        position = 0
+        for name, code in COLUMNS:
+            size = array(code).itemsize * chunk.count
+            raw = payload[position:position + size]
+            if sys.byteorder == 'big' and size:
+                swapped = array(code)
+                swapped.frombytes(raw)
+                swapped.byteswap()
+                raw = memoryview(swapped).cast('B')
+            columns[name] = raw.cast(code)
+            position += size
+        self._cached = (chunk_index, columns)
+        return columns
+
+    def _record(self, columns: Dict[str, memoryview], chunk: _Chunk, i: int) -> TraceRecord:
+        return TraceRecord(chunk.start + i, columns['cycle'][i], columns['pc'][i],
+                           columns['word'][i], columns['rd'][i], columns['value'][i],
+                           columns['addr'][i], columns['mem'][i], columns['flags'][i])
+
+    def record(self, index: int) -> TraceRecord:
+        if index < 0:
+            index += self.total
+        if not 0 <= index < self.total:
+            raise IndexError(f"Trace record out of range: {index}")
+        chunk_index = bisect.bisect_right(self._starts, index) - 1
+        chunk = self.chunks[chunk_index]
+        return self._record(self.columns(chunk_index), chunk, index - chunk.start)
+
+    def records(self, start: int = 0, stop: Optional[int] = None) -> Iterator[TraceRecord]:
+        stop = self.total if stop is None else min(stop, self.total)
+        if start >= stop:
+            return
+        first = bisect.bisect_right(self._starts, start) - 1
+        for chunk_index in range(first, len(self.chunks)):
+            chunk = self.chunks[chunk_index]
+            if chunk.start >= stop:
+                break
+            columns = self.columns(chunk_index)
+            first_i = max(start, chunk.start) - chunk.start
+            for i in range(first_i, min(stop, chunk.start + chunk.count) - chunk.start):
+                yield self._record(columns, chunk, i)
+
+    def filter(self, opcodes: Optional[List[int]] = None, address: Optional[Tuple[int, int]] = None,
+               pc: Optional[int] = None) -> Iterator[TraceRecord]:
+        # Records matching every given test: opcode in opcodes, a LOAD or
+        # STORE with address in [low, high), or at pc
+        mask = 0xFFFF
+        if opcodes is not None:
+            mask = 0
+            for opcode in opcodes:
+                mask |= 1 << opcode
+        if address is not None:
+            low, high = address
+            mask &= (1 << OPCODES['load']) | (1 << OPCODES['store'])
+        for chunk_index, chunk in enumerate(self.chunks):
+            if not chunk.mask & mask:
+                continue
+            if address is not None and (chunk.high < low or chunk.low >= high):
+                continue
+            columns = self.columns(chunk_index)
+            words = columns['word']
+            if pc is not None:
+                candidates = [i for i, value in enumerate(columns['pc']) if value == pc]
+            elif address is not None:
+                candidates = [i for i, addr in enumerate(columns['addr']) if low <= addr < high]
+            else:
+                candidates = range(chunk.count)
+            for i in candidates:
+                if not mask >> (words[i] >> 12) & 1:
+                    continue
+                if address is not None and not low <= columns['addr'][i] < high:
+                    continue
+                yield self._record(columns, chunk, i)
+
+    def lines(self, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+        # The text trace, as Simulator.run() formats it
+        formatted = {}
+        for record in self.records(start, stop):
+            key = (record.pc, record.word, record.flags & FLAG_Z)
+            line = formatted.get(key)
+            if line is None:
+                line = formatted[key] = record.line()
+            yield line
+
+
+def record_run(simulator, file: Union[str, BinaryIO], max_steps: int,
+               chunk_records: int = DEFAULT_CHUNK_RECORDS, compress: bool = False
+               ) -> Tuple[Optional[str], TraceWriter]:
+    # Run simulator for up to max_steps with every instruction written to
+    # file; returns the run's stop note and the closed writer
+    with TraceWriter(file, simulator.state, chunk_records, compress) as writer:
+        note = simulator.execute(max_steps, writer)
+    return note, writer
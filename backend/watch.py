@@ -0,0 +1,106 @@
+# Memory watchpoints
+# Vishanth Dandu
+
+from typing import Dict, Optional
+
+from dispatch import op_store
+
+PAGE_SHIFT = 8
+
+WATCH_READ = 'read'
+WATCH_WRITE = 'write'
+WATCH_CHANGE = 'change'
+WATCH_KINDS = (WATCH_READ, WATCH_WRITE, WATCH_CHANGE)
+
+
+class Watchpoint:
+    __slots__ = ('id', 'start', 'end', 'kind')
+
+    def __init__(self, id: int, start: int, end: int, kind: str):
+        self.id = id
+        self.start = start
+        self.end = end
+        self.kind = kind
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'start': self.start, 'end': self.end, 'kind': self.kind}
+
+
+class WatchSet:
+    # Watchpoints on memory[start:end], triggered by LOAD (read) or STORE
+    # (write, or change when the stored word differs from the old one).
+    #
+    # `pages` flags every 256-byte page that some watchpoint covers; the run
+    # loop only calls check() for accesses that land on a flagged page.
+
+    def __init__(self):
+        self.watches: Dict[int, Watchpoint] = {}
+        # one extra entry so (addr + 1) >> 8 is always a valid index
+        self.pages = bytearray((0x10000 >> PAGE_SHIFT) + 1)
+        # details of the last watchpoint that fired
+        self.hit: Optional[dict] = None
+        self._next_id = 1
+
+    def __len__(self) -> int:
+        return len(self.watches)
+
+    def __iter__(self):
+        return iter(self.watches.values())
+
+    def add(self, start: int, end: int, kind: str = WATCH_WRITE) -> Watchpoint:
+        if kind not in WATCH_KINDS:
+            raise ValueError(f"Invalid watchpoint kind: {kind!r}")
+        if not 0 <= start < end <= 0x10000:
+            raise ValueError(f"Invalid watchpoint range: {start:#x}-{end:#x}")
+        watch = Watchpoint(self._next_id, start, end, kind)
+        self._next_id += 1
+        self.watches[watch.id] = watch
+        self._mark()
+        return watch
+
+    def remove(self, watch_id: int) -> bool:
+        if self.watches.pop(watch_id, None) is None:
+            return False
+        self._mark()
+        return True
+
+    def clear(self):
+        self.watches.clear()
+        self.hit = None
+        self._mark()
+
+    def _mark(self):
+        pages = self.pages
+        pages[:] = bytes(len(pages))
+        for watch in self.watches.values():
+            for page in range(watch.start >> PAGE_SHIFT, ((watch.end - 1) >> PAGE_SHIFT) + 1):
+                pages[page] = 1
+
+    def take_hit(self) -> Optional[dict]:
+        hit, self.hit = self.hit, None
+        return hit
+
+    def check(self, state, pc: int, handler, rd: int, base: int, offset: int) -> Optional[str]:
+        # Called before a LOAD/STORE executes; returns the stop note if the
+        # access triggers a watchpoint
+        addr = (state.registers[base] + offset) & 0xFFFF
+        if addr >= 0xFFFF or not (self.pages[addr >> PAGE_SHIFT]
+                                  or self.pages[(addr + 1) >> PAGE_SHIFT]):
+            return None
+        memory = state.memory
+        old = memory[addr] | (memory[addr + 1] << 8)
+        write = handler is op_store
+        new = state.registers[rd] if write else old
+        for watch in self.watches.values():
+            if not (addr < watch.end and watch.start < addr + 2):
+                continue
+            if watch.kind == WATCH_READ:
+                triggered = not write
+            elif watch.kind == WATCH_WRITE:
+                triggered = write
+            else:
+                triggered = write and new != old
+            if triggered:
+                self.hit = dict(watch.to_dict(), address=addr, pc=pc, old=old, new=new)
+                return f"WATCHPOINT {watch.kind} at ADDR={addr:04X} PC={pc:04X}"
+        return None
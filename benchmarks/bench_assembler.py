@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Lines-per-second benchmark for the assembler
+Assembles large generated sources that mix every instruction format,
+labels, comments and blank lines
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from assembler import Assembler
+
+
+def generate_source(lines: int, seed: int = 1) -> str:
+    # Machine-generated style program: blocks of straight-line code, each
+    # ending in branches to nearby labels
+    rng = random.Random(seed)
+    out = ["; generated benchmark program"]
+    block = 0
+    while len(out) < lines:
+        out.append(f"block{block}:")
+        for _ in range(rng.randint(4, 12)):
+            rd, rs, rt = (rng.randint(0, 7) for _ in range(3))
+            kind = rng.randrange(6)
+            if kind == 0:
+                out.append(f"        ADD  R{rd}, R{rs}, R{rt}")
+            elif kind == 1:
+                out.append(f"        SUB  R{rd}, R{rs}, R{rt}    ; difference")
+            elif kind == 2:
+                out.append(f"        ADDI R{rd}, R{rs}, {rng.randint(-32, 31)}")
+            elif kind == 3:
+                out.append(f"        LOAD R{rd}, R{rs}, {rng.randint(-32, 31)}")
+            elif kind == 4:
+                out.append(f"        STORE R{rd}, R{rs}, 0x{rng.randint(0, 31):X}")
+            else:
+                out.append("")
+        target = max(0, block - rng.randint(0, 3))
+        out.append(f"        BRZ  block{target}")
+        out.append(f"        JMP  block{block + 1}")
+        block += 1
+    out.append(f"block{block}: HALT")
+    return "\n".join(out)
+
+
+def bench_assemble(source: str, repeat: int = 5) -> float:
+    lines = source.count("\n") + 1
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        binary, errors = Assembler().assemble(source)
+        elapsed = time.perf_counter() - start
+        assert not errors, errors[:3]
+        best = max(best, lines / elapsed)
+    return best
+
+
+def main():
+    for lines in (1_000, 10_000, 50_000):
+        source = generate_source(lines)
+        print(f"{lines:>6} lines: {bench_assemble(source):>12,.0f} lines/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Instructions-per-second benchmark for the simulator dispatch loop
+Runs an array-sum loop modeled on examples/sum_array.asm
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from assembler import Assembler
+from simulator import Simulator
+
+# R3 = 31 * 2^10 iterations of the sum_array loop body
+SUM_LOOP = """
+        ADDI R3, R0, 31
+""" + "        ADD  R3, R3, R3\n" * 10 + """
+loop:   LOAD R4, R1, 0
+        ADD  R2, R2, R4
+        ADDI R1, R1, 2
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def bench_run(binary, max_steps, trace='full', repeat=3):
+    best = 0.0
+    for _ in range(repeat):
+        simulator = Simulator()
+        simulator.load_program(binary)
+        start = time.perf_counter()
+        simulator.run(max_steps, trace)
+        elapsed = time.perf_counter() - start
+        best = max(best, simulator.state.instruction_count / elapsed)
+    return best
+
+
+def bench_step(binary, max_steps, repeat=3):
+    best = 0.0
+    for _ in range(repeat):
+        simulator = Simulator()
+        simulator.load_program(binary)
+        start = time.perf_counter()
+        while not simulator.state.halted and simulator.state.instruction_count < max_steps:
+            simulator.step()
+        elapsed = time.perf_counter() - start
+        best = max(best, simulator.state.instruction_count / elapsed)
+    return best
+
+
+def main():
+    binary, errors = Assembler().assemble(SUM_LOOP)
+    if errors:
+        print("\n".join(errors))
+        return 1
+
+    max_steps = 200000
+    print(f"sum_array loop, {max_steps} instructions per run")
+    print(f"  run(), full trace:  {bench_run(binary, max_steps):>12,.0f} instr/s")
+    print(f"  run(), last 256:    {bench_run(binary, max_steps, 256):>12,.0f} instr/s")
+    print(f"  run(), no trace:    {bench_run(binary, max_steps, 'none'):>12,.0f} instr/s")
+    print(f"  step():             {bench_step(binary, max_steps):>12,.0f} instr/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Parameter-sweep benchmark: one program over many input sets
+Compares looping Simulator.run against the NumPy lockstep engine
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from assembler import Assembler
+from lockstep import LockstepSimulator
+from simulator import Simulator
+
+# Sums R3 words starting at the address in R1; each lane gets its own data
+SWEEP_LOOP = """
+loop:   LOAD R4, R1, 0
+        ADD  R2, R2, R4
+        ADDI R1, R1, 2
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def inputs(lane):
+    data = bytes([lane & 0xFF]) * 2048
+    return [0, 0x0100, 0, 1000, 0, 0, 0, 0], {0x0100: data}
+
+
+def bench_simulators(binary, lanes, max_steps, trace):
+    start = time.perf_counter()
+    executed = 0
+    for lane in range(lanes):
+        registers, memory = inputs(lane)
+        simulator = Simulator()
+        simulator.load_program(binary)
+        simulator.state.registers[:] = registers
+        for addr, data in memory.items():
+            simulator.state.memory[addr:addr + len(data)] = data
+        simulator.run(max_steps, trace)
+        executed += simulator.state.instruction_count
+    return executed / (time.perf_counter() - start)
+
+
+def bench_lockstep(binary, lanes, max_steps):
+    start = time.perf_counter()
+    batch = LockstepSimulator(lanes)
+    batch.load_program(binary)
+    for lane in range(lanes):
+        registers, memory = inputs(lane)
+        batch.set_lane(lane, registers=registers, memory=memory)
+    executed = batch.run(max_steps)
+    return executed / (time.perf_counter() - start)
+
+
+def main():
+    binary, errors = Assembler().assemble(SWEEP_LOOP)
+    if errors:
+        print("\n".join(errors))
+        return 1
+
+    max_steps = 100000
+    for lanes in (100, 1000):
+        print(f"{lanes} input sets")
+        print(f"  Simulator.run, full trace: {bench_simulators(binary, lanes, max_steps, 'full'):>12,.0f} instr/s")
+        print(f"  Simulator.run, no trace:   {bench_simulators(binary, lanes, max_steps, 'none'):>12,.0f} instr/s")
+        print(f"  LockstepSimulator:         {bench_lockstep(binary, lanes, max_steps):>12,.0f} instr/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite with machine-readable results and regression checks
+Runs the canonical simulator workloads through step() and run(), times the
+assembler on generated sources and program image loading, and measures
+per-session memory. Results can be written as JSON and compared against an
+earlier results file.
+
+    python benchmarks/bench_suite.py --json results.json
+    python benchmarks/bench_suite.py --compare baseline.json --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from assembler import Assembler
+from bench_assembler import bench_assemble, generate_source
+from bench_dispatch import SUM_LOOP, bench_run, bench_step
+from image import SECTION_CODE, SECTION_DATA, ProgramImage, Section, write_image
+from sessions import SessionManager
+from simulator import Simulator
+
+# Doubles R3 ten times: 31 * 2^10 loop iterations
+_COUNTER = "        ADDI R3, R0, 31\n" + "        ADD  R3, R3, R3\n" * 10
+
+ALU_LOOP = _COUNTER + """
+        ADDI R1, R0, 1
+loop:   ADD  R2, R2, R1
+        SUB  R4, R2, R1
+        OR   R5, R4, R2
+        AND  R6, R5, R1
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+# Alternates taken and not-taken branches on the counter's low bit
+BRANCH_LOOP = _COUNTER + """
+        ADDI R5, R0, 1
+loop:   ADDI R3, R3, -1
+        BRZ  done
+        AND  R4, R3, R5
+        BRZ  even
+        JMP  loop
+even:   JMP  loop
+done:   HALT
+"""
+
+WORKLOADS = {
+    'alu_loop': ALU_LOOP,
+    'sum_array': SUM_LOOP,
+    'branch_loop': BRANCH_LOOP,
+}
+
+ASSEMBLY_SIZES = (10_000, 50_000)
+
+DEFAULT_THRESHOLD = 0.10
+
+
+def metric(value: float, unit: str, higher_is_better: bool = True) -> dict:
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def bench_session_memory(binary, max_steps: int) -> int:
+    # Peak traced allocation for one session that loads and runs a program
+    # with a full trace
+    manager = SessionManager(pool_size=0)
+    tracemalloc.start()
+    try:
+        session, _ = manager.open(object())
+        session.simulator.load_program(binary)
+        session.simulator.run(max_steps)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_image_load(repeat: int = 50) -> float:
+    # Best time in microseconds to load a prebuilt image filling 60 KB of
+    # memory from disk
+    binary, _ = Assembler().assemble(SUM_LOOP)
+    code = b''.join(word.to_bytes(2, 'little') for word in binary)
+    image = ProgramImage(0, [Section(SECTION_CODE, 0, code),
+                             Section(SECTION_DATA, 0x1000, bytes(range(256)) * 240)])
+    simulator = Simulator()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.img')
+        with open(path, 'wb') as f:
+            f.write(write_image(image))
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            simulator.load_image_file(path)
+            best = min(best, time.perf_counter() - start)
+    return best * 1e6
+
+
+def run_suite(max_steps: int = 200_000, repeat: int = 3) -> dict:
+    metrics = {}
+    for name, source in WORKLOADS.items():
+        binary, errors = Assembler().assemble(source)
+        assert not errors, errors
+        metrics[f'{name}.run_full'] = metric(bench_run(binary, max_steps, 'full', repeat), 'instr/s')
+        metrics[f'{name}.run_none'] = metric(bench_run(binary, max_steps, 'none', repeat), 'instr/s')
+        metrics[f'{name}.step'] = metric(bench_step(binary, max_steps, repeat), 'instr/s')
+
+    for lines in ASSEMBLY_SIZES:
+        source = generate_source(lines)
+        metrics[f'assemble.{lines}'] = metric(bench_assemble(source, repeat), 'lines/s')
+
+    metrics['image.load'] = metric(bench_image_load(), 'us', False)
+
+    binary, _ = Assembler().assemble(SUM_LOOP)
+    metrics['session.memory'] = metric(bench_session_memory(binary, max_steps), 'bytes', False)
+    return metrics
+
+
+def compare(current: dict, baseline: dict, threshold: float):
+    # (name, baseline value, current value, relative change, regressed) for
+    # every metric in both; change is positive when the result got better
+    rows = []
+    for name, entry in current.items():
+        base = baseline.get(name)
+        if base is None or not base['value']:
+            continue
+        change = (entry['value'] - base['value']) / base['value']
+        if not entry['higher_is_better']:
+            change = -change
+        rows.append((name, base['value'], entry['value'], change, change < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--compare', help="results file to check for regressions against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed relative slowdown (default %(default)s)")
+    parser.add_argument('--steps', type=int, default=200_000,
+                        help="instructions per simulator run (default %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    metrics = run_suite(args.steps, args.repeat)
+    for name, entry in metrics.items():
+        print(f"{name:<24} {entry['value']:>14,.0f} {entry['unit']}")
+
+    if args.json:
+        results = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'steps': args.steps,
+            'metrics': metrics,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['metrics']
+        rows = compare(metrics, baseline, args.threshold)
+        print(f"\nCompared with {args.compare} (threshold {args.threshold:.0%})")
+        for name, old, new, change, regressed in rows:
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:<24} {old:>14,.0f} -> {new:>14,.0f} {change:+8.1%}{flag}")
+        if any(row[4] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Load test for /ws/simulate with a fleet of simulated IDE clients
+Starts the API server locally (or targets --url), connects N clients that
+each edit, assemble, load, step, run and toggle breakpoints in a weighted
+mix with think time between actions, and reports latency percentiles per
+action, throughput and server memory. Results can be written as JSON and
+compared against an earlier results file like bench_suite.py.
+
+    python benchmarks/bench_websocket.py --clients 50 --duration 30 --json ws.json
+    python benchmarks/bench_websocket.py --clients 50 --compare ws.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import websockets
+from bench_suite import DEFAULT_THRESHOLD, compare, metric
+
+BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+# What a client sends; edits change the loop count (count * 16) so
+# assembly is redone
+PROGRAM = """
+        ADDI R3, R0, {count}
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+        ADDI R1, R0, 1
+loop:   ADD  R2, R2, R1
+        STORE R2, R0, 16
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+# Addresses in the loop body, for breakpoints
+BREAKPOINT_ADDRESSES = (12, 14, 16)
+
+# Relative weights of each action per mix
+MIXES = {
+    # Mostly single steps and short runs, an occasional edit
+    'ide': {'step': 40, 'step_count': 10, 'run': 15, 'breakpoint': 10, 'assemble': 10,
+            'load': 5, 'reset': 5, 'sync': 5},
+    'stepping': {'step': 80, 'step_count': 10, 'breakpoint': 10},
+    'running': {'run': 70, 'step': 20, 'assemble': 10},
+}
+
+# Reply message type that completes each request
+REPLIES = {
+    'assemble': 'assembled',
+    'load': 'state',
+    'step': 'state',
+    'step_count': 'state',
+    'run': 'complete',
+    'reset': 'state',
+    'sync': 'state',
+    'set_breakpoint': 'breakpoint_set',
+    'clear_breakpoint': 'breakpoint_cleared',
+}
+
+SERVER_START_TIMEOUT = 20.0
+# Seconds a client waits for a reply before giving up
+REQUEST_TIMEOUT = 30.0
+MEMORY_SAMPLE_INTERVAL = 0.25
+
+
+def percentile(values: List[float], p: float) -> float:
+    # Nearest-rank percentile of sorted values
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+def reply_halted(reply: dict) -> Optional[bool]:
+    # The halted flag from the state a reply carries: under "state" with
+    # full sync, or under "delta" when it changed; None if it has neither
+    for key in ('state', 'delta'):
+        part = reply.get(key)
+        if isinstance(part, dict) and 'halted' in part:
+            return part['halted']
+    return None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, log_path: Optional[str] = None) -> subprocess.Popen:
+    # uvicorn in a child process, waited on until / answers
+    log = open(log_path, 'a') if log_path else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=BACKEND, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not start")
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    # Resident set size from /proc; None where that is unavailable
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.connect: List[float] = []
+        self.failed_clients = 0
+        self.memory: List[int] = []
+
+    def add(self, action: str, seconds: float, error: bool):
+        self.latencies.setdefault(action, []).append(seconds)
+        if error:
+            self.errors[action] = self.errors.get(action, 0) + 1
+
+    def summary(self, elapsed: float) -> dict:
+        actions = {}
+        for action, values in sorted(self.latencies.items()):
+            values.sort()
+            actions[action] = {
+                'count': len(values),
+                'errors': self.errors.get(action, 0),
+                'mean_ms': sum(values) / len(values) * 1e3,
+                'p50_ms': percentile(values, 50) * 1e3,
+                'p95_ms': percentile(values, 95) * 1e3,
+                'p99_ms': percentile(values, 99) * 1e3,
+                'max_ms': values[-1] * 1e3,
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        self.connect.sort()
+        return {
+            'actions': actions,
+            'requests': total,
+            'errors': sum(self.errors.values()),
+            'throughput': total / elapsed if elapsed else 0.0,
+            'connect_p95_ms': percentile(self.connect, 95) * 1e3,
+            'failed_clients': self.failed_clients,
+            'server_rss_start': self.memory[0] if self.memory else None,
+            'server_rss_peak': max(self.memory) if self.memory else None,
+            'server_rss_end': self.memory[-1] if self.memory else None,
+        }
+
+
+class LoadClient:
+    # One simulated user on its own connection. Requests go one at a time;
+    # a request's latency runs from sending it to its reply arriving.
+
+    def __init__(self, url: str, mix: Dict[str, int], think: float, stats: Stats,
+                 rng: random.Random):
+        self.url = url
+        self.actions = list(mix)
+        self.weights = list(mix.values())
+        self.think = think
+        self.stats = stats
+        self.rng = rng
+        self.binary: List[int] = []
+        self.breakpoints = set()
+        self.halted = False
+
+    async def request(self, ws, action: str, message: dict) -> dict:
+        # Send and read until the reply completing it; binary state frames
+        # and progress messages along the way are skipped
+        expected = REPLIES[action]
+        started = time.perf_counter()
+        await ws.send(json.dumps(message))
+        deadline = time.monotonic() + REQUEST_TIMEOUT
+        while True:
+            try:
+                received = await asyncio.wait_for(ws.recv(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                # The client gives up on its connection
+                self.stats.add(action, time.perf_counter() - started, True)
+                raise
+            if isinstance(received, bytes):
+                continue
+            reply = json.loads(received)
+            if reply.get('type') in (expected, 'error'):
+                break
+        self.stats.add(action, time.perf_counter() - started, reply['type'] == 'error')
+        halted = reply_halted(reply)
+        if halted is not None:
+            self.halted = halted
+        return reply
+
+    async def assemble_and_load(self, ws):
+        source = PROGRAM.format(count=self.rng.randint(4, 31))
+        reply = await self.request(ws, 'assemble', {'action': 'assemble', 'source': source})
+        if reply.get('success'):
+            self.binary = reply['binary']
+        await self.request(ws, 'load', {'action': 'load', 'binary': self.binary})
+
+    async def act(self, ws, action: str):
+        if self.halted and action in ('step', 'step_count', 'run'):
+            action = 'reset'
+        if action == 'assemble':
+            await self.assemble_and_load(ws)
+        elif action == 'load':
+            await self.request(ws, 'load', {'action': 'load', 'binary': self.binary})
+        elif action == 'step':
+            await self.request(ws, 'step', {'action': 'step'})
+        elif action == 'step_count':
+            await self.request(ws, 'step_count', {'action': 'step', 'count': 100, 'trace': 10})
+        elif action == 'run':
+            await self.request(ws, 'run', {'action': 'run', 'max_steps': 5000, 'trace': 20})
+        elif action == 'reset':
+            # Reset clears memory and breakpoints; the program is loaded
+            # again after it
+            await self.request(ws, 'reset', {'action': 'reset'})
+            self.breakpoints.clear()
+            await self.request(ws, 'load', {'action': 'load', 'binary': self.binary})
+        elif action == 'sync':
+            mode = self.rng.choice(['full', 'delta'])
+            await self.request(ws, 'sync', {'action': 'sync', 'mode': mode})
+        elif action == 'breakpoint':
+            address = self.rng.choice(BREAKPOINT_ADDRESSES)
+            if address in self.breakpoints:
+                self.breakpoints.discard(address)
+                await self.request(ws, 'clear_breakpoint',
+                                   {'action': 'clear_breakpoint', 'address': address})
+            else:
+                self.breakpoints.add(address)
+                await self.request(ws, 'set_breakpoint',
+                                   {'action': 'set_breakpoint', 'address': address})
+
+    async def run(self, deadline: float):
+        started = time.perf_counter()
+        try:
+            async with websockets.connect(self.url, max_size=None) as ws:
+                await ws.recv()  # session message
+                self.stats.connect.append(time.perf_counter() - started)
+                await self.assemble_and_load(ws)
+                while time.monotonic() < deadline:
+                    action = self.rng.choices(self.actions, self.weights)[0]
+                    await self.act(ws, action)
+                    if self.think:
+                        await asyncio.sleep(self.rng.expovariate(1 / self.think))
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+            self.stats.failed_clients += 1
+
+
+async def sample_memory(pid: int, stats: Stats, stop: asyncio.Event):
+    while True:
+        rss = rss_bytes(pid)
+        if rss is not None:
+            stats.memory.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), MEMORY_SAMPLE_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(url: str, clients: int, duration: float, mix: Dict[str, int], think: float,
+                   ramp: float, seed: int, pid: Optional[int] = None) -> dict:
+    stats = Stats()
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_memory(pid, stats, stop)) if pid else None
+    started = time.monotonic()
+    deadline = started + ramp + duration
+
+    async def client(i: int):
+        # Connections are spread over the ramp-up period
+        await asyncio.sleep(ramp * i / clients)
+        await LoadClient(url, mix, think, stats, random.Random(seed + i)).run(deadline)
+
+    await asyncio.gather(*(client(i) for i in range(clients)))
+    elapsed = time.monotonic() - started
+    if sampler is not None:
+        stop.set()
+        await sampler
+    return stats.summary(elapsed)
+
+
+def result_metrics(summary: dict) -> dict:
+    # bench_suite-style metrics, for --compare
+    metrics = {'ws.throughput': metric(summary['throughput'], 'req/s')}
+    for action, entry in summary['actions'].items():
+        for p in ('p50', 'p95', 'p99'):
+            metrics[f'ws.{action}.{p}'] = metric(entry[f'{p}_ms'], 'ms', False)
+    if summary['server_rss_peak'] is not None:
+        metrics['server.rss_peak'] = metric(summary['server_rss_peak'], 'bytes', False)
+    return metrics
+
+
+def print_summary(summary: dict):
+    print(f"{'action':<18} {'count':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+          f" {'max ms':>9}")
+    for action, entry in summary['actions'].items():
+        print(f"{action:<18} {entry['count']:>8,} {entry['errors']:>7,} {entry['p50_ms']:>9.2f}"
+              f" {entry['p95_ms']:>9.2f} {entry['p99_ms']:>9.2f} {entry['max_ms']:>9.2f}")
+    print(f"\n{summary['requests']:,} requests, {summary['throughput']:,.0f}/s,"
+          f" {summary['errors']} errors, {summary['failed_clients']} failed clients,"
+          f" connect p95 {summary['connect_p95_ms']:.1f} ms")
+    if summary['server_rss_peak'] is not None:
+        print(f"server RSS {summary['server_rss_start'] / 2**20:.1f} MB at start,"
+              f" {summary['server_rss_peak'] / 2**20:.1f} MB peak,"
+              f" {summary['server_rss_end'] / 2**20:.1f} MB at end")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--clients', type=int, default=20, help="concurrent clients (default %(default)s)")
+    parser.add_argument('--duration', type=float, default=20.0,
+                        help="seconds of load after ramp-up (default %(default)s)")
+    parser.add_argument('--ramp', type=float, default=2.0,
+                        help="seconds over which clients connect (default %(default)s)")
+    parser.add_argument('--mix', choices=sorted(MIXES), default='ide',
+                        help="action mix (default %(default)s)")
+    parser.add_argument('--think', type=float, default=0.1,
+                        help="mean seconds between a client's actions, 0 for none (default %(default)s)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="ws:// URL of a running server instead of starting one")
+    parser.add_argument('--pid', type=int, help="process to sample memory of with --url")
+    parser.add_argument('--server-log', help="file for the started server's output")
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--compare', help="results file to check for regressions against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed relative slowdown (default %(default)s)")
+    args = parser.parse_args()
+
+    server = None
+    url, pid = args.url, args.pid
+    if url is None:
+        port = free_port()
+        server = start_server(port, args.server_log)
+        url, pid = f'ws://127.0.0.1:{port}/ws/simulate', server.pid
+    try:
+        summary = asyncio.run(run_load(url, args.clients, args.duration, MIXES[args.mix],
+                                       args.think, args.ramp, args.seed, pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_summary(summary)
+    metrics = result_metrics(summary)
+
+    if args.json:
+        results = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'clients': args.clients,
+            'duration': args.duration,
+            'mix': args.mix,
+            'think': args.think,
+            'summary': summary,
+            'metrics': metrics,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['metrics']
+        rows = compare(metrics, baseline, args.threshold)
+        print(f"\nCompared with {args.compare} (threshold {args.threshold:.0%})")
+        for name, old, new, change, regressed in rows:
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:<24} {old:>14,.2f} -> {new:>14,.2f} {change:+8.1%}{flag}")
+        if any(row[4] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
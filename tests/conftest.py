@@ -0,0 +1,25 @@
+"""
+Shared test setup - makes the backend modules importable
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from assembler import Assembler
+from simulator import Simulator
+
+
+@pytest.fixture
+def make_simulator():
+    # Returns make(source): a fresh Simulator with source assembled and loaded
+    def make(source):
+        binary, errors = Assembler().assemble(source)
+        assert errors == []
+        simulator = Simulator()
+        simulator.load_program(binary)
+        return simulator
+    return make
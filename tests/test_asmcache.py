@@ -0,0 +1,57 @@
+"""
+Unit tests for the assembly cache
+"""
+
+import pytest
+from asmcache import AssemblyCache, normalize_source
+from assembler import Assembler
+
+
+SOURCE = """
+; count down
+        ADDI R3, R0, 4
+loop:   ADDI R3, R3, -1     ; decrement
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def test_hit_and_miss():
+    cache = AssemblyCache()
+    first = cache.assemble(SOURCE)
+    assert (list(first.binary), list(first.errors)) == Assembler().assemble(SOURCE)
+    assert first.labels == {'loop': 2, 'done': 8}
+    assert cache.assemble(SOURCE) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_normalized_sources_share_entry():
+    """Test comment and layout changes hit the same entry"""
+    cache = AssemblyCache()
+    first = cache.assemble(SOURCE)
+    reformatted = "\n\n".join(line.strip() for line in SOURCE.replace("; decrement", "").split("\n"))
+    assert normalize_source(reformatted) == normalize_source(SOURCE)
+    assert cache.assemble(reformatted) is first
+    assert cache.assemble(SOURCE.replace("-1", "-2")) is not first
+    assert len(cache) == 2
+
+
+def test_errors_are_cached():
+    cache = AssemblyCache()
+    result = cache.assemble("ADD R9, R1, R1")
+    assert result.errors == ("Register out of range: R9",)
+    assert cache.assemble("ADD R9, R1, R1") is result
+
+
+def test_byte_budget_evicts_oldest():
+    cache = AssemblyCache(max_bytes=2000)
+    sources = [f"ADDI R1, R0, {n}\n" * 10 for n in range(10)]
+    for source in sources:
+        cache.assemble(source)
+    assert cache.size <= 2000
+    assert 0 < len(cache) < 10
+    cache.assemble(sources[-1])
+    assert cache.hits == 1
+    cache.assemble(sources[0])
+    assert cache.misses == 11
@@ -62,3 +62,28 @@ def test_halt():
     assert len(errors) == 0
     assert binary[0] == 0xA000  # HALT opcode << 12
 
+
+
+def test_error_messages():
+    """Test the table-driven encoder reports the same errors as before"""
+    cases = {
+        "ADDI R1, R2, 40": "Line 0: Immediate out of range: 40 (must be -32 to 31)",
+        "LOAD R1, R2, -33": "Line 0: Offset out of range: -33 (must be -32 to 31)",
+        "SUB R1, R2": "Line 0: SUB requires 3 operands",
+        "JMP": "Line 0: JMP requires 1 operand",
+        "JMP nowhere": "Line 0: Unknown label or invalid offset: nowhere",
+        "BRZ 600": "Line 0: Jump offset out of range: 600 (must be -512 to 511)",
+        "STORE R1, X2, 0": "Invalid register: X2",
+        "MUL R1, R2, R3": "Line 0: Unknown instruction: MUL",
+    }
+    for source, message in cases.items():
+        binary, errors = Assembler().assemble(source)
+        assert binary == []
+        assert errors == [message]
+
+
+def test_operand_spellings():
+    """Test hex, '#' and lowercase operands"""
+    binary, errors = Assembler().assemble("addi r1, r2, 0x1F\nSTORE R3,R4,#-2\nBRZ -4")
+    assert errors == []
+    assert binary == [0x529F, 0x773E, 0x93FC]
@@ -0,0 +1,74 @@
+"""
+Unit tests for batch execution
+"""
+
+import os
+
+import pytest
+from batch import BatchJob, BatchRunner, run_job
+
+
+def test_run_job_source():
+    """Test a job assembled from source runs to HALT"""
+    result = run_job(BatchJob(id="add", source="ADDI R1, R0, 5\nADD R2, R1, R1\nHALT"))
+    assert result['status'] == 'halted'
+    assert result['state']['registers'][2] == 10
+    assert result['errors'] == []
+
+
+def test_run_job_initial_state():
+    """Test registers and memory from the job are applied before running"""
+    # LOAD R2, R1, 0 ; HALT
+    job = BatchJob(binary=[0x6440, 0xA000], registers=[0, 0x20], memory={0x20: [0x34, 0x12]},
+                   trace_last=1)
+    result = run_job(job)
+    assert result['state']['registers'][2] == 0x1234
+    assert result['trace_log'] == ["PC=0002 I=A000 HALT"]
+
+
+def test_run_job_limits():
+    """Test assembly errors, step limits and timeouts are reported per job"""
+    assert run_job(BatchJob(source="BOGUS"))['status'] == 'error'
+    looping = "loop: ADDI R1, R1, 1\nBRZ loop\nJMP loop"
+    assert run_job(BatchJob(source=looping, max_steps=100))['status'] == 'max_steps'
+    assert run_job(BatchJob(source=looping, max_steps=10**9, timeout=0.05))['status'] == 'timeout'
+
+
+def test_runner_streams_all_results():
+    """Test the process pool returns one result per job"""
+    runner = BatchRunner(workers=2)
+    try:
+        jobs = [BatchJob(id=str(i), source=f"ADDI R1, R0, {i}\nHALT") for i in range(6)]
+        results = {r['id']: r for r in runner.run(jobs)}
+    finally:
+        runner.shutdown()
+    assert sorted(results) == [str(i) for i in range(6)]
+    assert all(results[str(i)]['state']['registers'][1] == i for i in range(6))
+
+
+def test_run_job_rejects_memory_out_of_bounds():
+    """Test memory past 0xFFFF or below 0 is a per-job error, not a write"""
+    for memory in ({0xFFFF: [1, 2]}, {0x10000: [1]}, {-1: [1]}, {0: [256]}):
+        result = run_job(BatchJob(binary=[0xA000], memory=memory))
+        assert result['status'] == 'error'
+        assert result['errors'][0].startswith("Bad memory")
+    # The worker's simulator keeps its 64K memory
+    result = run_job(BatchJob(binary=[0xA000], memory={0xFFFE: [1, 2]}))
+    assert result['status'] == 'halted'
+
+
+def test_dead_worker_replaces_pool():
+    """Test a broken pool is swapped out without waiting for it"""
+    runner = BatchRunner(workers=1)
+    try:
+        broken = runner.pool
+        result = runner._collect(broken.submit(os._exit, 1), BatchJob(id="x"), broken)
+        assert result['errors'] == ["Worker process died"]
+        fresh = runner.pool
+        assert fresh is not broken
+        # A late report about the old pool leaves the fresh one in place
+        runner._discard_pool(broken)
+        assert runner.pool is fresh
+        assert [r['status'] for r in runner.run([BatchJob(binary=[0xA000])])] == ['halted']
+    finally:
+        runner.shutdown()
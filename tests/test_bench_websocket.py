@@ -0,0 +1,55 @@
+"""
+Unit tests for the WebSocket load-test client
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'benchmarks'))
+
+from bench_websocket import LoadClient, Stats, reply_halted
+
+
+class FakeSocket:
+    # Answers each request with the reply type it waits for, halting the
+    # machine on any run
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, text):
+        self.sent.append(json.loads(text))
+
+    async def recv(self):
+        action = self.sent[-1]['action']
+        if action == 'run':
+            return json.dumps({'type': 'complete', 'state': {'halted': True}})
+        if action in ('reset', 'load'):
+            return json.dumps({'type': 'state', 'delta': {'halted': False}, 'seq': 1})
+        return json.dumps({'type': 'state', 'delta': {}, 'seq': 1})
+
+
+def test_reply_halted():
+    assert reply_halted({'type': 'state', 'state': {'halted': True}}) is True
+    assert reply_halted({'type': 'state', 'delta': {'halted': False}}) is False
+    assert reply_halted({'type': 'state', 'delta': {'pc': 4}}) is None
+    assert reply_halted({'type': 'assembled', 'halted': True}) is None
+
+
+def test_halted_machine_is_reset():
+    client = LoadClient('ws://unused', {'run': 1}, 0, Stats(), random.Random(0))
+    ws = FakeSocket()
+
+    async def scenario():
+        await client.act(ws, 'run')
+        assert client.halted
+        # Running a halted machine resets and reloads it instead
+        await client.act(ws, 'run')
+        await client.act(ws, 'step')
+
+    asyncio.run(scenario())
+    assert [m['action'] for m in ws.sent] == ['run', 'reset', 'load', 'step']
+    assert not client.halted
@@ -0,0 +1,83 @@
+"""
+Unit tests for basic-block compilation
+"""
+
+import pytest
+from assembler import Assembler
+from simulator import Simulator
+from tracebuf import TRACE_NONE
+
+
+SUM_SOURCE = """
+        ADDI R3, R0, 31
+        ADD  R3, R3, R3
+loop:   LOAD R4, R1, 0
+        ADD  R2, R2, R4
+        ADDI R1, R1, 2
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def run_both(source, max_steps=100000, breakpoints=()):
+    binary, errors = Assembler().assemble(source)
+    assert errors == []
+    results = []
+    for compile_blocks in (False, True):
+        simulator = Simulator()
+        simulator.compile_blocks = compile_blocks
+        simulator.load_program(binary)
+        simulator.breakpoints.update(breakpoints)
+        log = simulator.run(max_steps, TRACE_NONE)
+        results.append((log, simulator.get_state_dict(), simulator))
+    return results
+
+
+def test_compiled_matches_interpreter():
+    """Test a compiled loop ends in exactly the interpreter's state"""
+    (log, state, _), (jit_log, jit_state, simulator) = run_both(SUM_SOURCE)
+    assert jit_log == log
+    assert jit_state == state
+    assert state['halted']
+    assert simulator.block_cache.blocks
+
+
+def test_max_steps_accounting():
+    """Test compiled blocks never overrun max_steps"""
+    (_, state, _), (_, jit_state, _) = run_both(SUM_SOURCE, max_steps=301)
+    assert jit_state == state
+    assert jit_state['instruction_count'] == 301
+
+
+def test_breakpoint_inside_block():
+    """Test a breakpoint in the middle of a hot block still stops the run"""
+    (log, state, _), (jit_log, jit_state, _) = run_both(SUM_SOURCE, breakpoints=[0x0A])
+    assert jit_log == log == ["BREAKPOINT at PC=000A"]
+    assert jit_state == state
+
+
+def test_store_into_block_invalidates():
+    """Test a STORE that rewrites a compiled block is seen by the next entry"""
+    # After 22 iterations the loop patches its ADDI R2, R2, 1 into
+    # ADDI R2, R2, 2 by copying the word stored at `data`
+    source = """
+        ADDI R3, R0, 30
+        ADDI R5, R0, 8
+        ADDI R4, R0, 26
+loop:   ADDI R2, R2, 1
+        ADDI R3, R3, -1
+        BRZ  done
+        SUB  R7, R3, R5
+        BRZ  patch
+        JMP  loop
+patch:  LOAD  R6, R4, 0
+        STORE R6, R0, 6
+        JMP  loop
+done:   HALT
+data:   ADDI R2, R2, 2
+    """
+    (_, state, _), (_, jit_state, _) = run_both(source)
+    assert jit_state == state
+    assert state['registers'][2] == 22 + 2 * 8
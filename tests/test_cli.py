@@ -0,0 +1,87 @@
+"""
+Unit tests for the command line batch runner
+"""
+
+import json
+
+from cli import find_programs, main
+
+
+COUNT_SOURCE = """
+        ADDI R3, R0, 5
+loop:   ADDI R1, R1, 1
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def write_tree(root):
+    (root / "a").mkdir()
+    (root / "b").mkdir()
+    (root / "a" / "count.asm").write_text(COUNT_SOURCE)
+    (root / "a" / "count.json").write_text(json.dumps({"registers": [0, 100]}))
+    (root / "b" / "count.asm").write_text(COUNT_SOURCE)
+    (root / "b" / "bad.asm").write_text("BOGUS R1\n")
+    (root / "b" / "notes.txt").write_text("not a program")
+
+
+def run_cli(capsys, *argv):
+    status = main(["run", "--workers", "2", "--quiet", *argv])
+    lines = capsys.readouterr().out.splitlines()
+    return status, {record["path"]: record for record in map(json.loads, lines)}
+
+
+def test_find_programs(tmp_path):
+    write_tree(tmp_path)
+    found = [relative for _, relative in find_programs([str(tmp_path)])]
+    assert found == ["a/count.asm", "b/bad.asm", "b/count.asm"]
+
+
+def test_run_directory(tmp_path, capsys):
+    """Test every program runs with its sidecar and pattern fixtures"""
+    write_tree(tmp_path)
+    fixtures = tmp_path / "fixtures.json"
+    fixtures.write_text(json.dumps({"b/*": {"max_steps": 4, "memory": {"0x20": [1, 2]}}}))
+    status, records = run_cli(capsys, str(tmp_path), "--fixtures", str(fixtures), "--memory")
+    assert status == 1
+    assert len(records) == 3
+
+    a = records[str(tmp_path / "a" / "count.asm")]
+    assert (a["status"], a["halted"], a["registers"][1]) == ("halted", True, 105)
+    assert a["instruction_count"] == a["cycle_count"] == 21
+    assert "elapsed" in a
+
+    b = records[str(tmp_path / "b" / "count.asm")]
+    assert (b["status"], b["instruction_count"]) == ("max_steps", 4)
+    assert b["memory"][0x20:0x22] == [1, 2]
+
+    bad = records[str(tmp_path / "b" / "bad.asm")]
+    assert bad["status"] == "error" and bad["errors"]
+
+
+def test_run_single_file(tmp_path, capsys):
+    write_tree(tmp_path)
+    path = str(tmp_path / "a" / "count.asm")
+    status, records = run_cli(capsys, path, "--trace-last", "1")
+    assert status == 0
+    assert records[path]["trace_log"] == ["PC=000A I=A000 HALT"]
+    assert "memory" not in records[path]
+
+
+def test_bad_fixtures_rejected(tmp_path, capsys):
+    """Test fixtures with memory out of range or wrong types stop the run"""
+    (tmp_path / "count.asm").write_text(COUNT_SOURCE)
+    fixtures = tmp_path / "fixtures.json"
+    for bad in ({"memory": {"0xFFFF": [1, 2]}}, {"memory": {"-1": [1]}},
+                {"memory": {"0": [300]}}, {"registers": "R1"}, {"start_address": 0x10000},
+                {"max_steps": "many"}, {"flags": {"Q": True}}, [1, 2]):
+        fixtures.write_text(json.dumps({"*": bad}))
+        assert main(["run", "--quiet", str(tmp_path), "--fixtures", str(fixtures)]) == 2
+        assert "error:" in capsys.readouterr().err
+
+    fixtures.unlink()
+    (tmp_path / "count.json").write_text("[]")
+    assert main(["run", "--quiet", str(tmp_path)]) == 2
+    assert "count.json: fixture must be a JSON object" in capsys.readouterr().err
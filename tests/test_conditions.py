@@ -0,0 +1,126 @@
+"""
+Unit tests for run-until conditions
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from conditions import compile_condition
+from streaming import RUN_CONDITION, StreamingRun
+from timing import TimingModel
+
+# Counts R3 down from 124, storing it at 0x1E each time round
+COUNT_SOURCE = """
+        ADDI R3, R0, 31
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+loop:   STORE R3, R0, 30
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def reference(make_simulator, test):
+    # Step one instruction at a time until test(state) holds before one
+    simulator = make_simulator(COUNT_SOURCE)
+    while not test(simulator.state):
+        simulator.step()
+    return simulator.get_state_dict()
+
+
+def test_rejects_unsafe_expressions():
+    for text in ("", "R9 == 0", "state.pc", "open('x')", "mem[1:2]", "__import__('os')",
+                 "pc ==", "x" * 300):
+        with pytest.raises(ValueError):
+            compile_condition(text)
+
+
+def test_rejects_costly_operators_and_constants():
+    for text in ("R1 // R2 == 3", "R1 % 2 == 0", "R1 << -1 == 0", "R1 >> 1 == 0",
+                 "R1 * R2 == 4", "R1 == 70000", "R1 == (1 + 0x10000)"):
+        with pytest.raises(ValueError):
+            compile_condition(text)
+    assert compile_condition("R1 == -1 or R2 & 0xFFFF == 3").pcs is None
+
+
+def test_evaluation_error_stops_with_note():
+    # State missing memory: the condition fails instead of raising
+    condition = compile_condition("mem[5] == 1")
+    state = SimpleNamespace(registers=[0] * 8, memory=b'')
+    assert condition.test(state, 0, 0) is True
+    assert condition.note(0x12) == "CONDITION mem[5] == 1 failed at PC=0012: IndexError: index out of range"
+
+
+def test_pc_only_conditions():
+    assert compile_condition("pc == 0x0A").pcs == {0x0A}
+    assert compile_condition("pc == 6 or 0x0C == pc").pcs == {6, 0x0C}
+    assert compile_condition("pc == 6 and R1 == 0").pcs is None
+
+
+def test_run_until_register(make_simulator):
+    expected = reference(make_simulator, lambda state: state.registers[3] == 100)
+    simulator = make_simulator(COUNT_SOURCE)
+    log = simulator.run(100000, 'none', compile_condition("R3 == 100"))
+    assert log == [f"CONDITION R3 == 100 at PC={expected['pc']:04X}"]
+    assert simulator.get_state_dict() == expected
+
+
+def test_pc_condition_matches_generic(make_simulator):
+    """Test pc-only conditions, run as breakpoints, stop where the generic test does"""
+    fast = make_simulator(COUNT_SOURCE)
+    slow = make_simulator(COUNT_SOURCE)
+    for _ in range(3):
+        fast.run(100000, 'none', compile_condition("pc == 0x0C"))
+        slow.run(100000, 'none', compile_condition("pc == 0x0C and True"))
+        assert fast.get_state_dict() == slow.get_state_dict()
+        assert fast.state.pc == 0x0C
+        # move past the stop, as a client would before continuing
+        fast.step()
+        slow.step()
+
+
+def test_instruction_count_across_slices(make_simulator):
+    condition = compile_condition("icount >= 250")
+    simulator = make_simulator(COUNT_SOURCE)
+    simulator.enable_history()
+    assert simulator.execute(100, None, condition) is None
+    assert simulator.execute(1000, None, condition) is not None
+    assert simulator.state.instruction_count == 250
+
+
+def test_memory_and_flag_conditions(make_simulator):
+    expected = reference(make_simulator, lambda state: state.read_word(0x1E) == 60)
+    simulator = make_simulator(COUNT_SOURCE)
+    simulator.run(100000, 'full', compile_condition("word[0x1E] == 60 and not Z"))
+    assert simulator.get_state_dict() == expected
+
+
+def test_condition_with_sampled_timing(make_simulator):
+    expected = reference(make_simulator, lambda state: state.registers[3] == 7)
+    simulator = make_simulator(COUNT_SOURCE)
+    simulator.enable_timing(TimingModel(sample_interval=100, sample_window=10))
+    simulator.run(100000, 'none', compile_condition("R3 == 7"))
+    assert simulator.state.registers[3] == 7
+    assert simulator.state.pc == expected['pc']
+    assert simulator.state.instruction_count == expected['instruction_count']
+
+
+def test_streaming_run_until(make_simulator):
+    async def main():
+        simulator = make_simulator(COUNT_SOURCE)
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        run = StreamingRun(simulator, send, None, 'none', True, 50,
+                           until=compile_condition("R3 == 3"))
+        return await run.run(), messages[-1], simulator
+
+    status, message, simulator = asyncio.run(main())
+    assert status == RUN_CONDITION
+    assert message['trace_log'][-1].startswith("CONDITION R3 == 3")
+    assert simulator.state.registers[3] == 3
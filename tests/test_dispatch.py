@@ -0,0 +1,69 @@
+"""
+Unit tests for the predecoded dispatch table
+"""
+
+import pytest
+from assembler import Assembler
+from dispatch import decode_entry, get_dispatch_table, op_add, op_addi, op_jmp
+from simulator import Simulator
+
+
+LOOP_SOURCE = """
+        ADDI R3, R0, 5
+loop:   ADDI R2, R2, 3
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def test_table_is_shared():
+    """Test every simulator dispatches through the same table"""
+    assert Simulator().table is Simulator().table
+    assert len(get_dispatch_table()) == 0x10000
+
+
+def test_decode_entry():
+    """Test operands are decoded once into the entry"""
+    # ADD R1, R2, R3
+    assert decode_entry(0x1298) == (op_add, 1, 2, 3)
+    # ADDI R3, R3, -1
+    assert decode_entry(0x56FF) == (op_addi, 3, 3, -1)
+    # JMP -4
+    assert decode_entry(0x83FC) == (op_jmp, 0, -4, 0)
+
+
+def test_unused_bits_share_entry():
+    """Test words differing only in unused bits share one entry"""
+    table = get_dispatch_table()
+    assert table[0x1298] is table[0x129F]
+
+
+def test_backward_branch_loop():
+    """Test a counted loop with a backward JMP runs to completion"""
+    binary, errors = Assembler().assemble(LOOP_SOURCE)
+    assert errors == []
+    simulator = Simulator()
+    simulator.load_program(binary)
+    simulator.run(1000)
+    assert simulator.state.halted
+    assert simulator.state.registers[2] == 15
+    assert simulator.state.instruction_count == 1 + 5 * 3 + 4 + 1
+
+
+def test_run_matches_step():
+    """Test run() produces the same trace and counters as step()"""
+    binary, _ = Assembler().assemble(LOOP_SOURCE)
+    stepped = Simulator()
+    stepped.load_program(binary)
+    step_trace = []
+    while not stepped.state.halted:
+        step_trace.append(stepped.step())
+
+    ran = Simulator()
+    ran.load_program(binary)
+    assert ran.run(1000) == step_trace
+    assert ran.get_state_dict() == stepped.get_state_dict()
+    assert "PC=0008 I=83FA JMP -6" in step_trace
+    assert any("BRZ (taken)" in line for line in step_trace)
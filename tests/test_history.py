@@ -0,0 +1,112 @@
+"""
+Unit tests for checkpoints and reverse stepping
+"""
+
+import pytest
+from history import MAX_CHECKPOINTS, MAX_JOURNAL_BYTES, PAGE_COUNT, history_limits
+from simulator import Simulator
+from tracebuf import TRACE_NONE
+
+
+STORE_LOOP = """
+        ADDI R1, R0, 8
+        ADDI R2, R0, 0
+loop:   STORE R1, R2, 30
+        ADDI R2, R2, 2
+        ADDI R1, R1, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def test_step_back_undoes_steps(make_simulator):
+    """Test step_back(n) returns to the state from n steps earlier"""
+    simulator = make_simulator(STORE_LOOP)
+    simulator.enable_history()
+    states = [simulator.get_state_dict()]
+    for _ in range(12):
+        simulator.step()
+        states.append(simulator.get_state_dict())
+
+    assert simulator.step_back(5) == 5
+    assert simulator.get_state_dict() == states[7]
+    assert simulator.step_back(100) == 7
+    assert simulator.get_state_dict() == states[0]
+
+
+def test_step_back_after_run(make_simulator):
+    """Test run() journals too, including the final HALT"""
+    simulator = make_simulator(STORE_LOOP)
+    simulator.enable_history()
+    simulator.run(1000, TRACE_NONE)
+    assert simulator.state.halted
+    halted = simulator.get_state_dict()
+
+    simulator.step_back(1)
+    assert not simulator.state.halted
+    simulator.run(1000, TRACE_NONE)
+    assert simulator.get_state_dict() == halted
+
+
+def test_restore_checkpoint(make_simulator):
+    """Test restore() through the journal and through pages"""
+    simulator = make_simulator(STORE_LOOP)
+    simulator.enable_history()
+    simulator.run(10, TRACE_NONE)
+    first = simulator.checkpoint()
+    expected = simulator.get_state_dict()
+    simulator.run(1000, TRACE_NONE)
+
+    simulator.restore(first)
+    assert simulator.get_state_dict() == expected
+
+    # A journal too small to reach back falls back to the saved pages
+    simulator = make_simulator(STORE_LOOP)
+    simulator.enable_history(max_journal_bytes=64)
+    simulator.run(10, TRACE_NONE)
+    first = simulator.checkpoint()
+    simulator.run(1000, TRACE_NONE)
+    assert simulator.history.length == 4
+    simulator.restore(first)
+    assert simulator.get_state_dict() == expected
+
+
+def test_checkpoint_pages_are_shared(make_simulator):
+    """Test a checkpoint only copies pages written since the previous one"""
+    simulator = make_simulator(STORE_LOOP)
+    simulator.enable_history()
+    first = simulator.checkpoint()
+    simulator.step()
+    simulator.step()
+    simulator.step()  # STORE to 0x1E
+    second = simulator.checkpoint()
+
+    pages_1 = simulator.history.checkpoints[first].pages
+    pages_2 = simulator.history.checkpoints[second].pages
+    changed = [i for i in range(PAGE_COUNT) if pages_1[i] is not pages_2[i]]
+    assert changed == [0]
+
+
+def test_unknown_checkpoint():
+    simulator = Simulator()
+    with pytest.raises(KeyError):
+        simulator.restore(1)
+    simulator.checkpoint()
+    with pytest.raises(KeyError):
+        simulator.restore(99)
+
+
+def test_checkpoint_limit(make_simulator):
+    simulator = make_simulator(STORE_LOOP)
+    simulator.enable_history(max_checkpoints=2)
+    ids = [simulator.checkpoint() for _ in range(3)]
+    assert list(simulator.history.checkpoints) == ids[1:]
+
+
+def test_history_limits():
+    assert history_limits(4096, 8) == (4096, 8)
+    assert history_limits(2 ** 40, 10 ** 6) == (MAX_JOURNAL_BYTES, MAX_CHECKPOINTS)
+    for limits in (("1024", 8), (1024, -1), (1.5, 8), (True, 8), (None, 8)):
+        with pytest.raises(ValueError):
+            history_limits(*limits)
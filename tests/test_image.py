@@ -0,0 +1,89 @@
+"""
+Unit tests for program images
+"""
+
+import pytest
+from assembler import Assembler
+from image import SECTION_CODE, SECTION_DATA, ProgramImage, Section, read_image, write_image
+from simulator import Simulator
+
+
+# sum_array.asm with its array shipped in a data section
+SUM_SOURCE = """
+        .data 0x0100
+array:  .word 5, 10, 15, 20
+        .text 0x0020
+start:  LOAD R1, R0, 30         ; R1 = &array
+        LOAD R3, R0, 28         ; R3 = count
+loop:   LOAD R4, R1, 0
+        ADD  R2, R2, R4
+        ADDI R1, R1, 2
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+        .org 0x001C
+        .word 4, array
+"""
+
+
+def test_assemble_sections():
+    image, errors = Assembler().assemble_image(SUM_SOURCE)
+    assert errors == []
+    assert image.entry == 0x20
+    assert [(s.kind, s.address, len(s.data)) for s in image.sections] == [
+        (SECTION_DATA, 0x100, 8), (SECTION_CODE, 0x20, 18), (SECTION_CODE, 0x1C, 4)]
+    assert image.symbols == {'array': 0x100, 'start': 0x20, 'loop': 0x24, 'done': 0x30}
+    binary, _ = Assembler().assemble("\n".join(SUM_SOURCE.split("\n")[4:13]))
+    assert bytes(image.sections[1].data) == b''.join(w.to_bytes(2, 'little') for w in binary)
+
+
+def test_load_and_run(tmp_path):
+    image, _ = Assembler().assemble_image(SUM_SOURCE)
+    path = tmp_path / "sum.img"
+    path.write_bytes(write_image(image))
+
+    simulator = Simulator()
+    assert simulator.load_image_file(str(path)) == image.symbols
+    assert simulator.state.pc == 0x20
+    simulator.run(1000, 'none')
+    assert simulator.state.halted
+    assert simulator.state.registers[2] == 50
+
+
+def test_round_trip():
+    image = ProgramImage(2, [Section(SECTION_CODE, 0, b'\x00\xa0'), Section(SECTION_DATA, 0xFFFE, b'\x01\x02')],
+                         {'main': 0, 'top': 0xFFFE})
+    data = write_image(image)
+    parsed = read_image(data)
+    assert (parsed.entry, parsed.symbols) == (2, image.symbols)
+    assert [(s.kind, s.address, bytes(s.data)) for s in parsed.sections] == [
+        (s.kind, s.address, s.data) for s in image.sections]
+
+
+def test_malformed_images():
+    data = write_image(ProgramImage(0, [Section(SECTION_DATA, 0x10, b'\x01\x02')], {'x': 0}))
+    with pytest.raises(ValueError, match="magic"):
+        read_image(b'XXXX' + data[4:])
+    with pytest.raises(ValueError, match="Truncated"):
+        read_image(data[:14])
+    with pytest.raises(ValueError, match="out of bounds"):
+        read_image(data[:-1])
+
+
+def test_directive_errors():
+    image, errors = Assembler().assemble_image("""
+        .data 0x101
+        .word 70000
+        .org
+        .fill 3
+        ADDI R1, R0, 99
+    """)
+    assert image is None
+    assert errors == [
+        "Line 2: Invalid section address: 0x101",
+        "Line 4: .org requires an address",
+        "Line 5: Unknown directive: .fill",
+        "Line 3: Word out of range: 70000",
+        "Line 6: Immediate out of range: 99 (must be -32 to 31)",
+    ]
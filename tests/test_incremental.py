@@ -0,0 +1,103 @@
+"""
+Unit tests for incremental re-assembly
+"""
+
+import random
+
+import pytest
+from assembler import Assembler
+from incremental import AssemblySession
+from simulator import Simulator
+
+
+SOURCE = """
+        ADDI R3, R0, 4
+loop:   ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+LINES = ["ADD R1, R2, R3", "ADDI R1, R1, -1", "LOAD R4, R1, 0", "STORE R2, R0, 8", "HALT",
+         "", "; comment", "loop:", "loop: ADDI R3, R3, 1", "done: HALT", "JMP loop",
+         "BRZ done", "JMP 4", "BRZ x", "ADD R9, R1, R1", "ADDI R1, R1, 99", "x: NOP",
+         "  JMP   loop  ; back", "FOO R1", "BRZ R3, done"]
+
+
+def test_matches_full_assembly():
+    """Test random edits always give the same binary and errors as assemble()"""
+    rng = random.Random(7)
+    session = AssemblySession()
+    lines = [rng.choice(LINES) for _ in range(20)]
+    for _ in range(500):
+        roll = rng.random()
+        if roll < 0.5 and lines:
+            lines[rng.randrange(len(lines))] = rng.choice(LINES)
+        elif roll < 0.75:
+            lines.insert(rng.randrange(len(lines) + 1), rng.choice(LINES))
+        elif lines:
+            del lines[rng.randrange(len(lines))]
+        source = "\n".join(lines)
+        update = session.update(source)
+        assert (update.binary, update.errors) == Assembler().assemble(source)
+
+
+def test_in_place_edit_changes():
+    session = AssemblySession()
+    first = session.update(SOURCE)
+    assert first.labels == {'loop': 2, 'done': 8}
+
+    update = session.update(SOURCE.replace("R3, R0, 4", "R3, R0, 9"))
+    assert update.changes == [(0, 0x5609)]
+    assert update.binary[1:] == first.binary[1:]
+
+
+def test_moved_label_reencodes_branches():
+    session = AssemblySession()
+    session.update(SOURCE)
+    source = SOURCE.replace("done:", "        NOP\ndone:")
+    update = session.update(source)
+    assert update.binary == Assembler().assemble(source)[0]
+    # BRZ done moved +2, JMP loop is unchanged, NOP and HALT are new words
+    assert [i for i, _ in update.changes] == [2, 4, 5]
+
+
+def test_errors_have_no_changes():
+    session = AssemblySession()
+    session.update(SOURCE)
+    update = session.update(SOURCE.replace("JMP  loop", "JMP  nowhere"))
+    assert update.errors == ["Line 0: Unknown label or invalid offset: nowhere"]
+    assert update.changes is None
+
+
+def test_patch_loaded_program():
+    """Test patching the changes in matches loading the new binary"""
+    session = AssemblySession()
+    simulator = Simulator()
+    simulator.load_program(session.update(SOURCE).binary)
+    simulator.step()
+    update = session.update(SOURCE.replace("ADDI R3, R3, -1", "ADDI R3, R3, -2"))
+    simulator.patch_program(update.changes)
+    simulator.run(100)
+
+    expected = Simulator()
+    expected.load_program(update.binary)
+    expected.step()
+    expected.run(100)
+    assert simulator.get_state_dict() == expected.get_state_dict()
+
+
+def test_shrink_zeroes_removed_words():
+    """Test removing instructions clears the old tail of a patched program"""
+    session = AssemblySession()
+    simulator = Simulator()
+    simulator.load_program(session.update(SOURCE).binary)
+    source = SOURCE.replace("        JMP  loop\n", "")
+    update = session.update(source)
+    assert update.changes[-1] == (4, 0)
+    simulator.patch_program(update.changes)
+
+    expected = Simulator()
+    expected.load_program(update.binary)
+    assert simulator.get_state_dict() == expected.get_state_dict()
+    assert simulator.state.memory == expected.state.memory
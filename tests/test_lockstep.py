@@ -0,0 +1,81 @@
+"""
+Unit tests for the NumPy lockstep batch engine
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from assembler import Assembler
+from lockstep import LockstepSimulator
+from simulator import Simulator
+
+
+SUM_SOURCE = """
+loop:   LOAD R4, R1, 0
+        ADD  R2, R2, R4
+        ADDI R1, R1, 2
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def assemble(source):
+    binary, errors = Assembler().assemble(source)
+    assert errors == []
+    return binary
+
+
+def test_lanes_match_simulator():
+    """Test every lane ends in the same state as its own Simulator"""
+    binary = assemble(SUM_SOURCE)
+    batch = LockstepSimulator(4)
+    batch.load_program(binary)
+    expected = []
+    for lane in range(4):
+        # different counts make the lanes' PCs diverge
+        registers = [0, 0x0100, 0, lane + 2, 0, 0, 0, 0]
+        data = bytes(range(lane, lane + 16))
+        batch.set_lane(lane, registers=registers, memory={0x0100: data})
+
+        simulator = Simulator()
+        simulator.load_program(binary)
+        simulator.state.registers[:] = registers
+        simulator.state.memory[0x0100:0x0110] = data
+        simulator.run(1000)
+        expected.append(simulator.get_state_dict())
+
+    batch.run(1000)
+    assert batch.get_state_dicts() == expected
+    assert batch.halted.all()
+
+
+def test_store_and_flags():
+    """Test STORE, SUB flags and carry per lane"""
+    binary = assemble("""
+        ADD   R3, R1, R2
+        STORE R3, R0, 8
+        SUB   R4, R1, R1
+        HALT
+    """)
+    batch = LockstepSimulator(2)
+    batch.load_program(binary)
+    batch.set_lane(0, registers=[0, 0xFFFF, 2])
+    batch.set_lane(1, registers=[0, 1, 2])
+    batch.run()
+    first, second = batch.get_state_dicts()
+    assert first['memory'][8:10] == [0x01, 0x00]
+    assert first['flags'] == {'Z': True, 'N': False, 'C': True}
+    assert second['memory'][8:10] == [0x03, 0x00]
+    assert second['flags'] == {'Z': True, 'N': False, 'C': False}
+
+
+def test_max_steps():
+    """Test run stops after max_steps vector steps"""
+    batch = LockstepSimulator(3)
+    batch.load_program(assemble("loop: JMP loop"))
+    assert batch.run(50) == 150
+    assert batch.instruction_count.tolist() == [50, 50, 50]
+    assert not batch.halted.any()
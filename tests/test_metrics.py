@@ -0,0 +1,69 @@
+"""
+Unit tests for the metrics registry and text format
+"""
+
+import pytest
+from metrics import Counter, Gauge, Histogram, RateMeter, Registry
+
+
+def test_counter_and_gauge_render():
+    registry = Registry()
+    requests = registry.add(Counter('requests_total', "Requests", ('path',)))
+    open_now = registry.add(Gauge('open', "Open things"))
+    requests.inc(1, '/a')
+    requests.inc(2, '/a')
+    requests.inc(1, 'say "hi"\n')
+    open_now.inc()
+    open_now.inc()
+    open_now.dec()
+    assert registry.render() == (
+        '# HELP requests_total Requests\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{path="/a"} 3\n'
+        'requests_total{path="say \\"hi\\"\\n"} 1\n'
+        '# HELP open Open things\n'
+        '# TYPE open gauge\n'
+        'open 1\n')
+
+
+def test_histogram_buckets():
+    histogram = Histogram('latency_seconds', "Latency", ('action',), (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, 'step')
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{action="step",le="0.1"} 2',
+        'latency_seconds_bucket{action="step",le="1"} 3',
+        'latency_seconds_bucket{action="step",le="+Inf"} 4',
+        'latency_seconds_sum{action="step"} 3.65',
+        'latency_seconds_count{action="step"} 4',
+    ]
+
+
+def test_collected_values():
+    source = {'hits': 4}
+    hits = Counter('hits_total', "Hits", collect=lambda: source['hits'])
+    source['hits'] = 9
+    assert hits.render()[-1] == 'hits_total 9'
+    by_kind = Gauge('things', "Things", ('kind',), collect=lambda: {('a',): 1, ('b',): 2})
+    assert by_kind.render()[2:] == ['things{kind="a"} 1', 'things{kind="b"} 2']
+
+
+def test_rate_meter():
+    now = [100.0]
+    meter = RateMeter(window=10, clock=lambda: now[0])
+    meter.add(50)
+    now[0] = 105.5
+    meter.add(50)
+    assert meter.rate() == 10.0
+    now[0] = 112.0
+    # the first second has left the window
+    assert meter.rate() == 5.0
+    now[0] = 200.0
+    assert meter.rate() == 0.0
+
+
+def test_duplicate_names():
+    registry = Registry()
+    registry.add(Counter('x_total', "X"))
+    with pytest.raises(ValueError):
+        registry.add(Gauge('x_total', "X again"))
@@ -0,0 +1,73 @@
+"""
+Unit tests for the execution profiler
+"""
+
+import pytest
+from incremental import AssemblySession
+
+
+COUNT_SOURCE = """; count down from 4
+        ADDI R3, R0, 4
+loop:   ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def test_counts(make_simulator):
+    simulator = make_simulator(COUNT_SOURCE)
+    simulator.enable_profiler()
+    simulator.run(1000, 'none')
+    profiler = simulator.profiler
+    assert profiler.total == simulator.state.instruction_count == 13
+    assert list(profiler.pc_counts[:10]) == [1, 0, 4, 0, 4, 0, 3, 0, 1, 0]
+    assert profiler.taken[4] == 1
+    report = profiler.report(simulator.state.memory)
+    assert report['opcodes'] == {'ADDI': 5, 'BRZ': 4, 'JMP': 3, 'HALT': 1}
+    assert report['branches'] == [{'pc': 4, 'executed': 4, 'taken': 1, 'not_taken': 3,
+                                   'taken_ratio': 0.25}]
+
+
+def test_step_matches_run(make_simulator):
+    """Test step() and every run() loop fill the same counters"""
+    stepped = make_simulator(COUNT_SOURCE)
+    stepped.enable_profiler()
+    while not stepped.state.halted:
+        stepped.step()
+    for trace in ('full', 'none', 4):
+        simulator = make_simulator(COUNT_SOURCE)
+        simulator.enable_profiler()
+        simulator.run(1000, trace)
+        assert simulator.profiler.pc_counts == stepped.profiler.pc_counts
+        assert simulator.profiler.taken == stepped.profiler.taken
+        assert simulator.profiler.opcode_counts == stepped.profiler.opcode_counts
+
+
+def test_report_maps_to_source(make_simulator):
+    session = AssemblySession()
+    update = session.update(COUNT_SOURCE)
+    simulator = make_simulator(COUNT_SOURCE)
+    simulator.enable_profiler()
+    simulator.run(1000, 'none')
+    report = simulator.profiler.report(simulator.state.memory, 2, update.labels,
+                                       session.source_map(), session.lines)
+    assert report['hotspots'] == [
+        {'pc': 2, 'label': 'loop', 'line': 3, 'source': 'loop:   ADDI R3, R3, -1', 'count': 4},
+        {'pc': 4, 'label': 'loop+2', 'line': 4, 'source': 'BRZ  done', 'count': 4},
+    ]
+    loop, = report['loops']
+    assert (loop['start']['label'], loop['end']['pc']) == ('loop', 6)
+    assert loop['iterations'] == 3
+    assert loop['instructions'] == 11
+
+
+def test_reset_and_disable(make_simulator):
+    simulator = make_simulator(COUNT_SOURCE)
+    simulator.enable_profiler()
+    simulator.run(1000, 'none')
+    simulator.reset()
+    assert simulator.profiler.total == 0
+    simulator.disable_profiler()
+    simulator.run(1000, 'none')
+    assert simulator.profiler is None
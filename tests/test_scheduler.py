@@ -0,0 +1,98 @@
+"""
+Unit tests for the fair run scheduler
+"""
+
+import asyncio
+
+import pytest
+from scheduler import BudgetExhausted, Scheduler
+from streaming import RUN_BUDGET, RUN_HALTED, StreamingRun
+
+
+COUNT_SOURCE = """
+        ADDI R3, R0, 31
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+loop:   ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+async def discard(message):
+    pass
+
+
+def test_scheduled_run_matches_plain_run(make_simulator):
+    expected = make_simulator(COUNT_SOURCE)
+    expected_log = expected.run(10000)
+
+    async def main():
+        scheduler = Scheduler(quantum=50)
+        simulator = make_simulator(COUNT_SOURCE)
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        run = StreamingRun(simulator, send, slice_steps=scheduler.quantum, scheduler=scheduler)
+        status = await run.run()
+        scheduler.shutdown()
+        return status, simulator, messages, scheduler.stats()
+
+    status, simulator, messages, stats = asyncio.run(main())
+    assert status == RUN_HALTED
+    assert messages == [{'type': 'complete', 'trace_log': expected_log}]
+    assert simulator.get_state_dict() == expected.get_state_dict()
+    assert stats['quanta'] == 8 and stats['steps'] == len(expected_log)
+
+
+def test_priorities_share_cpu(make_simulator):
+    """Test two busy sessions get quanta in proportion to priority"""
+    async def main():
+        scheduler = Scheduler(quantum=500)
+        low, high = scheduler.client(1.0), scheduler.client(3.0)
+        runs = [StreamingRun(make_simulator("loop: JMP loop"), discard, None, 'none', True,
+                             scheduler.quantum, scheduler=scheduler, client=client)
+                for client in (low, high)]
+        tasks = [asyncio.create_task(run.run()) for run in runs]
+        while low.quanta + high.quanta < 200:
+            await asyncio.sleep(0.005)
+        for run in runs:
+            run.cancel()
+        await asyncio.gather(*tasks)
+        scheduler.shutdown()
+        return low, high, scheduler.stats()
+
+    low, high, stats = asyncio.run(main())
+    assert 2.0 < high.quanta / low.quanta < 4.5
+    assert stats['max_queue_depth'] >= 1
+    assert stats['wait_max'] >= stats['wait_avg'] > 0
+
+
+def test_cpu_budget(make_simulator):
+    async def main():
+        scheduler = Scheduler(quantum=100, cpu_budget=0.0)
+        run = StreamingRun(make_simulator(COUNT_SOURCE), discard, 10000, 'none', scheduler=scheduler)
+        status = await run.run()
+        with pytest.raises(BudgetExhausted):
+            await scheduler.execute(run.client, run.simulator, 10)
+        scheduler.shutdown()
+        return status, run.steps, scheduler.stats()
+
+    status, steps, stats = asyncio.run(main())
+    assert status == RUN_BUDGET
+    assert steps == 0
+    assert stats['budget_exhausted'] == 2
+
+
+def test_priority_is_clamped():
+    client = Scheduler().client(100)
+    assert client.priority == 4.0
+    client.set_priority(0)
+    assert client.priority == 0.25
+    for bad in ("high", None, True, float('nan'), [1]):
+        with pytest.raises(ValueError):
+            client.set_priority(bad)
+    assert client.priority == 0.25
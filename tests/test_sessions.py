@@ -0,0 +1,126 @@
+"""
+Unit tests for the simulator session pool
+"""
+
+import asyncio
+
+import pytest
+from sessions import SessionManager
+from simulator import MEMORY_SIZE
+
+
+def test_resume_returns_same_simulator():
+    manager = SessionManager(pool_size=2)
+    owner = object()
+    session, resumed = manager.open(owner)
+    assert not resumed
+    session.simulator.state.registers[1] = 7
+    manager.close(session, owner)
+    assert session.owner is None
+
+    again, resumed = manager.open(object(), session.id)
+    assert resumed and again is session
+    assert again.simulator.state.registers[1] == 7
+
+    fresh, resumed = manager.open(object(), "unknown")
+    assert not resumed and fresh is not session
+
+
+def test_takeover_ignores_stale_close():
+    """Test the old connection's close does not detach a resumed session"""
+    manager = SessionManager()
+    old, new = object(), object()
+    session, _ = manager.open(old)
+    manager.open(new, session.id)
+    manager.close(session, old)
+    assert session.owner is new
+
+
+def test_lru_eviction_under_byte_budget():
+    manager = SessionManager(max_bytes=3 * MEMORY_SIZE, pool_size=1)
+    opened = []
+    for _ in range(3):
+        owner = object()
+        session, _ = manager.open(owner)
+        manager.close(session, owner)
+        opened.append(session)
+    # touch the oldest so the second becomes least recently used
+    owner = object()
+    manager.open(owner, opened[0].id)
+    manager.close(opened[0], owner)
+
+    attached, _ = manager.open(object())
+    assert len(manager) == 3
+    assert manager.get(opened[1].id) is None
+    assert manager.get(opened[0].id) is opened[0]
+    assert manager.evictions == 1
+    assert manager.get(attached.id) is attached
+
+
+def test_attached_sessions_are_not_evicted():
+    manager = SessionManager(max_sessions=1)
+    first, _ = manager.open(object())
+    second, _ = manager.open(object())
+    assert len(manager) == 2
+    assert manager.stats()['attached'] == 2
+
+
+def test_pool_reuses_reset_simulators():
+    manager = SessionManager(max_sessions=1, pool_size=1)
+    owner = object()
+    session, _ = manager.open(owner)
+    simulator = session.simulator
+    simulator.state.write_word(0x100, 0xBEEF)
+    simulator.breakpoints.add(4)
+    manager.close(session, owner)
+    assert manager.discard(session.id)
+
+    reused, _ = manager.open(object())
+    assert reused.simulator is simulator
+    assert simulator.state.read_word(0x100) == 0
+    assert not simulator.breakpoints
+
+
+def test_running_simulator_pooled_after_run_ends():
+    # A cancelled run still finishing a quantum keeps its simulator out of
+    # the pool until the run task is done
+    async def scenario():
+        manager = SessionManager(max_sessions=1, pool_size=1)
+        owner = object()
+        session, _ = manager.open(owner)
+        simulator = session.simulator
+        simulator.state.write_word(0x100, 0xBEEF)
+        quantum_done = asyncio.Event()
+
+        async def run():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                await quantum_done.wait()
+                # Still using the simulator after cancellation
+                assert simulator.state.read_word(0x100) == 0xBEEF
+                raise
+
+        session.run_task = asyncio.create_task(run())
+        await asyncio.sleep(0)
+        manager.close(session, owner)
+        newer, _ = manager.open(object())
+        assert manager.get(session.id) is None
+        assert newer.simulator is not simulator
+
+        quantum_done.set()
+        with pytest.raises(asyncio.CancelledError):
+            await session.run_task
+        assert manager._pool == [simulator]
+        assert simulator.state.read_word(0x100) == 0
+
+    asyncio.run(scenario())
+
+
+def test_stats_report_memory():
+    manager = SessionManager(pool_size=0)
+    session, _ = manager.open(object())
+    session.simulator.enable_history(max_journal_bytes=1024)
+    stats = manager.stats()
+    assert stats['sessions'] == 1 and stats['pooled'] == 0
+    assert stats['bytes'] == MEMORY_SIZE + 1024
@@ -84,3 +84,74 @@ def test_load_store():
     trace = simulator.step()
     assert simulator.state.registers[3] == 42
 
+
+
+def test_packed_flags():
+    """Test flag dict access is backed by the packed flag bits"""
+    simulator = Simulator()
+    simulator.state.flags['C'] = True
+    assert simulator.state.flag_bits == 0x4
+    simulator.state.flags = {'Z': True, 'N': False, 'C': False}
+    assert simulator.state.flags['Z'] == True
+    assert simulator.state.flags['C'] == False
+
+
+def test_state_dict_shape():
+    """Test get_state_dict keeps its JSON-friendly shape"""
+    simulator = Simulator()
+    simulator.load_program([0x5245, 0xA000])
+    state = simulator.get_state_dict()
+    assert state['registers'] == [0] * 8
+    assert state['flags'] == {'Z': False, 'N': False, 'C': False}
+    assert isinstance(state['memory'], list)
+    assert len(state['memory']) == 1024
+    assert state['memory'][:4] == [0x45, 0x52, 0x00, 0xA0]
+
+
+def test_word_access():
+    """Test little-endian word helpers and bulk loads at the top of memory"""
+    simulator = Simulator()
+    simulator.state.write_word(0x0200, 0xBEEF)
+    assert simulator.state.memory[0x0200] == 0xEF
+    assert simulator.state.read_word(0x0200) == 0xBEEF
+
+    simulator.load_program([0x1111, 0x2222, 0x3333], start_address=0xFFFC)
+    assert simulator.state.read_word(0xFFFC) == 0x1111
+    assert simulator.state.read_word(0xFFFE) == 0x2222
+
+
+def test_snapshot_restore():
+    """Test a snapshot restores memory, registers and flags"""
+    simulator = Simulator()
+    simulator.state.registers[1] = 7
+    simulator.state.memory[10] = 99
+    snapshot = simulator.state.snapshot()
+
+    simulator.reset()
+    assert simulator.state.memory[10] == 0
+    simulator.state.restore(snapshot)
+    assert simulator.state.registers[1] == 7
+    assert simulator.state.memory[10] == 99
+
+
+def test_memory_ranges():
+    """Test ranged reads and bulk writes anywhere in memory"""
+    simulator = Simulator()
+    assert simulator.write_memory(0xFFF0, bytes(range(16))) == 16
+    assert simulator.read_memory(0xFFF8, 8) == bytes(range(8, 16))
+    assert simulator.get_state_dict((0xFFFE, 0x10000))['memory'] == [14, 15]
+    assert simulator.get_state_dict(None)['memory'] == []
+    with pytest.raises(ValueError):
+        simulator.write_memory(0xFFFF, b'ab')
+    with pytest.raises(ValueError):
+        simulator.read_memory(-1, 4)
+
+
+def test_write_memory_is_checkpointed():
+    simulator = Simulator()
+    simulator.checkpoint()
+    simulator.write_memory(0x3000, b'xy')
+    second = simulator.checkpoint()
+    simulator.write_memory(0x3000, b'zz')
+    simulator.restore(second)
+    assert simulator.read_memory(0x3000, 2) == b'xy'
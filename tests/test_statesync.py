@@ -0,0 +1,135 @@
+"""
+Unit tests for delta and binary state updates
+"""
+
+import pytest
+from simulator import Simulator
+from statesync import (ENCODING_BINARY, SYNC_DELTA, StateSync, decode_frame, decode_memory_frame,
+                       diff_memory, encode_memory_frame)
+
+
+def apply_delta(state, delta):
+    # What a client does with a JSON delta or decoded frame
+    for index, value in delta.get('registers', []):
+        state['registers'][index] = value
+    for key in ('pc', 'flags', 'halted', 'cycle_count', 'instruction_count'):
+        if key in delta:
+            state[key] = delta[key]
+    for addr, data in delta.get('memory', []):
+        state['memory'][addr:addr + len(data)] = data
+
+
+SOURCE = """
+        ADDI R1, R0, 5
+        STORE R1, R0, 8
+        ADDI R1, R1, -5
+        HALT
+"""
+
+
+def test_diff_memory():
+    old = bytes(32)
+    new = bytearray(old)
+    new[3] = 1
+    new[5] = 2
+    new[20] = 3
+    assert diff_memory(old, bytes(new), 0x100) == [(0x103, b'\x01\x00\x02'), (0x114, b'\x03')]
+    assert diff_memory(old, old) == []
+
+
+def test_full_mode_unchanged(make_simulator):
+    """Test the default mode still sends get_state_dict()"""
+    simulator = make_simulator(SOURCE)
+    sync = StateSync(simulator)
+    assert sync.update() == {'state': simulator.get_state_dict()}
+    simulator.step()
+    assert sync.update() == {'state': simulator.get_state_dict()}
+
+
+def test_json_deltas_rebuild_state(make_simulator):
+    simulator = make_simulator(SOURCE)
+    sync = StateSync(simulator, SYNC_DELTA)
+    first = sync.update()
+    client = first['state']
+    seq = first['seq']
+    while not simulator.state.halted:
+        simulator.step()
+        update = sync.update()
+        assert update['seq'] == seq + 1
+        seq = update['seq']
+        apply_delta(client, update['delta'])
+        assert client == simulator.get_state_dict()
+
+    # Nothing changed, nothing sent
+    assert sync.update()['delta'] == {}
+
+
+def test_binary_frames_rebuild_state(make_simulator):
+    simulator = make_simulator(SOURCE)
+    sync = StateSync(simulator, SYNC_DELTA, ENCODING_BINARY)
+    full = decode_frame(sync.update())
+    assert full['kind'] == 'full'
+    client = {'registers': [0] * 8, 'memory': [0] * 1024}
+    apply_delta(client, full)
+    assert client == simulator.get_state_dict()
+
+    simulator.step()
+    frame = sync.update()
+    assert len(frame) < 40
+    apply_delta(client, decode_frame(frame))
+    assert client == simulator.get_state_dict()
+
+    simulator.step()  # STORE
+    apply_delta(client, decode_frame(sync.update()))
+    assert client == simulator.get_state_dict()
+
+
+def test_resync(make_simulator):
+    simulator = make_simulator(SOURCE)
+    sync = StateSync(simulator, SYNC_DELTA)
+    sync.update()
+    sync.invalidate()
+    assert 'state' in sync.update()
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        StateSync(Simulator(), 'sometimes')
+
+
+def test_state_window(make_simulator):
+    simulator = make_simulator(SOURCE)
+    sync = StateSync(simulator, window=(4, 8))
+    assert sync.update()['state']['memory'] == [0x7B, 0x52, 0x00, 0xA0]
+    sync.configure(SYNC_DELTA, ENCODING_BINARY, None)
+    assert 'memory' not in decode_frame(sync.update())
+    with pytest.raises(ValueError):
+        sync.configure(SYNC_DELTA, ENCODING_BINARY, (0x100, 0x20000))
+
+
+def test_viewports(make_simulator):
+    """Test viewports are pushed once, then only when their bytes change"""
+    simulator = make_simulator(SOURCE)
+    sync = StateSync(simulator)
+    sync.set_viewport(7, 0x3000, 0x3004)
+    frames = sync.viewport_frames()
+    assert [decode_memory_frame(frame)[:2] for frame in frames] == [(7, 0x3000)]
+    assert sync.viewport_frames() == []
+
+    simulator.write_memory(0x3002, b'\x01')
+    frame_id, address, data = decode_memory_frame(sync.viewport_frames()[0])
+    assert (frame_id, address, bytes(data)) == (7, 0x3000, b'\x00\x00\x01\x00')
+
+    sync.invalidate()
+    assert len(sync.viewport_frames()) == 1
+    assert sync.clear_viewport(7)
+    simulator.write_memory(0x3000, b'\x02')
+    assert sync.viewport_frames() == []
+
+
+def test_memory_frame_round_trip():
+    frame = encode_memory_frame(3, 0x1234, b'abc')
+    frame_id, address, data = decode_memory_frame(frame)
+    assert (frame_id, address, bytes(data)) == (3, 0x1234, b'abc')
+    with pytest.raises(ValueError):
+        decode_memory_frame(frame[:-1])
@@ -0,0 +1,101 @@
+"""
+Unit tests for time-sliced streaming runs
+"""
+
+import asyncio
+
+import pytest
+from simulator import Simulator
+from streaming import RUN_BREAKPOINT, RUN_CANCELLED, RUN_HALTED, RUN_MAX_STEPS, StreamingRun
+from tracebuf import TRACE_NONE
+
+
+COUNT_SOURCE = """
+        ADDI R3, R0, 25
+loop:   ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def run_streaming(simulator, **options):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def main():
+        run = StreamingRun(simulator, send, **options)
+        return await run.run()
+
+    return asyncio.run(main()), messages
+
+
+def test_matches_plain_run(make_simulator):
+    """Test a sliced run ends where run() does, with the same trace"""
+    expected = make_simulator(COUNT_SOURCE)
+    expected_log = expected.run(10000)
+
+    simulator = make_simulator(COUNT_SOURCE)
+    status, messages = run_streaming(simulator, slice_steps=7)
+    assert status == RUN_HALTED
+    assert messages == [{'type': 'complete', 'trace_log': expected_log}]
+    assert simulator.get_state_dict() == expected.get_state_dict()
+
+
+def test_streamed_trace_arrives_in_batches(make_simulator):
+    expected = make_simulator(COUNT_SOURCE).run(10000)
+
+    simulator = make_simulator(COUNT_SOURCE)
+    status, messages = run_streaming(simulator, stream=True, slice_steps=10, interval=0)
+    assert [m['type'] for m in messages[:-1]] == ['progress'] * (len(messages) - 1)
+    complete = messages[-1]
+    assert complete['status'] == RUN_HALTED
+    assert complete['steps'] == len(expected)
+    lines = [line for m in messages[:-1] for line in m['trace']] + complete['trace_log']
+    assert lines == expected
+
+
+def test_max_steps_and_breakpoint(make_simulator):
+    status, _ = run_streaming(make_simulator(COUNT_SOURCE), max_steps=12, trace=TRACE_NONE, slice_steps=5)
+    assert status == RUN_MAX_STEPS
+
+    simulator = make_simulator(COUNT_SOURCE)
+    simulator.breakpoints.add(0x06)
+    status, messages = run_streaming(simulator, trace=TRACE_NONE)
+    assert status == RUN_BREAKPOINT
+    assert messages[-1]['trace_log'] == ["BREAKPOINT at PC=0006"]
+
+
+def test_pause_resume_cancel(make_simulator):
+    """Test an unbounded streamed run can be paused and cancelled"""
+    simulator = make_simulator("loop: JMP loop\n")
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def main():
+        run = StreamingRun(simulator, send, max_steps=None, trace=TRACE_NONE, stream=True,
+                           slice_steps=100)
+        task = asyncio.create_task(run.run())
+        for _ in range(5):
+            await asyncio.sleep(0)
+        run.pause()
+        await asyncio.sleep(0)
+        paused_at = simulator.state.instruction_count
+        for _ in range(5):
+            await asyncio.sleep(0)
+        assert simulator.state.instruction_count == paused_at
+        run.resume()
+        run.cancel()
+        return await task
+
+    assert asyncio.run(main()) == RUN_CANCELLED
+    assert messages[-1]['status'] == RUN_CANCELLED
+
+
+def test_unbounded_needs_stream():
+    with pytest.raises(ValueError):
+        StreamingRun(Simulator(), None, max_steps=None)
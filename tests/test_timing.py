@@ -0,0 +1,101 @@
+"""
+Unit tests for the cache and pipeline timing model
+"""
+
+import pytest
+from timing import Cache, TimingModel, timing_from_dict
+
+
+LOOP_SOURCE = """
+        ADDI R3, R0, 31
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+        ADD  R3, R3, R3
+loop:   LOAD R4, R1, 0
+        ADD  R2, R2, R4
+        ADDI R1, R1, 2
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def test_cache_lru():
+    cache = Cache(size=64, associativity=2, line_size=16)
+    # lines 0, 2 and 4 share set 0
+    assert [cache.access(addr) for addr in (0, 4, 32, 0, 64, 32, 0)] == [
+        False, True, False, True, False, False, False]
+    assert (cache.hits, cache.misses) == (2, 5)
+    with pytest.raises(ValueError):
+        Cache(size=48)
+
+
+def test_penalties(make_simulator):
+    simulator = make_simulator("LOAD R1, R0, 0\nADD R2, R1, R1\nHALT")
+    simulator.enable_timing(TimingModel())
+    simulator.run(10, 'none')
+    stats = simulator.timing.stats()
+    # fetch miss + data miss + load-use bubble
+    assert simulator.state.cycle_count == stats['cycles'] == 3 + 10 + 10 + 1
+    assert stats['stalls'] == {'icache': 10, 'dcache': 10, 'load_use': 1, 'branch': 0}
+    assert stats['dcache']['miss_rate'] == 1.0
+
+
+def test_disabled_counts_one_cycle(make_simulator):
+    simulator = make_simulator(LOOP_SOURCE)
+    simulator.run(100000, 'none')
+    assert simulator.state.cycle_count == simulator.state.instruction_count
+
+
+def test_step_matches_run(make_simulator):
+    stepped = make_simulator(LOOP_SOURCE)
+    stepped.enable_timing(TimingModel())
+    while not stepped.state.halted:
+        stepped.step()
+    for trace in ('full', 'none'):
+        simulator = make_simulator(LOOP_SOURCE)
+        simulator.enable_timing(TimingModel())
+        simulator.run(100000, trace)
+        assert simulator.state.cycle_count == stepped.state.cycle_count
+        assert simulator.timing.stats() == stepped.timing.stats()
+    assert stepped.timing.cpi > 1.5
+
+
+def test_sampled_estimate(make_simulator):
+    """Test sampled runs fast-forward most instructions and stay close"""
+    detailed = make_simulator(LOOP_SOURCE)
+    detailed.enable_timing(TimingModel())
+    detailed.run(100000, 'none')
+
+    model = TimingModel(sample_interval=1000, sample_window=100, warmup=20)
+    simulator = make_simulator(LOOP_SOURCE)
+    simulator.enable_timing(model)
+    simulator.run(100000, 'none')
+    assert simulator.state.instruction_count == detailed.state.instruction_count
+    sampling = model.stats()['sampling']
+    assert sampling['fast_forwarded'] > 3 * sampling['detailed']
+    assert simulator.state.cycle_count == pytest.approx(detailed.state.cycle_count, rel=0.02)
+
+
+def test_from_dict():
+    model = timing_from_dict({'icache': {'size': 256, 'line_size': 8}, 'branch_penalty': 3,
+                              'sample_interval': 1000, 'sample_window': 100, 'ignored': 1})
+    assert (model.icache.size, model.icache.line_size, model.dcache.size) == (256, 8, 1024)
+    assert (model.branch_penalty, model.sample_interval) == (3, 1000)
+    with pytest.raises(ValueError):
+        timing_from_dict({'sample_interval': 10, 'sample_window': 20})
+
+
+def test_from_dict_rejects_unbounded_settings():
+    for data in ({'icache': {'size': 2 ** 34}}, {'dcache': {'size': 1024, 'line_size': 2 ** 20}},
+                 {'icache': {'associativity': 1.5}}, {'icache': 'big'},
+                 {'miss_penalty': -1}, {'branch_penalty': '2'}, {'sample_interval': 1e9}):
+        with pytest.raises(ValueError):
+            timing_from_dict(data)
+    assert timing_from_dict({'icache': {'size': 0x10000}}).icache.size == 0x10000
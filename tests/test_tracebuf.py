@@ -0,0 +1,84 @@
+"""
+Unit tests for trace buffers and run() trace modes
+"""
+
+import pytest
+from tracebuf import MAX_TRACE_ENTRIES, TRACE_FULL, TRACE_NONE, TraceBuffer, check_trace_mode
+
+
+LOOP_SOURCE = """
+        ADDI R3, R0, 4
+loop:   ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+def test_ring_buffer_keeps_newest():
+    """Test a bounded buffer keeps only the newest records"""
+    buffer = TraceBuffer(3)
+    for i in range(5):
+        buffer.record(i * 2, 0x0000, False, i)
+    assert len(buffer) == 3
+    assert buffer.dropped == 2
+    assert [pc for pc, _, _, _ in buffer.records()] == [4, 6, 8]
+    assert [cycle for _, _, _, cycle in buffer.records(last=2)] == [3, 4]
+
+
+def test_lines_format_brz():
+    """Test BRZ text uses the recorded zero flag"""
+    buffer = TraceBuffer()
+    buffer.record(0x10, 0x9004, True, 0)
+    buffer.record(0x12, 0x9004, False, 1)
+    assert buffer.lines() == [
+        "PC=0010 I=9004 BRZ (taken) +4",
+        "PC=0012 I=9004 BRZ (not taken) +4",
+    ]
+
+
+def test_run_trace_modes(make_simulator):
+    """Test full, last-N and no-trace runs end in the same state"""
+    full = make_simulator(LOOP_SOURCE)
+    full_log = full.run(1000)
+
+    last = make_simulator(LOOP_SOURCE)
+    assert last.run(1000, 5) == full_log[-5:]
+
+    quiet = make_simulator(LOOP_SOURCE)
+    assert quiet.run(1000, TRACE_NONE) == []
+    assert quiet.trace_lines() == []
+    assert quiet.get_state_dict() == full.get_state_dict()
+    assert full.trace_lines(last=1) == ["PC=0008 I=A000 HALT"]
+
+
+def test_run_breakpoint_note(make_simulator):
+    """Test the breakpoint note is reported without a trace"""
+    simulator = make_simulator(LOOP_SOURCE)
+    simulator.breakpoints.add(0x08)
+    assert simulator.run(1000, TRACE_NONE) == ["BREAKPOINT at PC=0008"]
+
+
+def test_invalid_trace_mode(make_simulator):
+    """Test unknown trace modes are rejected"""
+    with pytest.raises(ValueError):
+        make_simulator(LOOP_SOURCE).run(10, "verbose")
+
+
+def test_check_trace_mode():
+    """Test client trace modes are validated and entry counts clamped"""
+    assert check_trace_mode(TRACE_FULL) == TRACE_FULL
+    assert check_trace_mode(TRACE_NONE) == TRACE_NONE
+    assert check_trace_mode(50) == 50
+    assert check_trace_mode(10 ** 12) == MAX_TRACE_ENTRIES
+    for bad in (0, -5, "verbose", True, 2.5, None, [1]):
+        with pytest.raises(ValueError):
+            check_trace_mode(bad)
+
+
+def test_run_off_end_of_memory(make_simulator):
+    """Test the last record of a program without HALT keeps PC 0x10000"""
+    simulator = make_simulator("ADDI R1, R0, 1")
+    log = simulator.run(40000)
+    assert len(log) == 32769
+    assert log[-1] == "PC=10000 I=0000 NOP"
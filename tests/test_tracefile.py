@@ -0,0 +1,130 @@
+"""
+Unit tests for trace files written while running and read through mmap
+"""
+
+import json
+
+import pytest
+from cli import main
+from tracefile import (NO_REGISTER, OPCODES, TraceReader, TraceWriter, record_run)
+
+
+STORE_LOOP_SOURCE = """
+        ADDI R3, R0, 20
+        ADDI R1, R0, 30
+loop:   STORE R3, R1, 2
+        LOAD R1, R1, 0
+        ADDI R1, R0, 30
+        ADDI R3, R3, -1
+        BRZ  done
+        JMP  loop
+done:   HALT
+"""
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_text_trace_reproduced(tmp_path, compress, make_simulator):
+    expected = make_simulator(STORE_LOOP_SOURCE).run(10000)
+    path = str(tmp_path / "run.trace")
+    note, writer = record_run(make_simulator(STORE_LOOP_SOURCE), path, 10000, chunk_records=16, compress=compress)
+    assert note is None
+    with TraceReader(path) as reader:
+        assert reader.complete
+        assert reader.compressed == compress
+        assert len(reader) == writer.total == len(expected)
+        assert len(reader.chunks) > 1
+        assert list(reader.lines()) == expected
+        assert list(reader.lines(5, 9)) == expected[5:9]
+        assert reader.record(-1).line() == expected[-1]
+
+
+def test_filter_stores_in_range(tmp_path, make_simulator):
+    path = str(tmp_path / "run.trace")
+    record_run(make_simulator(STORE_LOOP_SOURCE), path, 10000, chunk_records=8)
+    with TraceReader(path) as reader:
+        stores = list(reader.filter([OPCODES['store']], address=(0x20, 0x21)))
+        assert [record.mem for record in stores] == list(range(20, 0, -1))
+        assert all(record.rd == NO_REGISTER for record in stores)
+        assert list(reader.filter([OPCODES['store']], address=(0x100, 0x200))) == []
+        # Chunks without a STORE are skipped by their opcode mask
+        assert [r.index for r in reader.filter(pc=4)] == [r.index for r in stores]
+
+
+def test_load_into_base_register(tmp_path, make_simulator):
+    # LOAD R1, R1, 0 reads address 30 although R1 is overwritten by it
+    path = str(tmp_path / "run.trace")
+    record_run(make_simulator(STORE_LOOP_SOURCE), path, 10000)
+    with TraceReader(path) as reader:
+        loads = list(reader.filter([OPCODES['load']]))
+        assert len(loads) == 20
+        assert all(record.addr == 30 and record.rd == 1 for record in loads)
+
+
+def test_register_and_flag_columns(tmp_path, make_simulator):
+    path = str(tmp_path / "run.trace")
+    record_run(make_simulator("ADDI R2, R0, 7\nSUB R2, R2, R2\nHALT\n"), path, 100)
+    with TraceReader(path) as reader:
+        first, second, halt = reader.records()
+    assert (first.rd, first.value, first.flags) == (2, 7, 0)
+    assert (second.rd, second.value, second.flags & 1) == (2, 0, 1)
+    assert halt.opcode == OPCODES['halt']
+
+
+def test_run_off_end_of_memory(tmp_path, make_simulator):
+    # Without HALT the run ends by reaching PC 0x10000
+    path = str(tmp_path / "run.trace")
+    simulator = make_simulator("ADDI R1, R0, 1\n")
+    record_run(simulator, path, 40000, chunk_records=4096)
+    with TraceReader(path) as reader:
+        assert reader.complete
+        assert len(reader) == 32769
+        assert reader.record(0).line() == "PC=0000 I=5201 ADDI R1, R0, 1"
+        assert reader.record(-1).pc == 0x10000
+
+
+def test_failed_run_leaves_unfinished_file(tmp_path, make_simulator):
+    path = str(tmp_path / "run.trace")
+    simulator = make_simulator(STORE_LOOP_SOURCE)
+    with pytest.raises(RuntimeError):
+        with TraceWriter(path, simulator.state, chunk_records=10) as writer:
+            simulator.execute(25, writer)
+            raise RuntimeError("run failed")
+    with TraceReader(path) as reader:
+        assert not reader.complete
+        assert list(reader.lines()) == make_simulator(STORE_LOOP_SOURCE).run(25)
+
+
+def test_unfinished_file_readable(tmp_path, make_simulator):
+    path = str(tmp_path / "run.trace")
+    simulator = make_simulator(STORE_LOOP_SOURCE)
+    writer = TraceWriter(path, simulator.state, chunk_records=10)
+    simulator.execute(35, writer)
+    writer.file.flush()
+    with TraceReader(path) as reader:
+        assert not reader.complete
+        # The 5 records still buffered were never written
+        assert len(reader) == 30
+    writer.close()
+    with TraceReader(path) as reader:
+        assert reader.complete
+        assert len(reader) == 35
+
+
+def test_bad_file(tmp_path):
+    path = tmp_path / "bad.trace"
+    path.write_bytes(b"NOPE" + bytes(60))
+    with pytest.raises(ValueError):
+        TraceReader(str(path))
+
+
+def test_cli_trace_and_inspect(tmp_path, capsys):
+    program = tmp_path / "loop.asm"
+    program.write_text(STORE_LOOP_SOURCE)
+    output = str(tmp_path / "loop.trace")
+    assert main(["trace", str(program), "-o", output, "--compress"]) == 0
+    assert "halted" in capsys.readouterr().out
+
+    assert main(["inspect", output, "--op", "STORE", "--address", "0x20", "--json",
+                 "--limit", "3"]) == 0
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [record["mem"] for record in records] == [20, 19, 18]
@@ -0,0 +1,93 @@
+"""
+Unit tests for breakpoints and memory watchpoints
+"""
+
+import pytest
+from simulator import Simulator
+from tracebuf import TRACE_NONE
+from watch import WATCH_CHANGE, WATCH_READ, WATCH_WRITE
+
+
+# Stores 5, 5, 4 to 0x18 then reads it back
+STORE_SOURCE = """
+        ADDI R1, R0, 5
+        STORE R1, R0, 24
+        STORE R1, R0, 24
+        ADDI R1, R1, -1
+        STORE R1, R0, 24
+        LOAD R2, R0, 24
+        HALT
+"""
+
+
+@pytest.mark.parametrize("kind, stops", [
+    (WATCH_WRITE, [0x02, 0x04, 0x08]),
+    (WATCH_CHANGE, [0x08]),
+    (WATCH_READ, [0x0A]),
+])
+def test_watchpoint_kinds(kind, stops, make_simulator):
+    """Test each kind stops right after the access that triggers it"""
+    simulator = make_simulator(STORE_SOURCE)
+    simulator.state.memory[0x18] = 5
+    watch = simulator.watchpoints.add(0x18, 0x1A, kind)
+    seen = []
+    while not simulator.state.halted:
+        log = simulator.run(100, TRACE_NONE)
+        if log and log[-1].startswith("WATCHPOINT"):
+            hit = simulator.watchpoints.take_hit()
+            assert hit['id'] == watch.id
+            assert log[-1] == f"WATCHPOINT {kind} at ADDR=0018 PC={hit['pc']:04X}"
+            assert simulator.state.pc == hit['pc'] + 2
+            seen.append(hit['pc'])
+    assert seen == stops
+
+
+def test_watchpoint_with_trace_and_step(make_simulator):
+    simulator = make_simulator(STORE_SOURCE)
+    simulator.state.memory[0x18] = 5
+    simulator.watchpoints.add(0x19, 0x20, WATCH_CHANGE)
+    log = simulator.run(100)
+    assert log[-1] == "WATCHPOINT change at ADDR=0018 PC=0008"
+    assert len(log) == 6
+
+    simulator = make_simulator(STORE_SOURCE)
+    simulator.state.memory[0x18] = 5
+    simulator.watchpoints.add(0x18, 0x1A, WATCH_READ)
+    for _ in range(5):
+        simulator.step()
+        assert simulator.watchpoints.take_hit() is None
+    simulator.step()
+    assert simulator.watchpoints.take_hit()['new'] == 4
+
+
+def test_unwatched_page_is_ignored(make_simulator):
+    simulator = make_simulator(STORE_SOURCE)
+    simulator.state.memory[0x18] = 5
+    simulator.watchpoints.add(0x100, 0x102, WATCH_WRITE)
+    assert simulator.run(100, TRACE_NONE) == []
+    assert simulator.state.halted
+
+
+def test_remove_and_validate():
+    simulator = Simulator()
+    watch = simulator.watchpoints.add(0, 2)
+    assert simulator.watchpoints.remove(watch.id)
+    assert not simulator.watchpoints.remove(watch.id)
+    assert not any(simulator.watchpoints.pages)
+    with pytest.raises(ValueError):
+        simulator.watchpoints.add(4, 2)
+    with pytest.raises(ValueError):
+        simulator.watchpoints.add(0, 2, 'execute')
+
+
+def test_breakpoint_set(make_simulator):
+    """Test breakpoints stop every loop variant and reset clears them"""
+    for trace in ('full', TRACE_NONE):
+        simulator = make_simulator(STORE_SOURCE)
+        simulator.state.memory[0x18] = 5
+        simulator.breakpoints.add(0x06)
+        log = simulator.run(100, trace)
+        assert log[-1] == "BREAKPOINT at PC=0006"
+        assert simulator.state.instruction_count == 3
+    simulator.reset()
+    assert not simulator.breakpoints
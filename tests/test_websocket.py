@@ -0,0 +1,128 @@
+"""
+Unit tests for validation of /ws/simulate messages
+"""
+
+import importlib.util
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from history import MAX_JOURNAL_BYTES
+
+# Loaded by path: the repository root has a main.py of its own
+_spec = importlib.util.spec_from_file_location(
+    "backend_main", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 "backend", "main.py"))
+main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(main)
+
+
+@pytest.fixture
+def ws():
+    with TestClient(main.app) as client:
+        with client.websocket_connect("/ws/simulate") as websocket:
+            session = websocket.receive_json()
+            assert session["type"] == "session"
+            websocket.session = main.session_manager.get(session["id"])
+            yield websocket
+
+
+def test_history_limits_clamped(ws):
+    ws.send_json({"action": "history", "max_bytes": 2 ** 40, "max_checkpoints": 10 ** 9})
+    assert ws.receive_json() == {"type": "history", "enabled": True}
+    assert ws.session.simulator.history.max_journal_bytes == MAX_JOURNAL_BYTES
+
+
+@pytest.mark.parametrize("message", [{"max_bytes": "big"}, {"max_bytes": -1},
+                                     {"max_checkpoints": 2.5}])
+def test_history_rejects_bad_limits(ws, message):
+    ws.send_json({"action": "history", **message})
+    assert ws.receive_json()["type"] == "error"
+    # The connection stays usable
+    ws.send_json({"action": "history", "enabled": False})
+    assert ws.receive_json() == {"type": "history", "enabled": False}
+
+
+@pytest.mark.parametrize("priority", ["high", None, [2]])
+def test_run_rejects_bad_priority(ws, priority):
+    ws.send_json({"action": "run", "max_steps": 10, "priority": priority})
+    assert ws.receive_json()["type"] == "error"
+    assert not ws.session.running()
+    ws.send_json({"action": "history", "enabled": False})
+    assert ws.receive_json()["type"] == "history"
+
+
+@pytest.mark.parametrize("message", [
+    {"action": "step", "count": 5, "trace": 0},
+    {"action": "step", "count": 5, "trace": "verbose"},
+    {"action": "run", "trace": -1},
+    {"action": "run", "trace": "lots"},
+    {"action": "run", "max_steps": None},
+    {"action": "trace", "last": "all"},
+])
+def test_bad_trace_settings_get_error_reply(ws, message):
+    ws.send_json(message)
+    assert ws.receive_json()["type"] == "error"
+    ws.send_json({"action": "step", "count": 2, "trace": 1})
+    reply = ws.receive_json()
+    assert reply["type"] == "state" and reply["steps"] == 2
+
+
+@pytest.mark.parametrize("message", [
+    {"action": "set_breakpoint", "address": [1]},
+    {"action": "set_breakpoint", "address": 0x10000},
+    {"action": "set_breakpoint"},
+    {"action": "clear_breakpoint", "address": [1]},
+    {"action": "set_watchpoint", "start": "1"},
+    {"action": "set_watchpoint", "start": 4, "end": "8"},
+    {"action": "clear_watchpoint", "id": [1]},
+])
+def test_bad_breakpoints_and_watchpoints_get_error_reply(ws, message):
+    ws.send_json(message)
+    assert ws.receive_json()["type"] == "error"
+    ws.send_json({"action": "set_breakpoint", "address": 4})
+    assert ws.receive_json() == {"type": "breakpoint_set", "address": 4}
+
+
+@pytest.mark.parametrize("message", [
+    {"action": "step_back", "count": "1"},
+    {"action": "step_back", "count": -1},
+    {"action": "restore", "id": [1]},
+    {"action": "restore", "id": 99},
+])
+def test_bad_history_requests_get_error_reply(ws, message):
+    ws.send_json({"action": "history"})
+    assert ws.receive_json()["type"] == "history"
+    ws.send_json(message)
+    assert ws.receive_json()["type"] == "error"
+    ws.send_json({"action": "step_back", "count": 0})
+    reply = ws.receive_json()
+    assert reply["type"] == "state" and reply["steps"] == 0
+
+
+@pytest.mark.parametrize("message", [
+    {"action": "read_memory", "id": "x", "start": 0, "length": 4},
+    {"action": "read_memory", "id": 0x10000},
+    {"action": "read_memory", "start": "0"},
+    {"action": "read_memory", "start": 0xFFFE, "length": 4},
+    {"action": "viewport", "start": "x"},
+    {"action": "clear_viewport", "id": [1]},
+])
+def test_bad_memory_requests_get_error_reply(ws, message):
+    # The error is the only reply: no header goes out first
+    ws.send_json(message)
+    assert ws.receive_json()["type"] == "error"
+    ws.send_json({"action": "read_memory", "id": 7, "start": 0, "length": 2})
+    assert ws.receive_json() == {"type": "memory", "id": 7, "start": 0, "length": 2}
+    assert len(ws.receive_bytes()) > 2
+
+
+@pytest.mark.parametrize("message", [{"top": "x"}, {"top": -1}, {"start_address": "0"},
+                                     {"start_address": 1.5}])
+def test_bad_profile_request_gets_error_reply(ws, message):
+    ws.send_json({"action": "profile", "enabled": True, **message})
+    assert ws.receive_json()["type"] == "error"
+    assert ws.session.simulator.profiler is None
+    ws.send_json({"action": "profile", "enabled": True, "top": 3})
+    reply = ws.receive_json()
+    assert reply["type"] == "profile" and reply["enabled"]